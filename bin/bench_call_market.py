@@ -0,0 +1,190 @@
+#!python
+"""
+Benchmark the call market pipeline on synthetic order books.
+
+Each group is filled with bids and offers clustered around the last period price, and every stage
+of the market calculation is timed separately:
+    load            CallMarket(group) - get_player_records and get_orders_for_group
+    market_price    CallMarket.get_market_price
+    fill_orders     OrderFill.fill_orders
+    positions       CallMarket.compute_positions
+    final_updates   CallMarket.final_updates, including the flush to the database
+
+The database is an in-memory sqlite database, so the project database is never touched.
+Run from the project root:
+    python bin/bench_call_market.py --sizes 10 1000 100000 --repeat 5 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from statistics import median
+
+ROOT = Path(__file__).resolve().parent.parent
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+os.environ['OTREE_IN_MEMORY'] = '1'
+
+import numpy as np
+from otree import database
+from otree.database import db
+from otree.models import Session, Participant
+
+from rounds.call_market import CallMarket
+from rounds.models import Player, Group, Subsession, Order, OrderType
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+STAGES = ['load', 'market_price', 'fill_orders', 'positions', 'final_updates']
+LAST_PRICE = 14.0
+
+BENCH_CONFIG = dict(name='bench',
+                    interest_rate=0.05,
+                    div_amount='0.40 1.00',
+                    div_dist='.5 .5',
+                    margin_ratio=.5,
+                    margin_premium=0.1,
+                    margin_target_ratio=.6,
+                    initial_price=LAST_PRICE)
+
+
+def synthetic_orders(rng, num_orders, num_players, last_price=LAST_PRICE, spread=.1):
+    """
+    Generate bids and offers with prices clustered around the last price.
+    @return: list of (player index, order type, price, quantity)
+    """
+    sd = last_price * spread
+    orders = []
+    for _ in range(num_orders):
+        order_type = rng.choice([OrderType.BID.value, OrderType.OFFER.value])
+        # bids lean slightly below the last price and offers slightly above
+        center = last_price - sd / 2 if order_type == OrderType.BID.value else last_price + sd / 2
+        price = max(round(rng.gauss(center, sd), 2), .01)
+        orders.append((rng.randrange(num_players), order_type, price, rng.randint(1, 10)))
+    return orders
+
+
+def setup_group(code, num_orders, num_players, rng):
+    """
+    Create a session with one group, its players and the synthetic orders.
+    @return: the Group
+    """
+    session = Session(code=code, config=dict(BENCH_CONFIG))
+    db.add(session)
+    subsession = Subsession(session=session, round_number=1)
+    group = Group(session=session, subsession=subsession, round_number=1, id_in_subsession=1)
+    db.add(subsession)
+    db.add(group)
+
+    players = []
+    for i in range(num_players):
+        part = Participant(session=session, code=f'{code}_{i}', id_in_session=i + 1)
+        player = Player(session=session, subsession=subsession, group=group, participant=part,
+                        id_in_group=i + 1, round_number=1, cash=1000, shares=10)
+        db.add(part)
+        db.add(player)
+        players.append(player)
+    db._db.flush()
+
+    rows = [dict(player_id=players[p].id, group_id=group.id, order_type=t, price=str(price), quantity=q,
+                 quantity_final=0, is_buy_in=False)
+            for p, t, price, q in synthetic_orders(rng, num_orders, num_players)]
+    db._db.execute(Order.__table__.insert(), rows)
+    db.commit()
+    return group
+
+
+def time_stages(group_id):
+    """
+    Run the market for the group once, timing each stage, then roll back the results.
+    @return: dict of stage name to seconds
+    """
+    timings = {}
+    db._db.expunge_all()
+    group = db._db.query(Group).get(group_id)
+
+    t = time.perf_counter()
+    cm = CallMarket(group)
+    timings['load'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    market_price, market_volume = cm.get_market_price()
+    timings['market_price'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    cm.fill_orders(market_price)
+    timings['fill_orders'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    cm.compute_positions(market_price)
+    timings['positions'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    cm.final_updates(market_price, market_volume)
+    db._db.flush()
+    timings['final_updates'] = time.perf_counter() - t
+
+    db._db.rollback()
+    return timings
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat, seed):
+    database.init_orm()
+    db.new_session()
+    rng = random.Random(seed)
+
+    results = []
+    for size in sizes:
+        num_players = max(2, min(size // 5, 500))
+        group = setup_group(f'bench{size}', size, num_players, rng)
+        group_id = group.id
+
+        runs = [time_stages(group_id) for _ in range(repeat)]
+        stages = {s: dict(min=min(r[s] for r in runs),
+                          median=median(r[s] for r in runs),
+                          max=max(r[s] for r in runs))
+                  for s in STAGES}
+        total = median(sum(r.values()) for r in runs)
+        results.append(dict(num_orders=size, num_players=num_players, repeat=repeat,
+                            total_median=total, stages=stages))
+        print(f"{size:>8} orders {num_players:>4} players  total {total * 1000:10.2f} ms  " +
+              "  ".join(f"{s} {stages[s]['median'] * 1000:.2f}" for s in STAGES))
+
+    return dict(commit=get_commit(),
+                created=datetime.now().isoformat(timespec='seconds'),
+                python=platform.python_version(),
+                numpy=np.__version__,
+                seed=seed,
+                unit='seconds',
+                results=results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='orders per group')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per size')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='bench_results.json', help='JSON file for the results')
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.repeat, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!python
+"""
+Sweep session config overrides over the headless market simulation (see bots/sweep.py).
+
+The grid is a JSON file of config keys to lists of values, and/or --set options with comma separated values:
+    {"interest_rate": [0.04, 0.05], "div_amount": ["0.40 1.00", "0.20 1.20"], "gamma_hi": [0.004, 0.01]}
+
+Run from the project root:
+    python bin/sweep_sims.py --grid grid.json --set margin_ratio=.4,.5 --seeds 20 --agents 300 --rounds 50
+The summary and the price paths are written to <output>_summary and <output>_paths, as parquet if a parquet
+engine is installed and otherwise as CSV.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+from bots.sweep import run_sweep, write_table
+
+
+def parse_value(raw):
+    for parse in (json.loads, float):
+        try:
+            return parse(raw)
+        except ValueError:
+            pass
+    return raw
+
+
+def parse_set(option):
+    key, _, values = option.partition('=')
+    return key, [parse_value(v) for v in values.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--grid', help='JSON file of config keys to lists of values')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=V1,V2', help='values of one config key')
+    parser.add_argument('--session', default='sim_1', help='the session config the overrides apply to')
+    parser.add_argument('--seeds', type=int, default=10, help='runs per point')
+    parser.add_argument('--seed', type=int, default=0, help='the first seed')
+    parser.add_argument('--agents', type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=None, help='processes; defaults to the number of CPUs')
+    parser.add_argument('--output', default='sweep', help='prefix of the output files')
+    args = parser.parse_args()
+
+    grid = {}
+    if args.grid:
+        with open(args.grid) as f:
+            grid.update(json.load(f))
+    grid.update(parse_set(option) for option in args.set)
+
+    t = time.perf_counter()
+    summary, paths = run_sweep(grid, args.seeds, args.agents, args.rounds, session_name=args.session,
+                               base_seed=args.seed, max_workers=args.workers)
+    print(f"{len(summary)} runs in {time.perf_counter() - t:.1f} s")
+
+    print(f"Summary written to {write_table(summary, args.output + '_summary')}")
+    print(f"Price paths written to {write_table(paths, args.output + '_paths')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,130 +1,76 @@
-import random
-from abc import abstractmethod, ABCMeta
-
+import numpy as np
 from otree.api import Submission
 from otree.bots import Bot
 
 import common.SessionConfigFunctions as scf
 import rounds
-from rounds import Market, RoundResultsPage, Player, Group, OrderType
-from rounds.call_market_price import MarketPrice
+from rounds import Market, RoundResultsPage, Group, OrderType
+from rounds.clearing import CENTS, get_market_price
 from rounds.data_structs import DataForOrder
-
-# Parameters for Feedback investors
-BETA_LO = 0.001
-BETA_HI = 0.02
-DELTA_LO = 0
-DELTA_HI = 2
-
-# Parameters for Passive investors
-ALPHA_LO = 0.001
-ALPHA_HI = 0.02
-
-# Parameters for Speculators
-GAMMA_LO = 0.001
-GAMMA_HI = .004
-
-# Aggression is used to determine how individual players set the price.
-AGG_LO = 0.0
-AGG_HI = 0.15
-
-
-class OrderMaker:
-    FUNDAMENTAL_VALUE = -1
-    PRICE_HISTORY = []
-
-    __metaclass__ = ABCMeta
-    _aggression = -1
-    _player = None
-
-    def __init__(self, player: Player):
-        self._aggression = random.uniform(AGG_LO, AGG_HI)
-        self._part_code = player.participant.code
-
-    def __str__(self):
-        return f"{self.kind()}:  Participant {self._part_code}"
-
-    @abstractmethod
-    def get_demand(self, expected_price):
-        pass
-
-    @abstractmethod
-    def kind(self):
-        pass
-
-    def get_price(self, base_price, direction):
-        return int(base_price * (1 + direction * self._aggression))
-
-
-class FeedbackOrder(OrderMaker):
-    def __init__(self, player: Player):
-        super().__init__(player)
-        self._delta = random.uniform(DELTA_LO, DELTA_HI)
-        self._beta = random.uniform(BETA_LO, BETA_HI)
-
-    def get_demand(self, expected_price):
-        # Feedback players will sit out the first round
-        if len(OrderMaker.PRICE_HISTORY) < 2:
-            return 0
-
-        price_change = OrderMaker.PRICE_HISTORY[-1] - OrderMaker.PRICE_HISTORY[-2]
-        return round(-1 * self._delta + self._beta * price_change)
-
-    def kind(self):
-        return "FEEDBACK"
-
-
-class PassiveOrder(OrderMaker):
-    def __init__(self, player: Player):
-        super().__init__(player)
-        self._alpha = random.uniform(ALPHA_LO, ALPHA_HI)
+from bots import simulator
+from bots.simulator import KINDS
+
+# Agent state of the simulated sessions, by session code.  Keeping it per session lets several sim_1
+# sessions run in one process without sharing price histories or agents.  A session's state is dropped
+# once the orders of its last round are placed.
+SESSIONS = {}
+
+
+class SessionAgents:
+    """
+    The agents of one simulated session.  Their parameters are held in arrays (simulator.Agents); each
+    participant is an index into them.
+    """
+
+    def __init__(self, fundamental_value, init_price, seed=None):
+        self.fundamental_value = float(fundamental_value)
+        self.prices = [float(init_price)]
+        self.known_through = 0
+        self.rng = np.random.default_rng(seed)
+        self.agents = None
+        self.idx_by_participant = {}
+
+    def assign_types(self, participant_codes):
+        """
+        Draw the parameters of an agent for each participant.  The kinds follow simulator.AGENT_MIX.
+        """
+        self.agents = simulator.make_agents(len(participant_codes), self.rng)
+        self.idx_by_participant = {code: i for i, code in enumerate(participant_codes)}
+
+    def record_price(self, round_number, price):
+        """
+        Add the market price of a round to the history.  A round is only added once.
+        """
+        if round_number > self.known_through:
+            self.prices.append(int(price))
+            self.known_through = round_number
 
     def get_demand(self, expected_price):
-        price_diff = OrderMaker.PRICE_HISTORY[-1] - OrderMaker.FUNDAMENTAL_VALUE
-        return -1 * round(self._alpha * price_diff)
-
-    def kind(self):
-        return "PASSIVE"
-
-
-SPECULATING = -99
-
-
-class SpeculativeOrder(OrderMaker):
-    def __init__(self, player: Player):
-        super().__init__(player)
-        self._gamma = random.uniform(GAMMA_LO, GAMMA_HI)
-        self._delta = random.uniform(DELTA_LO, DELTA_HI)
+        return simulator.get_demand(self.agents, self.prices, self.fundamental_value, expected_price)
 
-    def get_demand(self, expected_price):
-        if expected_price == SPECULATING:
-            return 0
+    def describe(self, idx, participant_code):
+        return f"{KINDS[self.agents.kind[idx]]}:  Participant {participant_code}"
 
-        curr_price = OrderMaker.PRICE_HISTORY[-1]
-        return round(self._delta + self._gamma * (expected_price - curr_price))
 
-    def kind(self):
-        return "SPECULATOR"
+def get_session_agents(obj):
+    """
+    Get the agent state of the session of a player or group, creating it the first time.
+    """
+    code = obj.session.code
+    state = SESSIONS.get(code)
+    if state is None:
+        state = SessionAgents(scf.get_fundamental_value(obj), scf.get_init_price(obj))
+        SESSIONS[code] = state
+    return state
 
 
 class SimulationBot(Bot):
-    FIRST_TIME = True
-    O_MAKER_BY_PARTICIPANT = {}
-    ORDER_TYPE_CLASSES = [FeedbackOrder, FeedbackOrder, PassiveOrder, SpeculativeOrder, SpeculativeOrder, SpeculativeOrder]
-
-    def init_test(self):
-        OrderMaker.FUNDAMENTAL_VALUE = scf.get_fundamental_value(self.player)
-        OrderMaker.PRICE_HISTORY.append(scf.get_init_price(self.player))
 
     def play_round(self):
         player = self.player
         round_number = player.round_number
 
-        # Looks like execution gets here one time before calling the live methods.
-        # So, we can initialize some things like fundamental value
-        if SimulationBot.FIRST_TIME:
-            self.init_test()
-            SimulationBot.FIRST_TIME = False
+        get_session_agents(player)
         self.player.forecast_error = 0
         self.player.forecast_reward = 0
 
@@ -134,68 +80,66 @@ class SimulationBot(Bot):
             yield RoundResultsPage
 
 
-def assign_types(group: Group):
-    for i, player in enumerate(group.get_players()):
-        idx = i % len(SimulationBot.ORDER_TYPE_CLASSES)
-        SimulationBot.O_MAKER_BY_PARTICIPANT[player.participant.code] = SimulationBot.ORDER_TYPE_CLASSES[idx](player)
-
-
 def call_live_method(method, **kwargs):
     round_number = kwargs.get('round_number')
     group: Group = kwargs.get('group')
-    last_price = OrderMaker.PRICE_HISTORY[-1]
+    state = get_session_agents(group)
 
     print("================")
     print(f"==  ROUND: {round_number}")
     print("================")
 
     # Assign Types
-    if round_number == 1:
-        assign_types(group)
+    if state.agents is None:
+        state.assign_types([p.participant.code for p in group.get_players()])
 
     # Update price history
     prev_group = group.in_round_or_none(round_number - 1)
     if prev_group:
-        OrderMaker.PRICE_HISTORY.append(int(prev_group.price))
-    print("Price History:", OrderMaker.PRICE_HISTORY)
+        state.record_price(round_number - 1, prev_group.price)
+    print("Price History:", state.prices)
+    last_price = state.prices[-1]
 
     # Get the expected price for the speculators
-    exp_bids, exp_offers = get_orders(group, OrderMaker.FUNDAMENTAL_VALUE, last_price)
-    mp = MarketPrice(exp_bids, exp_offers)
-    expected_price, _ = mp.get_market_price(last_price=last_price)
+    exp_bids, exp_offers = get_orders(group, state, state.fundamental_value, last_price)
+    expected_price, _ = get_market_price(exp_bids, exp_offers, last_price)
     print("Expected Value:", expected_price)
 
     # Place orders for all players
-    bids, offers = get_orders(group, expected_price, last_price)
+    bids, offers = get_orders(group, state, expected_price, last_price)
     # calling update on the data objects will create the orders
     for o in bids + offers:
         o.update_order()
 
+    if round_number == rounds.Constants.num_rounds:
+        SESSIONS.pop(group.session.code, None)
+
 
-def get_orders(group, expected_price, last_price):
+def get_orders(group, state, expected_price, last_price):
     bids = []
     offers = []
 
-    for p in group.get_players():
-        participant = p.participant
-        order_maker = SimulationBot.O_MAKER_BY_PARTICIPANT.get(participant.code)
-
-        demand = order_maker.get_demand(expected_price)
-
-        if demand != 0:
-            o_type = OrderType.OFFER if demand < 0 else OrderType.BID
-
-            price = order_maker.get_price(last_price, o_type.value * -1)
-            d4o = DataForOrder(player=p,
-                               group=group,
-                               order_type=o_type.value,
-                               price=price,
-                               quantity=abs(demand),
-                               )
-            if o_type == OrderType.OFFER:
-                offers.append(d4o)
-            else:
-                bids.append(d4o)
-
-            print(f"{order_maker}: Demand: {demand}, Price: {price}")
+    players = group.get_players()
+    idx = np.fromiter((state.idx_by_participant[p.participant.code] for p in players), dtype=np.int64,
+                      count=len(players))
+    demand = np.zeros(len(state.agents.kind), dtype=np.int64)
+    demand[idx] = state.get_demand(expected_price)[idx]
+    order_idx, is_bid, prices, quants = simulator.get_orders(state.agents, demand, last_price)
+    player_by_idx = dict(zip(idx, players))
+
+    for i, bid, price, quant in zip(order_idx, is_bid, prices, quants):
+        p = player_by_idx[i]
+        o_type = OrderType.BID if bid else OrderType.OFFER
+        d4o = DataForOrder(player=p,
+                           group=group,
+                           order_type=o_type.value,
+                           price=int(price) // CENTS,
+                           quantity=int(quant),
+                           )
+        if o_type == OrderType.OFFER:
+            offers.append(d4o)
+        else:
+            bids.append(d4o)
+
+        print(f"{state.describe(i, p.participant.code)}: Demand: {demand[i]}, Price: {d4o.price}")
     return bids, offers
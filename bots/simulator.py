@@ -0,0 +1,323 @@
+"""
+Headless market simulation with the agents of the sim_1 bots.
+
+The agents are the feedback, passive and speculative investors of the sim_1 bots (bots/sim_bot.py) and
+the market is run with the packed-array kernels of the rounds app: clearing.clear for the price,
+clearing.fill for the fills, positions.margin_calls for the margin call stage and positions.compute_positions
+for the new positions.  Everything is held in numpy arrays, so there is no database, no oTree session and no
+page submissions.
+
+    sim = Simulation(get_session_config(interest_rate=.04), num_agents=3000, seed=1)
+    result = sim.run(200)
+"""
+from collections import namedtuple
+from typing import NamedTuple
+
+import numpy as np
+
+import common.SessionConfigFunctions as scf
+from rounds import clearing, positions
+from rounds.models import NO_AUTO_TRANS
+
+# Parameters for Feedback investors
+BETA_LO = 0.001
+BETA_HI = 0.02
+DELTA_LO = 0
+DELTA_HI = 2
+
+# Parameters for Passive investors
+ALPHA_LO = 0.001
+ALPHA_HI = 0.02
+
+# Parameters for Speculators
+GAMMA_LO = 0.001
+GAMMA_HI = .004
+
+# Aggression is used to determine how individual players set the price.
+AGG_LO = 0.0
+AGG_HI = 0.15
+
+SPECULATING = -99
+
+FEEDBACK = 0
+PASSIVE = 1
+SPECULATOR = 2
+KINDS = ('FEEDBACK', 'PASSIVE', 'SPECULATOR')
+
+# The agents are assigned in this pattern: two feedback investors, a passive investor and three speculators
+AGENT_MIX = (FEEDBACK, FEEDBACK, PASSIVE, SPECULATOR, SPECULATOR, SPECULATOR)
+
+# Upper bound on the margin call iterations, as in CallMarket
+MAX_MARGIN_CALL_ITERATIONS = 10
+
+SimResult = namedtuple('SimResult', ['prices', 'volumes', 'dividends', 'short', 'margin_calls', 'cash', 'shares'])
+
+
+class Agents(NamedTuple):
+    """
+    The parameters of the agents, one entry per agent.
+    """
+    kind: np.ndarray  # int8; FEEDBACK, PASSIVE or SPECULATOR
+    aggression: np.ndarray  # float64
+    alpha: np.ndarray  # float64
+    beta: np.ndarray  # float64
+    gamma: np.ndarray  # float64
+    delta: np.ndarray  # float64
+
+
+class AgentBounds(NamedTuple):
+    """
+    The (low, high) bounds of the uniform draws of the agent parameters.
+    """
+    aggression: tuple = (AGG_LO, AGG_HI)
+    alpha: tuple = (ALPHA_LO, ALPHA_HI)
+    beta: tuple = (BETA_LO, BETA_HI)
+    gamma: tuple = (GAMMA_LO, GAMMA_HI)
+    delta: tuple = (DELTA_LO, DELTA_HI)
+
+
+def get_session_config(name='sim_1', **overrides):
+    """
+    Build a session config the way oTree does: the defaults, then the named session config, then the overrides.
+    @return: the config dict
+    """
+    import settings
+
+    config = dict(settings.SESSION_CONFIG_DEFAULTS)
+    config.update(next(c for c in settings.SESSION_CONFIGS if c['name'] == name))
+    config.update(overrides)
+    return config
+
+
+def make_agents(num_agents, rng, bounds=AgentBounds()):
+    """
+    Draw the agents' parameters.  Every agent gets every parameter; each kind only uses its own.
+    @param rng: numpy Generator
+    @return: Agents of arrays
+    """
+    def draw(bound):
+        return rng.uniform(bound[0], bound[1], num_agents)
+
+    kind = np.resize(np.array(AGENT_MIX, dtype=np.int8), num_agents)
+    return Agents(kind, draw(bounds.aggression), draw(bounds.alpha), draw(bounds.beta), draw(bounds.gamma),
+                  draw(bounds.delta))
+
+
+def get_demand(agents, prices, fundamental_value, expected_price):
+    """
+    The demand of every agent.  Positive demand is a BID and negative an OFFER.
+        Feedback:    -delta + beta * (the last price change); they sit out the first round
+        Passive:     -alpha * (the last price - the fundamental value)
+        Speculator:  delta + gamma * (the expected price - the last price); they sit out while SPECULATING
+    @param prices: the price history, ending with the last period price
+    @param expected_price: the speculators' expected price, or SPECULATING
+    @return: int64 array of the demands
+    """
+    demand = np.zeros(len(agents.kind))
+    last_price = prices[-1]
+
+    feedback = agents.kind == FEEDBACK
+    if len(prices) >= 2:
+        demand[feedback] = -agents.delta[feedback] + agents.beta[feedback] * (prices[-1] - prices[-2])
+
+    passive = agents.kind == PASSIVE
+    demand[passive] = -agents.alpha[passive] * (last_price - fundamental_value)
+
+    if expected_price != SPECULATING:
+        spec = agents.kind == SPECULATOR
+        demand[spec] = agents.delta[spec] + agents.gamma[spec] * (expected_price - last_price)
+
+    # rint rounds half to even like round()
+    return np.rint(demand).astype(np.int64)
+
+
+def get_orders(agents, demand, last_price):
+    """
+    Each agent with a demand places one order for it.  BIDS are priced above the last price and OFFERS
+    below it by the agent's aggression, truncated to whole dollars.
+    @return: the agent index, BID mask, price (cents) and quantity of the orders
+    """
+    order_idx = np.flatnonzero(demand)
+    is_bid = demand[order_idx] > 0
+    direction = np.where(is_bid, 1, -1)
+    whole_prices = np.trunc(last_price * (1 + direction * agents.aggression[order_idx]))
+    prices = (whole_prices * clearing.CENTS).astype(np.int64)
+    return order_idx, is_bid, prices, np.abs(demand[order_idx])
+
+
+def cap_short_sales(is_bid, quants, held, limit):
+    """
+    Cap the short sales of the OFFERS in submission order, like place_order does with the market's
+    ShortInterest.  Each order's short sale is the part of it that is not covered by the shares held.
+    @param held: int64 array of the shares held by the placer of each order
+    @param limit: the number of shares that may still be sold short, or None if there is no cap
+    @return: int64 array of the capped quantities
+    """
+    if limit is None:
+        return quants
+
+    short_sale = np.where(is_bid, 0, np.maximum(quants - np.maximum(held, 0), 0))
+    allowed = np.diff(np.minimum(np.cumsum(short_sale), limit), prepend=0)
+    return quants - (short_sale - allowed)
+
+
+def get_endowments(config, num_agents):
+    """
+    The opening positions, as in assign_endowments: the stock endowments are dealt out in turn and every agent is
+    worth the same at the fundamental value.
+    @return: int64 arrays of cash (cents) and shares
+    """
+    stock_endowments = list(config.endow_stocks)
+    whole_quotient, remainder = divmod(num_agents, 3)
+    stock_for_players = stock_endowments * whole_quotient
+    if remainder == 1:
+        stock_for_players = stock_for_players + stock_endowments[1:2]
+    elif remainder == 2:
+        stock_for_players = stock_for_players + [stock_endowments[0], stock_endowments[2]]
+
+    shares = np.array(stock_for_players, dtype=np.int64)
+    cash = clearing.to_cents(config.endow_worth) - shares * clearing.to_cents(config.fundamental_value)
+    return cash, shares
+
+
+def update_delays(delays, violation, bankrupt, base):
+    """
+    Vector form of the auto transaction delay in Player.determine_auto_trans_status.
+    """
+    counting = np.where(delays == NO_AUTO_TRANS, base, np.maximum(delays - 1, 0))
+    return np.where(violation & ~bankrupt, counting, NO_AUTO_TRANS)
+
+
+class Simulation:
+    """
+    One market of agents over many rounds.
+    """
+
+    def __init__(self, config, num_agents, seed=None, bounds=AgentBounds()):
+        """
+        @param config: a session config dict or SessionConfig
+        @param seed: the seed of the agents' parameters and the dividends
+        """
+        self.config = scf.get_config(config)
+        self.rng = np.random.default_rng(seed)
+        self.agents = make_agents(num_agents, self.rng, bounds)
+
+        self.fundamental_value = float(self.config.fundamental_value)
+        init_price = self.config.init_price
+        self.prices = [init_price if init_price is not None else self.fundamental_value]
+        self.volumes = [0]
+        self.dividends = []
+        self.short = []
+        self.margin_calls = []
+
+        self.cash, self.shares = get_endowments(self.config, num_agents)
+        self.buy_delays = np.full(num_agents, NO_AUTO_TRANS, dtype=np.int64)
+        self.sell_delays = np.full(num_agents, NO_AUTO_TRANS, dtype=np.int64)
+
+        cap_ratio = self.config.float_ratio_cap
+        if not self.config.allow_short:
+            self.max_short = 0
+        else:
+            self.max_short = int(cap_ratio * self.shares.sum()) if cap_ratio else None
+
+        div_probabilities = self.config.div_probabilities
+        self.div_amounts = self.config.div_amounts
+        self.div_weights = div_probabilities / div_probabilities.sum()
+
+    def get_short(self):
+        return int(np.maximum(-self.shares, 0).sum())
+
+    def get_short_limit(self):
+        if self.max_short is None:
+            return None
+        return max(self.max_short - self.get_short(), 0)
+
+    def start_round(self):
+        """
+        Set the auto transaction delays from the positions at the last period price, like prepare_players.
+        """
+        price = clearing.to_cents(self.prices[-1])
+        status = positions.margin_status(self.cash, self.shares, price, self.config.margin_ratio)
+        base = self.config.auto_trans_delay
+        self.buy_delays = update_delays(self.buy_delays, status.short_mv, status.bankrupt, base)
+        self.sell_delays = update_delays(self.sell_delays, status.debt_mv, status.bankrupt, base)
+
+    def place_orders(self):
+        """
+        The orders of the agents, as in sim_bot.call_live_method: the speculators' expected price is the
+        price of a market in which they expect the fundamental value.
+        @return: the agent index, BID mask, price (cents) and quantity of the orders
+        """
+        last_price = self.prices[-1]
+        demand = get_demand(self.agents, self.prices, self.fundamental_value, self.fundamental_value)
+        order_idx, is_bid, prices, quants = get_orders(self.agents, demand, last_price)
+        expected_price, _ = clearing.clear(prices[is_bid], quants[is_bid], prices[~is_bid], quants[~is_bid],
+                                           last_price)
+
+        demand = get_demand(self.agents, self.prices, self.fundamental_value, expected_price)
+        order_idx, is_bid, prices, quants = get_orders(self.agents, demand, last_price)
+        quants = cap_short_sales(is_bid, quants, self.shares[order_idx], self.get_short_limit())
+        return order_idx, is_bid, prices, quants
+
+    def run_margin_calls(self, order_idx, is_bid, prices, quants):
+        """
+        Cancel the orders of the called agents and add their automatic orders, like CallMarket.run_margin_calls.
+        @return: the orders with the automatic orders and the number of agents called
+        """
+        auto_buy = self.buy_delays == 0
+        auto_sell = self.sell_delays == 0
+        if not (auto_buy.any() or auto_sell.any()):
+            return (order_idx, is_bid, prices, quants), 0
+
+        config = self.config
+        calls = positions.margin_calls(self.cash, self.shares, auto_buy, auto_sell, order_idx, is_bid, prices, quants,
+                                       self.prices[-1], config.margin_ratio, config.margin_target_ratio,
+                                       config.margin_premium, MAX_MARGIN_CALL_ITERATIONS)
+        quants = np.where(calls.canceled, 0, quants)
+        buyers = np.flatnonzero(calls.buying)
+        sellers = np.flatnonzero(calls.selling)
+        orders = (np.concatenate((order_idx, buyers, sellers)),
+                  np.concatenate((is_bid, np.ones(len(buyers), dtype=bool), np.zeros(len(sellers), dtype=bool))),
+                  np.concatenate((prices, np.full(len(buyers), calls.buy_at), np.full(len(sellers), calls.sell_at))),
+                  np.concatenate((quants, calls.buy_quant[buyers], calls.sell_quant[sellers])))
+        return orders, len(buyers) + len(sellers)
+
+    def run_round(self):
+        """
+        Run one round: the auto transaction statuses, the orders, the margin call stage, the clearing,
+        the fills and the new positions.
+        @return: the market price and volume
+        """
+        self.start_round()
+        orders, num_called = self.run_margin_calls(*self.place_orders())
+        order_idx, is_bid, prices, quants = orders
+
+        last_price = self.prices[-1]
+        market_price, volume = clearing.clear(prices[is_bid], quants[is_bid], prices[~is_bid], quants[~is_bid],
+                                              last_price)
+        price = clearing.to_cents(market_price)
+        filled = clearing.fill(is_bid, prices, quants, price)
+
+        dividend = float(self.rng.choice(self.div_amounts, p=self.div_weights))
+        order_types = np.where(is_bid, -1, 1)
+        shares_transacted = positions.net_shares(order_idx, order_types, filled, len(self.shares))
+        pos = positions.compute_positions(self.cash, self.shares, shares_transacted, price, dividend,
+                                          self.config.interest_rate)
+        self.cash = pos.cash_result
+        self.shares = pos.shares_result
+
+        self.prices.append(market_price)
+        self.volumes.append(volume)
+        self.dividends.append(dividend)
+        self.short.append(self.get_short())
+        self.margin_calls.append(num_called)
+        return market_price, volume
+
+    def run(self, num_rounds):
+        """
+        @return: SimResult; prices and volumes start with the initial values
+        """
+        for _ in range(num_rounds):
+            self.run_round()
+        return SimResult(np.array(self.prices), np.array(self.volumes), np.array(self.dividends),
+                         np.array(self.short), np.array(self.margin_calls), self.cash, self.shares)
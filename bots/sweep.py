@@ -0,0 +1,128 @@
+"""
+Parameter sweeps of the headless market simulation (see simulator).
+
+A sweep runs every point of a grid of session config overrides with several seeds.  The runs are spread over
+a process pool.  Besides the session config keys (interest_rate, div_amount, div_dist, margin_ratio,
+float_ratio_cap, ...), a grid can vary the bounds of the agents' parameters with <param>_lo and <param>_hi
+keys, e.g. gamma_hi or aggression_lo.
+
+Every point is run with the same seeds, base_seed to base_seed + seeds - 1, so the points are compared on the
+same draws.  The results are two tables: one summary row per run and the price paths of the runs, in long
+form with one row per round.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import common.SessionConfigFunctions as scf
+from bots.simulator import AgentBounds, Simulation, get_session_config
+
+
+def get_points(grid):
+    """
+    @param grid: dict of config key to the list of its values
+    @return: list of the override dicts of every combination of the values
+    """
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def split_overrides(overrides):
+    """
+    Separate the agent parameter bounds from the session config overrides.
+    @return: the session config overrides and AgentBounds
+    """
+    config = dict(overrides)
+    bounds = {}
+    for param, default in AgentBounds()._asdict().items():
+        lo = config.pop(param + '_lo', default[0])
+        hi = config.pop(param + '_hi', default[1])
+        bounds[param] = (lo, hi)
+    return config, AgentBounds(**bounds)
+
+
+def summarize(result, fundamental_value):
+    """
+    Summary statistics of a run.  The initial price is left out.  rad is the relative absolute deviation of
+    the price from the fundamental value.
+    @param result: SimResult
+    @return: dict
+    """
+    prices = result.prices[1:]
+    volumes = result.volumes[1:]
+    return dict(final_price=prices[-1],
+                mean_price=prices.mean(),
+                price_sd=prices.std(),
+                min_price=prices.min(),
+                max_price=prices.max(),
+                rad=np.abs(prices - fundamental_value).mean() / fundamental_value if fundamental_value else np.nan,
+                total_volume=int(volumes.sum()),
+                mean_volume=volumes.mean(),
+                max_short=int(result.short.max()),
+                margin_calls=int(result.margin_calls.sum()))
+
+
+def run_one(task):
+    """
+    Run one simulation.  This runs in the worker processes, so it only takes and returns plain data.
+    @param task: tuple of point index, overrides, seed, session config name, number of agents and rounds
+    @return: the summary dict, the prices and the volumes
+    """
+    point, overrides, seed, session_name, num_agents, num_rounds = task
+    config_overrides, bounds = split_overrides(overrides)
+    config = scf.parse_config(get_session_config(session_name, **config_overrides))
+
+    result = Simulation(config, num_agents, seed=seed, bounds=bounds).run(num_rounds)
+    summary = dict(point=point, seed=seed)
+    summary.update(overrides)
+    summary.update(summarize(result, float(config.fundamental_value)))
+    return summary, result.prices, result.volumes
+
+
+def get_tasks(points, seeds, base_seed, session_name, num_agents, num_rounds):
+    return [(i, overrides, base_seed + s, session_name, num_agents, num_rounds)
+            for i, overrides in enumerate(points)
+            for s in range(seeds)]
+
+
+def run_sweep(grid, seeds, num_agents, num_rounds, session_name='sim_1', base_seed=0, max_workers=None):
+    """
+    Run every point of the grid with each seed, across a process pool when max_workers is more than one.
+    @param max_workers: the size of the pool; None for the number of CPUs
+    @return: the summary and price path DataFrames
+    """
+    tasks = get_tasks(get_points(grid), seeds, base_seed, session_name, num_agents, num_rounds)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers <= 1 or len(tasks) <= 1:
+        results = [run_one(t) for t in tasks]
+    else:
+        # A few chunks per worker keeps the pool busy without sending every task separately
+        chunksize = max(len(tasks) // (4 * max_workers), 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(run_one, tasks, chunksize=chunksize))
+
+    summary = pd.DataFrame([r[0] for r in results])
+    num_prices = num_rounds + 1
+    paths = pd.DataFrame(dict(point=np.repeat(summary['point'].to_numpy(), num_prices),
+                              seed=np.repeat(summary['seed'].to_numpy(), num_prices),
+                              round=np.tile(np.arange(num_prices), len(results)),
+                              price=np.concatenate([r[1] for r in results]),
+                              volume=np.concatenate([r[2] for r in results])))
+    return summary, paths
+
+
+def write_table(df, path):
+    """
+    Write a table as parquet, or as CSV if no parquet engine is installed.
+    @param path: the file path without the extension
+    @return: the path written
+    """
+    try:
+        df.to_parquet(path + '.parquet', index=False)
+        return path + '.parquet'
+    except ImportError:
+        df.to_csv(path + '.csv', index=False)
+        return path + '.csv'
@@ -0,0 +1,255 @@
+"""
+Lightweight timing instrumentation for page hooks and live methods.
+
+Wrap a hook with @instrument_hook to record, for every call:
+    wall time (ms)
+    the number of database queries issued on the calling thread
+    the peak memory allocated during the call (KiB), only if tracemalloc is tracing.  Nested hooks
+    each report their own peak; the outer hook's peak includes the inner ones.
+
+Metrics are kept in-process as histograms per hook and can be read with get_metrics(),
+written with dump_metrics(), or shown on the admin report.
+
+Recording is off unless it is turned on.
+
+Environment:
+    INSTRUMENT_HOOKS=1              turn recording on
+    INSTRUMENT_ALLOCATIONS=1        start tracemalloc to record allocations (adds overhead)
+    INSTRUMENT_DUMP_PATH=<file>     write the metrics as JSON to the file at exit
+"""
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+from sqlalchemy import event
+
+TIME_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+ALLOC_BUCKETS_KB = [16, 64, 256, 1024, 4096, 16384, 65536]
+
+ENABLED = os.getenv('INSTRUMENT_HOOKS', '0') == '1'
+
+_lock = threading.Lock()
+_local = threading.local()
+_metrics = {}
+_query_listener = []
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram.  Bucket i counts the values <= bounds[i]; the last bucket counts the rest.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """
+        @return: the upper bound of the bucket holding the q-th quantile (max for the overflow bucket)
+        """
+        if not self.count:
+            return None
+
+        target = q * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        return dict(count=self.count,
+                    total=self.total,
+                    mean=self.mean(),
+                    min=self.min,
+                    max=self.max,
+                    p50=self.quantile(.5),
+                    p95=self.quantile(.95),
+                    bounds=self.bounds,
+                    counts=self.counts)
+
+
+class HookMetrics:
+    def __init__(self):
+        self.wall_ms = Histogram(TIME_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.alloc_kb = Histogram(ALLOC_BUCKETS_KB)
+        self.errors = 0
+
+    def to_dict(self):
+        return dict(wall_ms=self.wall_ms.to_dict(),
+                    queries=self.queries.to_dict(),
+                    alloc_kb=self.alloc_kb.to_dict(),
+                    errors=self.errors)
+
+
+def _count_query(*args, **kwargs):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def _listen_for_queries():
+    if _query_listener:
+        return
+
+    from otree.database import engine
+    event.listen(engine, 'before_cursor_execute', _count_query)
+    _query_listener.append(engine)
+
+
+def get_query_count():
+    """
+    @return: the number of queries issued so far on the current thread
+    """
+    return getattr(_local, 'queries', 0)
+
+
+def start_peak():
+    """
+    Reset the tracemalloc peak for a hook that is starting.  The peak of the enclosing hook so far is kept
+    on the thread's stack, since resetting the peak loses it.
+    """
+    stack = getattr(_local, 'peaks', None)
+    if stack is None:
+        stack = []
+        _local.peaks = stack
+
+    if stack:
+        stack[-1] = max(stack[-1], tracemalloc.get_traced_memory()[1])
+    stack.append(0)
+    tracemalloc.reset_peak()
+
+
+def end_peak():
+    """
+    @return: the peak traced memory since the matching start_peak, including the peaks of nested hooks
+    """
+    stack = _local.peaks
+    peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+    if stack:
+        stack[-1] = max(stack[-1], peak)
+    return peak
+
+
+def record(name, wall_ms, queries, alloc_kb=None, error=False):
+    with _lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = HookMetrics()
+            _metrics[name] = m
+
+        m.wall_ms.record(wall_ms)
+        m.queries.record(queries)
+        if alloc_kb is not None:
+            m.alloc_kb.record(alloc_kb)
+        if error:
+            m.errors += 1
+
+
+def instrument_hook(name=None):
+    """
+    Decorator that records the wall time, query count and allocations of each call.
+    Can be used as @instrument_hook or @instrument_hook('name').
+    @param name: the name to record under.  Defaults to the function's qualified name.
+    """
+    if callable(name):
+        return instrument_hook()(name)
+
+    def decorator(func):
+        hook_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+
+            _listen_for_queries()
+            tracing = tracemalloc.is_tracing()
+            if tracing:
+                start_mem = tracemalloc.get_traced_memory()[0]
+                start_peak()
+            start_queries = get_query_count()
+            start = time.perf_counter()
+
+            error = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                wall_ms = (time.perf_counter() - start) * 1000
+                queries = get_query_count() - start_queries
+                alloc_kb = (end_peak() - start_mem) / 1024 if tracing else None
+                record(hook_name, wall_ms, queries, alloc_kb, error)
+
+        return wrapper
+
+    return decorator
+
+
+def get_metrics():
+    """
+    @return: dict of hook name to the metrics of the hook, as plain dicts
+    """
+    with _lock:
+        return {name: m.to_dict() for name, m in sorted(_metrics.items())}
+
+
+def get_summary_rows():
+    """
+    One row per hook for display on the admin report.
+    """
+    rows = []
+    for name, m in get_metrics().items():
+        wall = m['wall_ms']
+        rows.append(dict(name=name,
+                         calls=wall['count'],
+                         errors=m['errors'],
+                         mean_ms=round(wall['mean'], 2),
+                         p95_ms=wall['p95'],
+                         max_ms=round(wall['max'], 2),
+                         mean_queries=round(m['queries']['mean'], 1),
+                         max_queries=m['queries']['max'],
+                         mean_alloc_kb=round(m['alloc_kb']['mean'], 1) if m['alloc_kb']['count'] else None))
+    return rows
+
+
+def reset_metrics():
+    with _lock:
+        _metrics.clear()
+
+
+def dump_metrics(path):
+    """
+    Write the metrics to a JSON file.
+    """
+    with open(path, 'w') as f:
+        json.dump(dict(created=time.time(), hooks=get_metrics()), f, indent=2)
+
+
+if ENABLED and os.getenv('INSTRUMENT_ALLOCATIONS') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+if os.getenv('INSTRUMENT_DUMP_PATH'):
+    atexit.register(dump_metrics, os.getenv('INSTRUMENT_DUMP_PATH'))
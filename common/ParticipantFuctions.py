@@ -23,6 +23,7 @@ def generate_participant_ids(subsession: BaseSubsession):
     for p in players:
         p.participant.MARKET_PAYMENT = cu(0)
         p.participant.FORECAST_PAYMENT = cu(0)
+        p.participant.FORECAST_TOTAL = cu(0)
 
     if scf.is_online(subsession):
         return
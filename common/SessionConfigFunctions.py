@@ -1,9 +1,10 @@
 from datetime import datetime
+from types import MappingProxyType
+from typing import NamedTuple, Optional
 
 from otree.api import Currency as cu
 from otree.models import Session
 import numpy as np
-from  copy import deepcopy
 
 SK_INTEREST_RATE = 'interest_rate'
 SK_DIV_AMOUNT = 'div_amount'
@@ -17,6 +18,7 @@ SK_RANDOMIZE_HISTORY = 'random_hist'
 SK_BONUS_CAP = 'bonus_cap'
 SK_AUTO_TRANS_DELAY = 'auto_trans_delay'
 SK_FLOAT_RATIO_CAP = 'float_ratio_cap'
+SK_ALLOW_SHORT = 'allow_short'
 SK_FORECAST_THOLD = 'forecast_thold'
 SK_FORECAST_REWARD = 'forecast_reward'
 SK_MARKET_TIME = 'market_time'
@@ -35,19 +37,11 @@ SK_EXP_TIME_PILOT = 'expected_time_pilot'
 SK_EXP_TIME_LIVE = 'expected_time_live'
 SK_START_TIME = 'start_time'
 SK_DEFAULT_URL = 'default_url'
+SK_CLEARING_WORKERS = 'clearing_workers'
 
 WHOLE_NUMBER_PERCENT = "{:.0%}"
 
 
-def ensure_config(obj):
-    if type(obj) == dict:
-        return obj
-    elif type(obj) == Session:
-        return deepcopy(obj.config)
-    else:
-        return deepcopy(obj.session.config)
-
-
 def get_item_as_int(config, key, default=0, return_none=False):
     raw_value = config.get(key)
     if raw_value:
@@ -84,14 +78,164 @@ def get_item_as_bool(config, key, default=False):
         return default
 
 
+class SessionConfig(NamedTuple):
+    """
+    Read-only snapshot of a session config with the numeric settings parsed once.
+    """
+    raw: MappingProxyType
+    interest_rate: float
+    div_probabilities: Optional[np.ndarray]
+    div_amounts: Optional[np.ndarray]
+    fundamental_value: Optional[cu]
+    margin_ratio: float
+    margin_premium: float
+    margin_target_ratio: float
+    init_price: Optional[float]
+    random_hist: bool
+    bonus_cap: cu
+    auto_trans_delay: int
+    float_ratio_cap: Optional[float]
+    allow_short: bool
+    forecast_thold: int
+    forecast_reward: int
+    market_time: Optional[int]
+    market_choice_time: Optional[int]
+    market_pause_time: Optional[int]
+    forecast_time: Optional[int]
+    summary_time: Optional[int]
+    endow_stocks: Optional[tuple]
+    endow_worth: int
+    show_next: bool
+    conversion_rate: float
+    is_prolific: bool
+    is_mturk: bool
+    is_pilot: bool
+    exp_time_pilot: int
+    exp_time_live: int
+    clearing_workers: int
+
+
+# Parsed configs by session code.  A session's config does not change once the session is created.
+# The config is read by every app up to the end of the session, which no app sees, so instead of being
+# dropped at the end the oldest sessions are dropped once there are CONFIG_CACHE_SIZE of them.  A config
+# dropped while its session is still running is just parsed again.
+CONFIG_CACHE = {}
+CONFIG_CACHE_SIZE = 64
+
+
+def parse_array(raw_value):
+    if raw_value is None:
+        return None
+    a = np.array([float(x) for x in raw_value.split()])
+    a.flags.writeable = False
+    return a
+
+
+def parse_config(config):
+    """
+    Parse a raw session config dict into a SessionConfig.  Every key is parsed up front: it happens once
+    per session (see CONFIG_CACHE), the values are short scalars, and a malformed value then fails on the
+    session's first read instead of partway through a market.
+    @param config: the session config dict
+    @return: SessionConfig
+    """
+    interest_rate = get_item_as_float(config, SK_INTEREST_RATE)
+    div_probabilities = parse_array(config.get(SK_DIV_DIST))
+    div_amounts = parse_array(config.get(SK_DIV_AMOUNT))
+
+    if interest_rate == 0:
+        fundamental_value = 0
+    elif div_probabilities is None or div_amounts is None:
+        fundamental_value = None
+    else:
+        fundamental_value = cu(div_probabilities.dot(div_amounts) / interest_rate)
+
+    raw_endow_stock = config.get(SK_ENDOW_STOCK)
+    endow_stocks = tuple(int(x) for x in raw_endow_stock.split()) if raw_endow_stock is not None else None
+
+    return SessionConfig(
+        raw=MappingProxyType(dict(config)),
+        interest_rate=interest_rate,
+        div_probabilities=div_probabilities,
+        div_amounts=div_amounts,
+        fundamental_value=fundamental_value,
+        margin_ratio=get_item_as_float(config, SK_MARGIN_RATIO),
+        margin_premium=get_item_as_float(config, SK_MARGIN_PREMIUM),
+        margin_target_ratio=get_item_as_float(config, SK_MARGIN_TARGET_RATIO),
+        init_price=get_item_as_float(config, SK_INITIAL_PRICE, return_none=True),
+        random_hist=get_item_as_bool(config, SK_RANDOMIZE_HISTORY),
+        bonus_cap=get_item_as_currency(config, SK_BONUS_CAP, default=9999999999),
+        auto_trans_delay=get_item_as_int(config, SK_AUTO_TRANS_DELAY),
+        float_ratio_cap=get_item_as_float(config, SK_FLOAT_RATIO_CAP, return_none=True),
+        allow_short=get_item_as_bool(config, SK_ALLOW_SHORT),
+        forecast_thold=get_item_as_int(config, SK_FORECAST_THOLD),
+        forecast_reward=get_item_as_int(config, SK_FORECAST_REWARD),
+        market_time=get_item_as_int(config, SK_MARKET_TIME, return_none=True),
+        market_choice_time=get_item_as_int(config, SK_MARKET_CHOICE_TIME, return_none=True),
+        market_pause_time=get_item_as_int(config, SK_MARKET_PAUSE_TIME, return_none=True),
+        forecast_time=get_item_as_int(config, SK_FORECAST_TIME, return_none=True),
+        summary_time=get_item_as_int(config, SK_SUMMARY_TIME, return_none=True),
+        endow_stocks=endow_stocks,
+        endow_worth=get_item_as_int(config, SK_ENDOW_WORTH),
+        show_next=get_item_as_bool(config, SK_SHOW_NEXT),
+        conversion_rate=get_item_as_float(config, SK_CONVERSION_RATE),
+        is_prolific=get_item_as_bool(config, SK_IS_PROLIFIC),
+        is_mturk=get_item_as_bool(config, SK_IS_MTURK),
+        is_pilot=get_item_as_bool(config, SK_IS_PILOT),
+        exp_time_pilot=get_item_as_int(config, SK_EXP_TIME_PILOT),
+        exp_time_live=get_item_as_int(config, SK_EXP_TIME_LIVE),
+        clearing_workers=get_item_as_int(config, SK_CLEARING_WORKERS),
+    )
+
+
+def get_config(obj):
+    """
+    Get the parsed config for a session, or for the session of a player, group or subsession.
+    Configs of sessions are cached by session code; plain dicts are parsed on every call.
+    @param obj: a config dict, a SessionConfig, a Session or a model with a session
+    @return: SessionConfig
+    """
+    if type(obj) == SessionConfig:
+        return obj
+    if type(obj) == dict:
+        return parse_config(obj)
+
+    session = obj if type(obj) == Session else obj.session
+    code = session.code
+    config = CONFIG_CACHE.get(code)
+    if config is None:
+        config = parse_config(session.config)
+        if len(CONFIG_CACHE) >= CONFIG_CACHE_SIZE:
+            del CONFIG_CACHE[next(iter(CONFIG_CACHE))]
+        CONFIG_CACHE[code] = config
+    return config
+
+
+def clear_config_cache(code=None):
+    """
+    Drop the cached config for the given session code, or all cached configs.
+    """
+    if code is None:
+        CONFIG_CACHE.clear()
+    else:
+        CONFIG_CACHE.pop(code, None)
+
+
+def ensure_config(obj):
+    """
+    @return: the raw session config as a new dict.  The copy is shallow; callers may add keys.
+    """
+    if type(obj) == dict:
+        return obj
+    return dict(get_config(obj).raw)
+
+
 def get_init_price(obj):
-    config = ensure_config(obj)
-    return get_item_as_float(config, SK_INITIAL_PRICE, return_none=True)
+    return get_config(obj).init_price
 
 
 def get_session_name(obj):
-    config = ensure_config(obj)
-    return config.get(SK_SESSION_NAME)
+    return get_config(obj).raw.get(SK_SESSION_NAME)
 
 
 def as_wnp(x):
@@ -99,79 +243,69 @@ def as_wnp(x):
 
 
 def get_margin_ratio(obj, wnp=False):
-    config = ensure_config(obj)
+    config = get_config(obj)
     if wnp:
-        return as_wnp(config.get(SK_MARGIN_RATIO))
+        return as_wnp(config.raw.get(SK_MARGIN_RATIO))
     else:
-        return get_item_as_float(config, SK_MARGIN_RATIO)
+        return config.margin_ratio
 
 
 def get_margin_target_ratio(obj, wnp=False):
-    config = ensure_config(obj)
+    config = get_config(obj)
     if wnp:
-        return as_wnp(config.get(SK_MARGIN_TARGET_RATIO))
+        return as_wnp(config.raw.get(SK_MARGIN_TARGET_RATIO))
     else:
-        return get_item_as_float(config, SK_MARGIN_TARGET_RATIO)
+        return config.margin_target_ratio
 
 
 def get_margin_premium(obj, wnp=False):
-    config = ensure_config(obj)
+    config = get_config(obj)
     if wnp:
-        return as_wnp(config.get(SK_MARGIN_PREMIUM))
+        return as_wnp(config.raw.get(SK_MARGIN_PREMIUM))
     else:
-        return get_item_as_float(config, SK_MARGIN_PREMIUM)
+        return config.margin_premium
 
 
 def get_dividend_dist(obj):
-    config = ensure_config(obj)
-    return config.get(SK_DIV_DIST)
+    return get_config(obj).raw.get(SK_DIV_DIST)
 
 
 def get_dividend_probabilities(obj):
-    return np.array([float(x) for x in get_dividend_dist(obj).split()])
+    """
+    @return: read-only array of the dividend probabilities
+    """
+    return get_config(obj).div_probabilities
 
 
 def get_dividend_amount(obj):
-    config = ensure_config(obj)
-    return config.get(SK_DIV_AMOUNT)
+    return get_config(obj).raw.get(SK_DIV_AMOUNT)
 
 
 def get_dividend_amounts(obj):
-    return np.array([float(x) for x in get_dividend_amount(obj).split()])
+    """
+    @return: read-only array of the dividend amounts
+    """
+    return get_config(obj).div_amounts
 
 
 def get_interest_rate(obj):
-    config = ensure_config(obj)
-    return get_item_as_float(config, SK_INTEREST_RATE)
+    return get_config(obj).interest_rate
 
 
 def get_fundamental_value(obj):
-    config = ensure_config(obj)
-
-    dist = get_dividend_probabilities(config)
-    div_amounts = get_dividend_amounts(config)
-    exp = dist.dot(div_amounts)
-    r = get_interest_rate(config)
-
-    if r == 0:
-        return 0
-
-    return cu(exp / r)
+    return get_config(obj).fundamental_value
 
 
 def is_random_hist(obj):
-    config = ensure_config(obj)
-    return get_item_as_bool(config, SK_RANDOMIZE_HISTORY)
+    return get_config(obj).random_hist
 
 
 def get_bonus_cap(obj):
-    config = ensure_config(obj)
-    return get_item_as_currency(config, SK_BONUS_CAP, default=9999999999)
+    return get_config(obj).bonus_cap
 
 
 def get_auto_trans_delay(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_AUTO_TRANS_DELAY)
+    return get_config(obj).auto_trans_delay
 
 
 def get_float_ratio_cap(obj):
@@ -180,77 +314,71 @@ def get_float_ratio_cap(obj):
     @param obj:
     @return: the short cap ratio if set, otherwise None.
     """
-    config = ensure_config(obj)
-    return get_item_as_float(config, SK_FLOAT_RATIO_CAP, return_none=True)
+    return get_config(obj).float_ratio_cap
+
+
+def is_short_allowed(obj):
+    """
+    Short sales are only allowed on submission if the session turns them on with allow_short.
+    @return: bool
+    """
+    return get_config(obj).allow_short
 
 
 def get_forecast_thold(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_FORECAST_THOLD)
+    return get_config(obj).forecast_thold
 
 
 def get_forecast_reward(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_FORECAST_REWARD)
+    return get_config(obj).forecast_reward
 
 
 def get_market_time(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_MARKET_TIME, return_none=True)
+    return get_config(obj).market_time
 
 
 def get_market_choice_time(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_MARKET_CHOICE_TIME, return_none=True)
+    return get_config(obj).market_choice_time
 
 
 def get_market_pause_time(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_MARKET_PAUSE_TIME, return_none=True)
+    return get_config(obj).market_pause_time
 
 
 def get_forecast_time(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_FORECAST_TIME, return_none=True)
+    return get_config(obj).forecast_time
 
 
 def get_summary_time(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_SUMMARY_TIME, return_none=True)
+    return get_config(obj).summary_time
 
 
 def get_endow_stock(obj):
-    config = ensure_config(obj)
-    return config.get(SK_ENDOW_STOCK)
+    return get_config(obj).raw.get(SK_ENDOW_STOCK)
 
 
 def get_endow_stocks(obj):
-    return [int(x) for x in get_endow_stock(obj).split()]
+    return list(get_config(obj).endow_stocks)
 
 
 def get_endow_worth(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_ENDOW_WORTH)
+    return get_config(obj).endow_worth
 
 
 def show_next_button(obj):
-    config = ensure_config(obj)
-    return get_item_as_bool(config, SK_SHOW_NEXT)
+    return get_config(obj).show_next
 
 
 def get_conversion_rate(obj):
-    config = ensure_config(obj)
-    return get_item_as_float(config, SK_CONVERSION_RATE)
+    return get_config(obj).conversion_rate
 
 
 def is_prolific(obj):
-    config = ensure_config(obj)
-    return get_item_as_bool(config, SK_IS_PROLIFIC)
+    return get_config(obj).is_prolific
 
 
 def is_mturk(obj):
-    config = ensure_config(obj)
-    return get_item_as_bool(config, SK_IS_MTURK)
+    return get_config(obj).is_mturk
 
 
 def is_online(obj):
@@ -258,18 +386,15 @@ def is_online(obj):
 
 
 def is_pilot(obj):
-    config = ensure_config(obj)
-    return get_item_as_bool(config, SK_IS_PILOT)
+    return get_config(obj).is_pilot
 
 
 def get_exp_time_pilot(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_EXP_TIME_PILOT)
+    return get_config(obj).exp_time_pilot
 
 
 def get_exp_time_live(obj):
-    config = ensure_config(obj)
-    return get_item_as_int(config, SK_EXP_TIME_LIVE)
+    return get_config(obj).exp_time_live
 
 
 def get_expected_time(obj):
@@ -280,8 +405,7 @@ def get_expected_time(obj):
 
 
 def get_start_time(obj):
-    config = ensure_config(obj)
-    raw_st = config.get(SK_START_TIME)
+    raw_st = get_config(obj).raw.get(SK_START_TIME)
     # allow this to raise an exception
     # this should fail fast
     dt = datetime.strptime(raw_st, '%Y%m%d%H%M')
@@ -289,5 +413,16 @@ def get_start_time(obj):
 
 
 def get_default_url(obj):
-    config = ensure_config(obj)
-    return config.get(SK_DEFAULT_URL)
+    return get_config(obj).raw.get(SK_DEFAULT_URL)
+
+
+def get_clearing_workers(obj):
+    """
+    The number of threads used to clear the groups of a subsession together.
+    @return: the number of workers; 0 (the default) clears each group on its own wait page.
+    """
+    return get_config(obj).clearing_workers
+
+
+def is_subsession_clearing(obj):
+    return get_clearing_workers(obj) > 0
@@ -1,7 +1,7 @@
 import rounds
 from common.ParticipantFuctions import generate_participant_ids
 from practice.models import *
-from rounds import OrderType
+from rounds import OrderType, order_cache, order_store
 from rounds.data_structs import DataForOrder, DataForPlayer
 
 doc = """
@@ -47,6 +47,10 @@ def practice_market_page_live_method(player, d):
     return rounds.market_page_live_method(player, d, o_cls=Order)
 
 
+def practice_market_before_next_page(player, timeout_happened):
+    rounds.market_page_before_next_page(player, timeout_happened, o_cls=Order)
+
+
 def practice_market_variables(player):
     ret = rounds.vars_for_market_template(player)
     ret['short'] = C.SHORT
@@ -81,6 +85,7 @@ def is_last_round(player: Player):
 def forecast_before_next_page(player: Player, timeout_happened):
     g = player.group  # price, volume, and dividend are already set on the group
 
+    order_store.flush_group(player.group_id, o_cls=Order)
     orders = [DataForOrder(o) for o in Order.filter(player=player)]
     # cap orders
     short_lim = C.FLOAT
@@ -115,6 +120,7 @@ def forecast_before_next_page(player: Player, timeout_happened):
     d4p.update_player()
     for o in orders:
         o.update_order()
+    order_cache.discard_player(player, o_cls=Order)
 
     player.determine_forecast_reward(g.price)
 
@@ -131,6 +137,7 @@ class PracticeMarketPage(Page):
     js_vars = rounds.get_js_vars
     live_method = practice_market_page_live_method
     vars_for_template = practice_market_variables
+    before_next_page = practice_market_before_next_page
 
 
 class PracticeForecastPage(Page):
@@ -161,6 +168,9 @@ class PracticeRoundResultsPage(Page):
             next_player.shares = player.shares_result
             next_player.cash = player.cash_result
 
+        # Each practice round's market is over once its results are shown
+        rounds.discard_market(player.group)
+
 
 class PracticeEndPage(Page):
     timeout_seconds = 120
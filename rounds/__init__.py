@@ -3,18 +3,18 @@ import json
 import random
 from collections import defaultdict
 from math import ceil
-import asyncio
-from threading import Thread
 
-from rounds.call_market import CallMarket
-from . import tool_tip
+from rounds.call_market import CallMarket, calculate_markets
+from rounds.clearing import to_cents
+from . import tool_tip, order_book, order_cache, order_store, price_history, positions, short_interest, trigger
 from .models import *
 import common.SessionConfigFunctions as scf
+from common.Instrumentation import instrument_hook, get_summary_rows
 from common.ParticipantFuctions import generate_participant_ids, is_button_click
 from otree import database
 import os
 
-from .trigger import SOCKETS
+from .trigger import HUB
 
 NUM_ROUNDS = os.getenv('SSE_NUM_ROUNDS')
 
@@ -28,6 +28,12 @@ class Constants(BaseConstants):
         num_rounds = 50
 
 
+# noinspection PyUnusedLocal
+def creating_session(subsession):
+    # Start the signal hub with the session, so peripherals can connect before the first round
+    trigger.start_thread()
+
+
 # assign treatments
 def assign_endowments(subsession):
     # only set up endowments in the first round
@@ -75,15 +81,18 @@ def get_js_vars_round_results(player: Player):
     return get_js_vars(player, include_current=True, show_notes=True, show_cancel=False)
 
 
+# These are the same for every page
+LABELS = list(range(0, Constants.num_rounds + 1))
+ERROR_CODES = {e.value: e.to_dict() for e in OrderErrorCode}
+
+# The most orders a player may have open; the order grid stops taking clicks at this many.
+MAX_ORDERS = 6
+
+
+@instrument_hook
 def get_js_vars(player: Player, include_current=False, show_notes=False, show_cancel=True):
     # Price History
     group: Group = player.group
-    if include_current:
-        # TODO: Try doing this with player.round_number
-        groups = list(filter(lambda g: g.field_maybe_none('price') is not None, group.in_all_rounds()))
-    else:
-        groups = group.in_previous_rounds()
-
     init_price = scf.get_init_price(player)
 
     if scf.is_random_hist(player):
@@ -91,21 +100,17 @@ def get_js_vars(player: Player, include_current=False, show_notes=False, show_ca
         prices = random.choices(range(25, 32), k=show_rounds) + [init_price]
         volumes = random.choices(range(0, 11), k=show_rounds) + [4]
     else:
-        prices = [init_price] + [g.price for g in groups]
-        volumes = [0] + [g.volume for g in groups]
-
-    # Error Codes
-    error_codes = {e.value: e.to_dict() for e in OrderErrorCode}
+        prices, volumes = price_history.get_price_series(group, include_current, init_price)
 
     market_price = group.price if include_current else group.get_last_period_price()
     mp_str = f"{market_price:.2f}"
 
     return dict(
-        labels=list(range(0, Constants.num_rounds + 1)),
+        labels=LABELS,
         price_data=prices,
         volume_data=volumes,
         num_periods=Constants.num_rounds,
-        error_codes=error_codes,
+        error_codes=ERROR_CODES,
         show_notes=show_notes,
         show_cancel=show_cancel,
         market_price=market_price,
@@ -120,10 +125,11 @@ def get_js_vars(player: Player, include_current=False, show_notes=False, show_ca
 
 
 
-def is_order_valid(player, data, orders_by_type):
+def is_order_valid(player, data, aggregates):
     """
     Check order form information.  This is both a syntactic and semantic check.
     @param data: Data from the otree live page's packet
+    @param aggregates: OrderAggregates of the player's existing orders
     @return: Error Code - 0 if valid
     @return: An OrderType object if valid, None otherwise
     @return: The price as an integer if valid, None otherwise
@@ -147,12 +153,9 @@ def is_order_valid(player, data, orders_by_type):
     if error_code > 0:
         return error_code, o_type, price, quant
 
-    offers = orders_by_type[OrderType.OFFER]
-    bids = orders_by_type[OrderType.BID]
-
     # If this is a bid, then its price must be less than the lowest ask
-    min_ask = min([o.price for o in offers], default=999999999)
-    max_bid = max([o.price for o in bids], default=-999)
+    min_ask = aggregates.min_ask(default=999999999)
+    max_bid = aggregates.max_bid(default=-999)
 
     if o_type == OrderType.BID and price >= min_ask:
         return OrderErrorCode.BID_GREATER_THAN_ASK.combine(error_code), o_type, price, quant
@@ -161,10 +164,10 @@ def is_order_valid(player, data, orders_by_type):
         return OrderErrorCode.ASK_LESS_THAN_BID.combine(error_code), o_type, price, quant
 
     # disallow margin trading and shorting
-    if o_type == OrderType.OFFER and is_shorting(player, offers, quant):
+    if o_type == OrderType.OFFER and is_shorting(player, aggregates, quant):
         return OrderErrorCode.SHORTING.combine(error_code), o_type, price, quant
 
-    if o_type == OrderType.BID and is_margin(player, bids, quant, price):
+    if o_type == OrderType.BID and is_margin(player, aggregates, quant, price):
         return OrderErrorCode.MARGIN.combine(error_code), o_type, price, quant
 
     return error_code, o_type, price, quant
@@ -228,27 +231,49 @@ def is_order_form_valid(data):
     return error_code, o_type, price, quant
 
 
-def is_shorting(player, offers,  quant):
-    outstanding_quant = sum([o.quantity for o in offers])
-    return outstanding_quant + quant > player.shares
+def get_short_sale(player, aggregates, quant):
+    """
+    @return: the number of shares of a SELL order that would be sold short, on top of the player's
+        other SELL orders
+    """
+    held = max(player.shares, 0)
+    offered = aggregates.offer_quantity
+    return max(offered + quant - held, 0) - max(offered - held, 0)
 
 
-def is_margin(player, bids, quant, price):
-    outstanding_cost = sum([o.quantity * o.price for o in bids])
-    return outstanding_cost + quant*price > player.cash
+def is_shorting(player, aggregates, quant):
+    """
+    Check a SELL order against the shorting rules.  No short sales are allowed unless the session sets
+    allow_short, and none without a float cap.  Otherwise the order's short sale is capped to what is left under the cap when it is placed
+    (see place_order), and the order is only refused if none of it would be left.
+    """
+    short_sale = get_short_sale(player, aggregates, quant)
+    if short_sale == 0:
+        return False
+    if not scf.is_short_allowed(player.group):
+        return True
+
+    tracker = short_interest.get_tracker(player.group)
+    if not tracker.is_capped():
+        return True
+    return short_sale - tracker.get_limit() >= quant
+
+
+def is_margin(player, aggregates, quant, price):
+    return aggregates.bid_cost + quant*price > player.cash
 
 
-def get_order_warnings(player, o_type, price, quant, orders_by_type):
+def get_order_warnings(player, o_type, price, quant, aggregates):
     warnings = []
 
     # show a warning if the combined orders can cause a short
-    existing_supply = sum((o.quantity for o in orders_by_type[OrderType.OFFER]))
+    existing_supply = aggregates.offer_quantity
     test_supply = existing_supply + quant if o_type == OrderType.OFFER else existing_supply
     if test_supply > 0 and player.shares < test_supply:
         warnings.append("Note:  Depending on market conditions, your combined SELL orders might result in a short "
                         "STOCK position.")
 
-    existing_cost = sum((o.price * o.quantity for o in orders_by_type[OrderType.BID]))
+    existing_cost = aggregates.bid_cost
     order_cost = price * quant
     test_cost = existing_cost + order_cost if o_type == OrderType.BID else existing_cost
     if test_cost > 0 and player.cash < test_cost:
@@ -265,48 +290,133 @@ def get_orders_by_type(existing_orders):
     return orders_cat
 
 
+def place_order(player, o_type: OrderType, price, quant, o_cls=Order):
+    """
+    Place a validated order.
+    @return: CachedOrder
+    """
+    # Short sales are held against the group's float cap, capping the order if the cap is reached
+    original_quant = None
+    if o_type == OrderType.OFFER:
+        short_sale = get_short_sale(player, get_order_aggregates(player, o_cls=o_cls), quant)
+        if short_sale:
+            allowed = short_interest.get_tracker(player.group).reserve(short_sale)
+            if allowed < short_sale:
+                original_quant = quant
+                quant -= short_sale - allowed
+
+    # The order is written behind (see order_store), but its id is known right away.
+    oid = order_store.add_order(player, o_type.value, price, quant, o_cls=o_cls, original_quantity=original_quant)
+
+    order = order_cache.CachedOrder(oid, player.id, player.id_in_group, player.group_id, o_type.value, price, quant,
+                                    original_quantity=original_quant)
+    order_book.get_book(player.group).add(oid, o_type.value, price, quant)
+    order_cache.add_order(player, order, o_cls=o_cls)
+    return order
+
+
 def create_order_from_live_submit(player, o_type: OrderType, price, quant, o_cls=Order):
-    # TODO:  Does this need to go in a transaction?
-    o = o_cls.create(player=player,
-                     group=player.group,
-                     order_type=o_type.value,
-                     price=price,
-                     quantity=quant,
-                     )
+    order = place_order(player, o_type, price, quant, o_cls=o_cls)
 
-    # Commit the order so that we can get an id.
-    database.db.commit()
+    ret = {'func': 'order_confirmed', 'order_id': order.id}
+    ret.update(get_order_delta(player, added=[order], o_cls=o_cls))
+    return ret
 
-    return {'func': 'order_confirmed', 'order_id': o.id}
 
+def create_orders_from_live_submit(player, orders_data, aggregates, o_cls=Order):
+    """
+    Validate and place several orders from one message.  Each order is checked against the player's
+    existing orders and the orders accepted before it, so the combined SHORTING and MARGIN checks
+    cover the whole batch.  Orders beyond MAX_ORDERS open orders are rejected with TOO_MANY_ORDERS.
+    @param orders_data: list of order form data
+    @param aggregates: OrderAggregates of the player's orders; placing an order adds it
+    @return: an orders_submitted message with an error code and order id (None if rejected) per order
+    """
+    results = []
+    added = []
+    for data in orders_data:
+        if len(aggregates.orders) >= MAX_ORDERS:
+            results.append({'error_code': OrderErrorCode.TOO_MANY_ORDERS.value, 'order_id': None})
+            continue
+
+        error_code, o_type, price, quant = is_order_valid(player, data, aggregates)
+        oid = None
+        if error_code == 0:
+            order = place_order(player, o_type, price, quant, o_cls=o_cls)
+            added.append(order)
+            oid = order.id
+        results.append({'error_code': error_code, 'order_id': oid})
 
-def get_orders_for_player_live(orders, show_notes):
-    orders_dicts = [o.to_dict() for o in orders]
+    ret = {'func': 'orders_submitted', 'results': results}
+    ret.update(get_order_delta(player, added=added, o_cls=o_cls))
+    return ret
 
-    for o in orders_dicts:
-        # Format price to two decimals
-        o['price'] = f"{o['price']:.2f}"
 
-        o['note'] = '&nbsp;'
-        if show_notes:
-            quant_orig = o.get('original_quantity')
-            quant = o.get('quantity')
+def format_order_for_live(o, show_notes):
+    """
+    Format an order's dictionary for the order list on the live pages.
+    """
+    # Format price to two decimals
+    o['price'] = f"{o['price']:.2f}"
+
+    o['note'] = '&nbsp;'
+    if show_notes:
+        quant_orig = o.get('original_quantity')
+        quant = o.get('quantity')
 
-            if o.get('is_buy_in'):
-                o['note'] = "<span class='auto-order'>Automatic</span>"
-            elif quant_orig != 0 and quant == 0:
-                o['note'] = "<span class='canceled-order'>Canceled</span>"
-            elif quant_orig is not None and quant_orig != quant:
-                o['note'] = f"Capped to {quant}"
+        if o.get('is_buy_in'):
+            o['note'] = "<span class='auto-order'>Automatic</span>"
+        elif quant_orig != 0 and quant == 0:
+            o['note'] = "<span class='canceled-order'>Canceled</span>"
+        elif quant_orig is not None and quant_orig != quant:
+            o['note'] = f"Capped to {quant}"
+    return o
 
+
+def get_orders_for_player_live(orders, show_notes):
+    orders_dicts = [format_order_for_live(o.to_dict(), show_notes) for o in orders]
     return dict(func='order_list', orders=orders_dicts)
 
 
+def get_order_delta(player, added=(), removed=(), o_cls=Order):
+    """
+    Describe a change to the player's order list.  The sequence number is the version of the
+    player's cached orders, which goes up by one per added or removed order; the page asks for
+    the full list if it sees a gap.
+    @param added: the new orders
+    @param removed: the ids of the removed orders
+    """
+    return dict(seq=order_cache.get_version(player, o_cls=o_cls),
+                added=[format_order_for_live(o.to_dict(), False) for o in added],
+                removed=list(removed))
+
+
 # noinspection PyUnresolvedReferences
 def delete_order(player, oid, o_cls=Order):
-    obs = o_cls.filter(player=player, id=oid)
-    for o in obs:
-        o_cls.delete(o)
+    """
+    @return: an order_delta message if the order was deleted, an empty dict otherwise
+    """
+    oid = int(oid)
+    # Only the player's own orders can be deleted
+    order = next((o for o in get_orders_for_player(player, o_cls=o_cls) if o.id == oid), None)
+    if order is None:
+        return {}
+
+    # Give back the order's short sale
+    if order.order_type == OrderType.OFFER.value:
+        held = max(player.shares, 0)
+        offered = get_order_aggregates(player, o_cls=o_cls).offer_quantity
+        short_sale = max(offered - held, 0) - max(offered - order.quantity - held, 0)
+        if short_sale:
+            short_interest.get_tracker(player.group).release(short_sale)
+
+    order_store.delete_order(player, oid, o_cls=o_cls)
+    order_book.forget_order(player.group, oid)
+    order_cache.remove_order(player, oid, o_cls=o_cls)
+
+    ret = {'func': 'order_delta'}
+    ret.update(get_order_delta(player, removed=[oid], o_cls=o_cls))
+    return ret
 
 
 def result_page_live_method(player, d, o_cls=Order):
@@ -317,23 +427,24 @@ def forecast_page_live_method(player, d, o_cls=Order):
     return market_page_live_method(player, d, o_cls=o_cls, show_warnings=False)
 
 
+@instrument_hook
 def market_page_live_method(player, d, o_cls=Order, show_warnings=True, show_notes=False):
     func = d['func']
 
+    ret = {}
     # Do delete first.  it might change the outcome of get_orders_for_player
     if func == 'delete_order':
-        delete_order(player, d['oid'], o_cls=o_cls)
+        ret.update(delete_order(player, d['oid'], o_cls=o_cls))
 
     orders_for_player = get_orders_for_player(player, o_cls=o_cls)
-    orders_by_type = get_orders_by_type(orders_for_player)
-    ret = {}
+    aggregates = get_order_aggregates(player, o_cls=o_cls)
     this_order_q = 0
     this_order_p = 0
     this_order_t = 'no_order'
 
     if func == 'submit-order':
         data = d['data']
-        error_code, t, p, q = is_order_valid(player, data, orders_by_type)
+        error_code, t, p, q = is_order_valid(player, data, aggregates)
 
         if error_code == 0:
             ret.update(create_order_from_live_submit(player, t, p, q, o_cls=o_cls))
@@ -343,35 +454,106 @@ def market_page_live_method(player, d, o_cls=Order, show_warnings=True, show_not
         else:
             ret.update({'func': 'order_rejected', 'error_code': error_code})
 
+    elif func == 'submit-orders':
+        ret.update(create_orders_from_live_submit(player, d['data'], aggregates, o_cls=o_cls))
+
     elif func == 'get_orders_for_player':
         ret.update(get_orders_for_player_live(orders_for_player, show_notes))
+        ret['seq'] = order_cache.get_version(player, o_cls=o_cls)
 
     # generate warnings
     if show_warnings:
-        warnings = get_order_warnings(player, this_order_t, this_order_p, this_order_q, orders_by_type)
+        warnings = get_order_warnings(player, this_order_t, this_order_p, this_order_q, aggregates)
         ret['warnings'] = warnings
 
+    # Write the group's buffered orders once the oldest has waited long enough
+    if order_store.flush_if_due(player.group_id, o_cls=o_cls):
+        database.db.commit()
+
     return {player.id_in_group: ret}
 
 
+# noinspection PyUnusedLocal
+def market_page_before_next_page(player, timeout_happened, o_cls=Order):
+    """
+    Write the group's buffered orders when a player leaves the market page, including on a timeout.
+    Without it, orders would only be written when a later live message or the market calculation
+    comes along.
+    """
+    order_store.flush_group(player.group_id, o_cls=o_cls)
+
+
 # END LIVE METHODS
 #######################################
 
 
 def get_orders_for_player(player, o_cls=Order):
-    return o_cls.filter(player=player)
+    return order_cache.get_orders(player, o_cls=o_cls)
+
+
+def get_order_aggregates(player, o_cls=Order):
+    return order_cache.get_aggregates(player, o_cls=o_cls)
+
+
+# Template variables that are the same for every player of a group, by group model and id.  Group
+# rows are per-round, so these are computed once per round, and dropped when the next round starts or
+# the market is over.
+GROUP_TEMPLATE_VARS = {}
+
+
+def group_vars_for_template(group: Group):
+    """
+    @return: the group-wide template variables.  The dict is shared and must not be changed.
+    """
+    key = (type(group), group.id)
+    ret = GROUP_TEMPLATE_VARS.get(key)
+    if ret is None:
+        ret = scf.ensure_config(group)
+        marg_req = ret.get(scf.SK_MARGIN_RATIO)
+        ret['marg_req_pct'] = f"{marg_req :.0%}"
+        ret['margin_buffer_pct'] = f"{1 + marg_req:.0%}"
+        ret['market_price'] = group.get_last_period_price()
+        ret['interest_pct'] = f"{scf.get_interest_rate(group):.0%}"
+        ret['dividends'] = " or ".join(str(d) for d in scf.get_dividend_amounts(group))
+        ret['buy_back'] = scf.get_fundamental_value(group)
+        ret['short'] = group.short
+        GROUP_TEMPLATE_VARS[key] = ret
+    return ret
+
+
+def get_result_short(group: Group):
+    """
+    @return: the group's total short after the market.  Tracked as the fills are applied;
+        groups whose market is not calculated by this app (e.g. practice) are summed on every call.
+    """
+    short = short_interest.get_result_short(group)
+    if short is None:
+        short = abs(sum(p.shares_result for p in group.get_players() if p.shares_result < 0))
+    return short
+
+
+def discard_group_template_vars(group: Group):
+    GROUP_TEMPLATE_VARS.pop((type(group), group.id), None)
+
+
+def discard_market(group: Group):
+    """
+    Drop what the module level registries hold for the group's market once it is over.  Called as each
+    player leaves the results; an entry read again by another player's page is dropped when they leave.
+    """
+    price_history.discard(group)
+    discard_group_template_vars(group)
+    short_interest.discard(group)
+    order_book.discard_book(group)
 
 
 def standard_vars_for_template(player: Player):
-    ret = scf.ensure_config(player)
-    marg_req = ret.get(scf.SK_MARGIN_RATIO)
-    ret['marg_req_pct'] = f"{marg_req :.0%}"
-    ret['margin_buffer_pct'] = f"{1 + marg_req:.0%}"
+    ret = dict(group_vars_for_template(player.group))
     ret['for_results'] = False
     ret['cash'] = player.cash
     ret['shares'] = player.shares
 
-    price = player.group.get_last_period_price()
+    price = ret['market_price']
     value_of_stock, equity, debt, limit, close = player.get_holding_details(price)
     ret['stock_val'] = value_of_stock
     ret['vos_neg_cls'] = 'neg-val' if value_of_stock < 0 else ''
@@ -383,11 +565,6 @@ def standard_vars_for_template(player: Player):
     ret['close_limit'] = close
     ret['is_short'] = player.is_short()
     ret['is_debt'] = player.is_debt()
-    ret['market_price'] = price
-    ret['interest_pct'] = f"{scf.get_interest_rate(player):.0%}"
-    ret['dividends'] = " or ".join(str(d) for d in scf.get_dividend_amounts(player))
-    ret['buy_back'] = scf.get_fundamental_value(player)
-    ret['short'] = player.group.short
 
     ret['messages'] = []  # The market page will populate this
     ret['attn_cls'] = ''
@@ -496,6 +673,7 @@ def get_short_message(limit, close, debt, delay, round_number):
     return class_attr, msg
 
 
+@instrument_hook
 def vars_for_market_template(player: Player):
     ret = standard_vars_for_template(player)
     ret['messages'] = get_messages(player, ret)
@@ -533,8 +711,7 @@ def vars_for_round_results_template(player: Player):
     ret['is_debt'] = player.is_debt()
     ret['market_price'] = price
 
-    short = abs(sum([p.shares_result for p in player.group.get_players() if p.shares_result < 0]))
-    ret['short'] = short
+    ret['short'] = get_result_short(player.group)
 
     filled_amount = abs(player.shares_transacted)
     orders = get_orders_for_player(player)
@@ -588,56 +765,124 @@ def get_round_result_messages(player: Player, d: dict):
     return messages
 
 
-async def await_send_signal(msg):
-    print(f"Sending Start Signal")
-    for socket in SOCKETS:
-        print(f"sending message {msg} to {socket}")
-        await socket.send(json.dumps(msg))
+def prepare_players(group: Group):
+    """
+    Copy the previous round's results to the group's players and determine their auto transaction statuses.
+    Does the same as Player.copy_results_from_previous_round and Player.determine_auto_trans_status for
+    each player, but loads the previous round in one query and checks the margins of all players at once.
+    @return: the players and the group in the previous round (None if it was not loaded)
+    """
+    players = group.get_players()
+    prev_players, prev_g = group.get_previous_round_records(players)
+    for p in players:
+        prev_p = prev_players.get(p.participant_id)
+        if prev_p:
+            p.cash = prev_p.cash_result
+            p.shares = prev_p.shares_result
+    if not players:
+        return players, prev_g
+
+    price = prev_g.price if prev_g is not None else group.get_last_period_price()
+    cash, shares = positions.pack_players(players)
+    status = positions.margin_status(cash, shares, to_cents(price), scf.get_margin_ratio(group))
+    auto_trans_delay = scf.get_auto_trans_delay(group)
+
+    for i, p in enumerate(players):
+        if not status.exact[i]:
+            p.determine_auto_trans_status()
+            continue
+
+        if status.bankrupt[i]:
+            p.periods_until_auto_buy = NO_AUTO_TRANS
+            p.periods_until_auto_sell = NO_AUTO_TRANS
+            continue
+
+        prev_p = prev_players.get(p.participant_id)
+        if status.short_mv[i]:
+            prev_delay = prev_p.field_maybe_none('periods_until_auto_buy') if prev_p else NO_AUTO_TRANS
+            p.periods_until_auto_buy = Player.calculate_delay(prev_delay, auto_trans_delay)
+        else:
+            p.periods_until_auto_buy = NO_AUTO_TRANS
 
+        if status.debt_mv[i]:
+            prev_delay = prev_p.field_maybe_none('periods_until_auto_sell') if prev_p else NO_AUTO_TRANS
+            p.periods_until_auto_sell = Player.calculate_delay(prev_delay, auto_trans_delay)
+        else:
+            p.periods_until_auto_sell = NO_AUTO_TRANS
 
-def send_signal(msg):
-    asyncio.run(await_send_signal(msg))
+    return players, prev_g
 
-def send_signal_in_thread(msg):
-    t = Thread(target=send_signal, args=[msg])
-    t.start()
-    t.join()
 
+@instrument_hook
 def pre_round_tasks(group: Group):
     assign_endowments(group)
 
     # Determine auto transaction statuses
     # And copy previous round results to the current player object
-    for p in group.get_players():
-        # Copy results from the previous player
-        p.copy_results_from_previous_round()
-
-        # update margin violations
-        p.determine_auto_trans_status()
+    players, prev_g = prepare_players(group)
 
     # Determine the float and set it on all group objects
+    short = None
     if group.round_number == 1:
         group.determine_float()
     else:
         # copy float from previous round
-        prev_g = group.in_round_or_none(group.round_number - 1)
+        if prev_g is None:
+            prev_g = group.in_round_or_none(group.round_number - 1)
         if prev_g:  # should be guaranteed a group object here, but just in case.
             group.float = prev_g.float
+            # The short after last round's fills is where this round starts
+            short = short_interest.get_result_short(prev_g)
+            order_store.flush_group(prev_g.id)
+            order_cache.discard_group(prev_g)
+            discard_group_template_vars(prev_g)
+            short_interest.discard(prev_g)
 
     # Calculate total shorts
-    group.short = abs(sum(p.shares for p in group.get_players() if p.shares < 0))
+    if short is None:
+        short = abs(sum(p.shares for p in players if p.shares < 0))
+    group.short = short
 
-    send_signal_in_thread({"type":"page", "page":"", "round": group.round_number})
+    trigger.start_thread()
+    HUB.send({"type":"page", "page":"", "round": group.round_number})
 
 #######################################
 # CALCULATE MARKET
+@instrument_hook
 def calculate_market(group: Group):
+    order_store.flush_group(group.id)
     cm = CallMarket(group)
     cm.calculate_market()
+    price_history.record_group(group)
+    order_book.discard_book(group)
+    # Orders were filled / created during the calculation.
+    order_cache.discard_group(group)
 
     for p in group.get_players():
         # Process current round forecasts
         p.determine_forecast_reward(group.price)
+        p.record_market_equity()
+
+
+@instrument_hook
+def calculate_subsession_market(subsession: Subsession):
+    groups = subsession.get_groups()
+    for group in groups:
+        order_store.flush_group(group.id)
+    calculate_markets(groups, scf.get_clearing_workers(subsession))
+
+    for group in groups:
+        price_history.record_group(group)
+        order_book.discard_book(group)
+        order_cache.discard_group(group)
+        for p in group.get_players():
+            # Process current round forecasts
+            p.determine_forecast_reward(group.price)
+            p.record_market_equity()
+
+
+def is_group_clearing(player: Player):
+    return not scf.is_subsession_clearing(player)
 
 
 def not_displayed_for_simulation(player: Player):
@@ -667,7 +912,8 @@ def custom_export(players):
 
 def vars_for_admin_report(subsession: BaseSubsession):
     group = subsession.get_groups()[0]
-    return {"orders": Order.filter(group=group)}
+    return {"orders": Order.filter(group=group),
+            "hook_metrics": get_summary_rows()}
 
 
 ############
@@ -688,6 +934,7 @@ class Market(Page):
     js_vars = get_js_vars
     vars_for_template = vars_for_market_template
     live_method = market_page_live_method
+    before_next_page = market_page_before_next_page
 
 
 class MarketGridChoice(Page):
@@ -698,6 +945,7 @@ class MarketGridChoice(Page):
     js_vars = get_js_vars
     vars_for_template = vars_for_market_template
     live_method = market_page_live_method
+    before_next_page = market_page_before_next_page
 
 
 class Fixate(Page):
@@ -720,6 +968,13 @@ class ForecastPage(Page):
 
 class MarketWaitPage(WaitPage):
     after_all_players_arrive = calculate_market
+    is_displayed = is_group_clearing
+
+
+class SubsessionMarketWaitPage(WaitPage):
+    wait_for_all_groups = True
+    after_all_players_arrive = calculate_subsession_market
+    is_displayed = scf.is_subsession_clearing
 
 
 class RoundResultsPage(Page):
@@ -742,15 +997,16 @@ class RoundResultsPage(Page):
             participant = player.participant
             participant.MARKET_PAYMENT = cu(0)
 
-            forecast_bonus = 0
-            for p in player.in_all_rounds():
-                forecast_bonus += p.forecast_reward
-            participant.FORECAST_PAYMENT = cu(forecast_bonus)
+            participant.FORECAST_PAYMENT = cu(player.get_forecast_total())
 
             return upcoming_apps[0]
 
     @staticmethod
+    @instrument_hook('RoundResultsPage.before_next_page')
     def before_next_page(player: Player, timeout_happened):
+        # Orders submitted on the results page are not written by a market calculation
+        order_store.flush_group(player.group_id)
+
         if player.round_number != Constants.num_rounds:
             return
 
@@ -760,17 +1016,14 @@ class RoundResultsPage(Page):
         # Market Bonus - Final equity with STOCK at Fundamental Value
         market_bonus = 0
         if not bankrupt:
-            stock_value = player.shares_result * scf.get_fundamental_value(player)
-            total_equity = stock_value + player.cash_result
+            total_equity = player.get_market_equity()
             bonus_cap = scf.get_bonus_cap(player)
             market_bonus = min(total_equity, bonus_cap)
 
         participant.MARKET_PAYMENT = cu(market_bonus)
 
         # Forecast Bonus
-        forecast_bonus = 0
-        for p in player.in_all_rounds():
-            forecast_bonus += p.forecast_reward
+        forecast_bonus = player.get_forecast_total()
         participant.FORECAST_PAYMENT = cu(forecast_bonus)
 
         # Determine total bonus and round up to whole dollar amount.
@@ -781,6 +1034,9 @@ class RoundResultsPage(Page):
             bonus = ceil(bonus / conversion) * conversion
         participant.payoff = max(bonus, 0)
 
+        # The market is over for this player
+        discard_market(player.group)
+
 
 class FinalResultsPage(Page):
     js_vars = get_js_vars_round_results
@@ -806,4 +1062,4 @@ class FinalResultsPage(Page):
 
 page_sequence = [PreMarketWait,
                  MarketGridChoice,
-                 ForecastPage, MarketWaitPage, RoundResultsPage, FinalResultsPage]
+                 ForecastPage, MarketWaitPage, SubsessionMarketWaitPage, RoundResultsPage, FinalResultsPage]
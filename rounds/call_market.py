@@ -1,20 +1,32 @@
 import random
 from collections import defaultdict
 
+import numpy as np
+
 from rounds.models import *
-from call_market_price import MarketPrice, OrderFill
-from rounds.data_structs import DataForPlayer
+from call_market_price import OrderFill
+from rounds import clearing, order_book, positions, short_interest
+from rounds.data_structs import DataForPlayer, DataForOrder, update_players, update_orders
 
+# Upper bound on the margin call iterations.  Each one re-clears the packed book, so this bounds the
+# extra work on the wait page even if the automatic orders keep moving the price.
+MAX_MARGIN_CALL_ITERATIONS = 10
 
 class CallMarket:
 
     def __init__(self, group: Group):
         self.group = group
+        # Load players before orders so that the orders' player links resolve without extra queries
+        self.player_records = group.get_player_records()
         self.bids, self.offers = self.get_orders_for_group()
         self.dividend = self.get_dividend()
         self.interest_rate = scf.get_interest_rate(group)
-        self.orders_by_player = get_orders_by_player(concat_or_null([self.bids, self.offers]))
-        self.players = ensure_player_data(group.get_players())
+        # Fills are recorded on the data objects and written back in bulk by final_updates
+        self.order_data = ensure_order_data(concat_or_null([self.bids, self.offers]))
+        self.orders_by_player = get_orders_by_player(self.order_data)
+        self.players = ensure_player_data([r.player for r in self.player_records.values()])
+        self.algo_orders = None
+        self.short_change = 0
 
 
     def get_orders_for_group(self):
@@ -33,60 +45,203 @@ class CallMarket:
 
     def calculate_market(self):
         market_price, market_volume = self.get_market_price()
-        market_price = market_price
-        market_volume = market_volume
-        self.fill_orders(market_price)
-
-        # Compute new player positions
-        for player in self.players:
-            #this call will mutate the player data
-            self.compute_player_position(player, market_price)
-
+        self.apply_market_price(market_price)
 
         # Perform final updates
         # with the last completed iteration.
         self.final_updates(market_price, market_volume)
 
+    def apply_market_price(self, market_price):
+        self.fill_orders(market_price)
 
-    def get_market_price(self):
-        # Calculate the Market Price
-        algo_orders = self.get_algo_orders()
-        algo_bids = [o for o in algo_orders if OrderType(o.order_type) == OrderType.BID]
-        algo_offers = [o for o in algo_orders if OrderType(o.order_type) == OrderType.OFFER]
+        # Compute new player positions for the whole group at once
+        self.compute_positions(market_price)
+        short_interest.record_fills(self.group, self.short_change)
 
+    def get_market_price(self):
+        func, args = self.get_clearing_task()
+        market_price, market_volume = func(*args)
+        return cu(market_price), market_volume
 
-        b = concat_or_null([self.bids, algo_bids])
-        o = concat_or_null([self.offers, algo_offers])
+    def get_clearing_task(self):
+        """
+        Pack the group's orders for the clearing engine.  The task only holds arrays and numbers, so
+        it can be run away from the database session (see calculate_markets).
+        @return: a (function, args) tuple; calling the function returns the market price (dollars) and volume
+        """
+        algo_orders = self.get_algo_orders()
         last_price = self.group.get_last_period_price()
 
-        mp = MarketPrice(b, o)
-        market_price, market_volume = mp.get_market_price(last_price=last_price)
-        return cu(market_price), market_volume
+        if not algo_orders:
+            book = self.get_order_book()
+            if book is not None:
+                # With one side empty the curves have no executable volume and the last price is kept
+                levels, cbq, csq = book.get_curves()
+                return clearing.select_price, (levels, cbq, csq, last_price)
+            b, o = self.bids, self.offers
+        else:
+            # Automatic orders cancel some of the players' orders, so the book is packed from the order data
+            active = [d for d in self.order_data if d.quantity > 0]
+            b = [d for d in active if OrderType(d.order_type) == OrderType.BID]
+            o = [d for d in active if OrderType(d.order_type) == OrderType.OFFER]
+
+        bid_prices, bid_quants = clearing.pack_orders(b)
+        offer_prices, offer_quants = clearing.pack_orders(o)
+        return clearing.clear, (bid_prices, bid_quants, offer_prices, offer_quants, last_price)
+
+    def get_order_book(self):
+        """
+        Get the order book maintained during the Market page.  The book is only used if it holds
+        exactly the orders read for this group.  Otherwise (e.g. after a restart or for orders
+        created outside of the live methods) the curves are rebuilt from the orders.
+        @return: OrderBook or None
+        """
+        book = order_book.peek_book(self.group)
+        if book is None or not book.matches(concat_or_null([self.bids, self.offers])):
+            return None
+        return book
 
 
     def fill_orders(self, market_price):
-        of = OrderFill(concat_or_null([self.bids, self.offers]))
+        of = OrderFill(self.order_data or [])
         of.fill_orders(market_price)
 
 
     def compute_player_position(self, data_for_player, market_price):
-        orders = self.orders_by_player[data_for_player.player]
+        orders = self.orders_by_player[data_for_player.player.id]
         data_for_player.get_new_player_position(orders, self.dividend, self.interest_rate, market_price)
 
+    def compute_positions(self, market_price):
+        """
+        Compute the new positions and margin flags for all players with the vectorized kernel.
+        Players whose amounts fall on a rounding tie are recomputed one at a time with Currency
+        arithmetic, so the results are the same as compute_player_position.
+        @param market_price: The market price
+        """
+        if not self.players:
+            return
+
+        idx_by_id = {d.player.id: i for i, d in enumerate(self.players)}
+        orders = [o for o in (self.order_data or []) if o.player_id in idx_by_id]
+        order_idx = np.fromiter((idx_by_id[o.player_id] for o in orders), dtype=np.int64, count=len(orders))
+        order_types = [o.order_type for o in orders]
+        quantities_final = [o.quantity_final for o in orders]
+
+        cash, shares = positions.pack_players([d.player for d in self.players])
+        price = clearing.to_cents(market_price)
+        shares_transacted = positions.net_shares(order_idx, order_types, quantities_final, len(self.players))
+        pos = positions.compute_positions(cash, shares, shares_transacted, price, self.dividend, self.interest_rate)
+        self.short_change = short_interest.short_change(shares, pos.shares_result)
+
+        margin_ratio = scf.get_margin_ratio(self.group)
+        mv_short, _ = positions.mv_short_mask(pos.shares_result, pos.cash_result, price, margin_ratio)
+        mv_debt, mv_debt_exact = positions.mv_debt_mask(pos.shares_result, pos.cash_result, price, margin_ratio)
+
+        for i, d in enumerate(self.players):
+            if not pos.exact[i]:
+                self.compute_player_position(d, market_price)
+                d.set_mv_short_future(margin_ratio, market_price)
+                d.set_mv_debt_future(margin_ratio, market_price)
+                continue
+
+            d.shares_transacted = int(pos.shares_transacted[i])
+            d.shares_result = int(pos.shares_result[i])
+            d.new_position = d.shares_result
+            d.trans_cost = positions.to_cu(pos.trans_cost[i])
+            d.cash_after_trade = positions.to_cu(pos.cash_after_trade[i])
+            d.dividend_earned = pos.dividend_earned[i]
+            d.interest_earned = positions.to_cu(pos.interest_earned[i])
+            d.cash_result = positions.to_cu(pos.cash_result[i])
+
+            d.mv_short_future = bool(mv_short[i])
+            if mv_debt_exact[i]:
+                d.mv_debt_future = bool(mv_debt[i])
+            else:
+                d.set_mv_debt_future(margin_ratio, market_price)
+
 
     def final_updates(self, market_price, market_volume):
-        # Final Updates
-        for p_data in self.players:
-            p_data.update_player()
+        # Final Updates - players and orders are written back in batches
+        update_players(self.players)
+        update_orders(self.order_data)
+        self.update_group(market_price, market_volume)
 
-        # Update the group
+    def update_group(self, market_price, market_volume):
         self.group.price = market_price
         self.group.volume = market_volume
         self.group.dividend = self.dividend
 
 
     def get_algo_orders(self):
-        return []
+        """
+        The automatic buy-in and sell-off orders of the market (see run_margin_calls).  They are
+        generated the first time they are needed.
+        @return: list of DataForOrder
+        """
+        if self.algo_orders is None:
+            self.algo_orders = self.run_margin_calls()
+        return self.algo_orders
+
+    def run_margin_calls(self):
+        """
+        Margin call stage.  A player whose automatic buy-in (sell-off) is due and whose position is in
+        violation at the candidate price gets an automatic BID (OFFER), which cancels the player's
+        OFFERS (BIDS).  The book is cleared again with the automatic orders until the price stops
+        moving, at most MAX_MARGIN_CALL_ITERATIONS times (see positions.margin_calls).  The iterations
+        only use packed arrays; order objects are made for the final automatic orders only.
+        The canceled orders are canceled on the order data and the automatic orders are added to it.
+        @return: list of DataForOrder
+        """
+        n = len(self.players or [])
+        auto_buy = np.fromiter((d.player.periods_until_auto_buy == 0 for d in self.players or []), dtype=bool, count=n)
+        auto_sell = np.fromiter((d.player.periods_until_auto_sell == 0 for d in self.players or []), dtype=bool,
+                                count=n)
+        if not (auto_buy.any() or auto_sell.any()):
+            return []
+
+        cash, shares = positions.pack_players([d.player for d in self.players])
+        orders = self.order_data or []
+        idx_by_id = {d.player.id: i for i, d in enumerate(self.players)}
+        order_idx = np.fromiter((idx_by_id.get(o.player_id, -1) for o in orders), dtype=np.int64, count=len(orders))
+        is_bid = np.fromiter((o.order_type == OrderType.BID.value for o in orders), dtype=bool, count=len(orders))
+        order_prices, order_quants = clearing.pack_orders(orders)
+
+        calls = positions.margin_calls(cash, shares, auto_buy, auto_sell, order_idx, is_bid, order_prices,
+                                       order_quants, self.group.get_last_period_price(),
+                                       scf.get_margin_ratio(self.group),
+                                       scf.get_margin_target_ratio(self.group),
+                                       scf.get_margin_premium(self.group),
+                                       MAX_MARGIN_CALL_ITERATIONS)
+        buying, buy_at, buy_quant = calls.buying, calls.buy_at, calls.buy_quant
+        selling, sell_at, sell_quant = calls.selling, calls.sell_at, calls.sell_quant
+        canceled = calls.canceled
+
+        if not (buying.any() or selling.any()):
+            return []
+
+        for o, cancel in zip(orders, canceled):
+            if cancel:
+                o.cancel()
+
+        algo_orders = []
+        for i in np.flatnonzero(buying):
+            algo_orders.append(DataForOrder(player=self.players[i].player,
+                                            group=self.group,
+                                            order_type=OrderType.BID.value,
+                                            price=positions.to_cu(buy_at),
+                                            quantity=int(buy_quant[i]),
+                                            is_buy_in=True))
+        for i in np.flatnonzero(selling):
+            algo_orders.append(DataForOrder(player=self.players[i].player,
+                                            group=self.group,
+                                            order_type=OrderType.OFFER.value,
+                                            price=positions.to_cu(sell_at),
+                                            quantity=int(sell_quant[i]),
+                                            is_buy_in=True))
+
+        self.order_data = orders + algo_orders
+        self.orders_by_player = get_orders_by_player(self.order_data)
+        return algo_orders
 
     @staticmethod
     def get_total_quantity(offers):
@@ -97,6 +252,31 @@ class CallMarket:
 
 
 
+def calculate_markets(groups, max_workers):
+    """
+    Clear the independent markets of a subsession together.  The orders of all groups are read
+    and packed first, the prices are determined on a thread pool, and the results of all groups
+    are written back in one batch.
+    @param groups: the groups of the subsession
+    @param max_workers: the number of threads used for clearing
+    """
+    markets = [CallMarket(g) for g in groups]
+    tasks = [cm.get_clearing_task() for cm in markets]
+    results = clearing.run_tasks(tasks, max_workers)
+
+    all_players = []
+    all_orders = []
+    for cm, (market_price, market_volume) in zip(markets, results):
+        market_price = cu(market_price)
+        cm.apply_market_price(market_price)
+        cm.update_group(market_price, market_volume)
+        all_players.extend(cm.players)
+        all_orders.extend(cm.order_data or [])
+
+    update_players(all_players)
+    update_orders(all_orders)
+
+
 def concat_or_null(list_of_list_of_orders):
     all_none = True
     for o_list in list_of_list_of_orders:
@@ -112,15 +292,26 @@ def concat_or_null(list_of_list_of_orders):
 
 
 def get_orders_by_player(orders):
+    """
+    Partition orders by the id of the player that placed them.
+    Uses the foreign key, so the player does not need to be loaded.
+    """
     d = defaultdict(list)
     if orders is None:
         return d
 
     for o in orders:
-        d[o.player].append(o)
+        d[o.player_id].append(o)
     return d
 
 
+def ensure_order_data(orders):
+    if orders is None:
+        return orders
+
+    return [o if isinstance(o, DataForOrder) else DataForOrder(o) for o in orders]
+
+
 def ensure_player_data(players):
     if players is None:
         return players
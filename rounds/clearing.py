@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+CENTS = 100
+
+
+def to_cents(price):
+    """
+    Convert a price (Currency, float or int) to whole cents.
+    """
+    return int(round(price * CENTS))
+
+
+def pack_orders(orders):
+    """
+    Pack a list of order objects into integer-cent price and quantity arrays.
+    @param orders: iterable of objects with price and quantity attributes (Order or DataForOrder), or None
+    @return: a tuple of two int64 numpy arrays: prices in cents, quantities
+    """
+    if not orders:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    prices = np.fromiter((to_cents(o.price) for o in orders), dtype=np.int64, count=len(orders))
+    quants = np.fromiter((o.quantity for o in orders), dtype=np.int64, count=len(orders))
+    return prices, quants
+
+
+def build_curves(bid_prices, bid_quants, offer_prices, offer_quants):
+    """
+    Build the demand and supply curves over every distinct price level in the book.
+    @param bid_prices: int64 array of bid prices in cents
+    @param bid_quants: int64 array of bid quantities
+    @param offer_prices: int64 array of offer prices in cents
+    @param offer_quants: int64 array of offer quantities
+    @return: levels - sorted distinct price levels (cents)
+    @return: cbq - cumulative bid quantity at or above each level
+    @return: csq - cumulative offer quantity at or below each level
+    """
+    levels = np.unique(np.concatenate((bid_prices, offer_prices)))
+    n = len(levels)
+
+    bid_depth = np.bincount(np.searchsorted(levels, bid_prices), weights=bid_quants, minlength=n)
+    offer_depth = np.bincount(np.searchsorted(levels, offer_prices), weights=offer_quants, minlength=n)
+
+    cbq = np.cumsum(bid_depth[::-1])[::-1].astype(np.int64)
+    csq = np.cumsum(offer_depth).astype(np.int64)
+    return levels, cbq, csq
+
+
+def select_price(levels, cbq, csq, last_price):
+    """
+    Choose the clearing price from the demand and supply curves.  The principles are applied in order
+    until a single candidate remains:
+        1. Maximum executable volume
+        2. Least residual (surplus) volume
+        3. Market pressure - the highest price with excess demand and/or the lowest price with excess supply
+        4. Reference - the highest remaining candidate
+    If the resulting volume is zero the last price is kept.
+    @param levels: sorted price levels in cents
+    @param cbq: cumulative bid quantity for each level
+    @param csq: cumulative offer quantity for each level
+    @param last_price: the market price of the previous period
+    @return: The market price (dollars) and the volume
+    """
+    if len(levels) == 0:
+        return last_price, 0
+
+    mev = np.minimum(cbq, csq)
+    candidates = mev == mev.max()
+
+    # Least residual
+    if np.count_nonzero(candidates) > 1:
+        residual = np.abs(cbq - csq)
+        candidates &= residual == residual[candidates].min()
+
+    # Market pressure
+    if np.count_nonzero(candidates) > 1:
+        # A level where the curves meet counts as buy pressure, as in MarketPrice
+        buy_pressure = cbq >= csq
+        pressure_cand = np.zeros_like(candidates)
+
+        buy_idx = np.flatnonzero(candidates & buy_pressure)
+        if len(buy_idx):
+            pressure_cand[buy_idx[-1]] = True
+
+        sell_idx = np.flatnonzero(candidates & ~buy_pressure)
+        if len(sell_idx):
+            pressure_cand[sell_idx[0]] = True
+
+        candidates = pressure_cand
+
+    # Reference price
+    idx = np.flatnonzero(candidates)[-1]
+    volume = int(mev[idx])
+    if volume == 0:
+        return last_price, 0
+
+    return int(levels[idx]) / CENTS, volume
+
+
+def clear(bid_prices, bid_quants, offer_prices, offer_quants, last_price):
+    """
+    Determine the market price and volume for packed bid and offer arrays.
+    @return: The market price (dollars) and the volume
+    """
+    if len(bid_prices) == 0 or len(offer_prices) == 0:
+        return last_price, 0
+
+    levels, cbq, csq = build_curves(bid_prices, bid_quants, offer_prices, offer_quants)
+    return select_price(levels, cbq, csq, last_price)
+
+
+def priority_fill(order, quants, volume):
+    """
+    Fill the orders in priority order until the volume is used up; the last one may be partially filled.
+    @param order: the indexes of the orders in priority order
+    @param quants: int64 array of the quantities of all of the orders
+    @param volume: the volume to fill
+    @return: int64 array of the filled quantities of all of the orders
+    """
+    filled = np.zeros(len(quants), dtype=np.int64)
+    q = quants[order]
+    before = np.cumsum(q) - q
+    filled[order] = np.clip(volume - before, 0, q)
+    return filled
+
+
+def fill(is_bid, prices, quants, market_price):
+    """
+    Vector form of OrderFill.fill_orders.  The bids at or above the market price and the offers at or
+    below it are filled up to the smaller of their volumes.  The side with the larger volume is filled
+    in priority order: bids by descending price then quantity, offers by ascending price then quantity,
+    and ties in the order given.
+    @param is_bid: mask of the BID orders
+    @param prices: int64 array of order prices in cents
+    @param quants: int64 array of order quantities
+    @param market_price: the market price in cents
+    @return: int64 array of the filled quantities (quantity_final)
+    """
+    bids = np.flatnonzero(is_bid & (prices >= market_price))
+    offers = np.flatnonzero(~is_bid & (prices <= market_price))
+    volume = min(quants[bids].sum(), quants[offers].sum())
+
+    # lexsort is stable and sorts by the last key first
+    bids = bids[np.lexsort((-quants[bids], -prices[bids]))]
+    offers = offers[np.lexsort((quants[offers], prices[offers]))]
+    return priority_fill(bids, quants, volume) + priority_fill(offers, quants, volume)
+
+
+def get_market_price(bids, offers, last_price):
+    """
+    Determine the market price and volume for lists of bids and offers.
+    @param bids: list of bid orders or None
+    @param offers: list of offer orders or None
+    @param last_price: the market price of the previous period
+    @return: The market price (dollars) and the volume
+    """
+    bid_prices, bid_quants = pack_orders(bids)
+    offer_prices, offer_quants = pack_orders(offers)
+    return clear(bid_prices, bid_quants, offer_prices, offer_quants, last_price)
+
+
+def run_tasks(tasks, max_workers):
+    """
+    Run clearing tasks for independent markets, concurrently when there is more than one.
+    @param tasks: list of (function, args) tuples, e.g. (clear, (bid_prices, ..., last_price))
+    @param max_workers: the size of the thread pool
+    @return: list of the (market price, volume) results in the order of the tasks
+    """
+    if len(tasks) <= 1 or max_workers <= 1:
+        return [func(*args) for func, args in tasks]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        futures = [executor.submit(func, *args) for func, args in tasks]
+        return [f.result() for f in futures]
@@ -1,10 +1,19 @@
 import math
 
 import numpy as np
+from otree.api import cu
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.orm.attributes import set_committed_value
 
 from common import SessionConfigFunctions as scf
+from rounds import order_store
 from rounds.models import Order, Player, OrderType
 
+PLAYER_RESULT_FIELDS = ('shares_result', 'shares_transacted', 'trans_cost', 'cash_after_trade',
+                        'dividend_earned', 'interest_earned', 'cash_result')
+PLAYER_INT_FIELDS = {'shares_result', 'shares_transacted'}
+ORDER_RESULT_FIELDS = ('quantity', 'quantity_final', 'original_quantity', 'is_buy_in')
+
 
 class DataForOrder:
     def __init__(self, o=None,
@@ -20,6 +29,7 @@ class DataForOrder:
             self.order = o
             self.id = None
             self.player = player
+            self.player_id = player.id if player is not None else None
             self.group = group
             self.order_type = order_type
             self.price = price
@@ -32,6 +42,7 @@ class DataForOrder:
         self.order = o
         self.id = o.id
         self.player = o.player
+        self.player_id = o.player_id
         self.group = o.group
         self.order_type = o.order_type
         self.price = o.price
@@ -46,7 +57,9 @@ class DataForOrder:
 
     def update_order(self):
         if self.order is None:
-            self.order = Order.create(player=self.player,
+            # The id comes from the same blocks as the orders submitted on the live pages
+            self.order = Order.create(id=order_store.next_order_id(),
+                                      player=self.player,
                                       group=self.group,
                                       order_type=self.order_type,
                                       price=self.price,
@@ -61,6 +74,20 @@ class DataForOrder:
             o.original_quantity = self.original_quantity
             o.is_buy_in = self.is_buy_in
 
+    def get_results(self):
+        return dict(quantity=self.quantity,
+                    quantity_final=self.quantity_final,
+                    original_quantity=self.original_quantity,
+                    is_buy_in=bool(self.is_buy_in))
+
+    def get_new_row(self):
+        row = self.get_results()
+        row.update(player_id=self.player.id,
+                   group_id=self.group.id,
+                   order_type=self.order_type,
+                   price=cu(self.price))
+        return row
+
     def __eq__(self, other):
         return np.all((
             eq_with_none(self.id, other.id),
@@ -188,6 +215,18 @@ class DataForPlayer:
                             quantity=number_of_shares,
                             is_buy_in=True)
 
+    def get_results(self):
+        """
+        @return: dict of the result fields converted to the types of the Player columns
+        """
+        ret = {}
+        for field in PLAYER_RESULT_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                value = int(value) if field in PLAYER_INT_FIELDS else cu(value)
+            ret[field] = value
+        return ret
+
     def update_player(self):
         p = self.player
         p.shares_result = self.shares_result
@@ -220,6 +259,88 @@ class DataForPlayer:
         return self.__str__()
 
 
+def get_db_session(obj):
+    """
+    @return: the database session the object is attached to, or None if it is not a persistent model
+    """
+    state = inspect(obj, raiseerr=False)
+    return state.session if state is not None else None
+
+
+def update_players(player_data):
+    """
+    Write the results for all players back with a single executemany UPDATE.
+    The loaded Player objects are refreshed in place without being marked dirty, so they
+    are not flushed again at commit.
+    Players not attached to a database session are updated attribute by attribute.
+    @param player_data: list of DataForPlayer
+    """
+    if not player_data:
+        return
+
+    session = get_db_session(player_data[0].player)
+    if session is None:
+        for d in player_data:
+            d.update_player()
+        return
+
+    rows = []
+    for d in player_data:
+        results = d.get_results()
+        rows.append(dict(results, b_id=d.player.id))
+        for field, value in results.items():
+            set_committed_value(d.player, field, value)
+
+    table = Player.__table__
+    stmt = (table.update()
+            .where(table.c.id == bindparam('b_id'))
+            .values({f: bindparam(f) for f in PLAYER_RESULT_FIELDS}))
+    session.execute(stmt, rows)
+
+
+def update_orders(order_data):
+    """
+    Write the filled quantities back with a single executemany UPDATE for existing orders
+    and a single executemany INSERT for orders created during the market (e.g. automatic orders).
+    Orders not attached to a database session are updated / created one at a time.
+    @param order_data: list of DataForOrder
+    """
+    if not order_data:
+        return
+
+    existing = [d for d in order_data if d.order is not None]
+    new = [d for d in order_data if d.order is None]
+
+    session = None
+    if existing:
+        session = get_db_session(existing[0].order)
+    elif new:
+        session = get_db_session(new[0].player)
+
+    if session is None:
+        for d in order_data:
+            d.update_order()
+        return
+
+    table = Order.__table__
+    if existing:
+        rows = []
+        for d in existing:
+            results = d.get_results()
+            rows.append(dict(results, b_id=d.id))
+            for field, value in results.items():
+                set_committed_value(d.order, field, value)
+
+        stmt = (table.update()
+                .where(table.c.id == bindparam('b_id'))
+                .values({f: bindparam(f) for f in ORDER_RESULT_FIELDS}))
+        session.execute(stmt, rows)
+
+    if new:
+        # Ids come from the same blocks as the orders submitted on the live pages
+        session.execute(table.insert(), [dict(d.get_new_row(), id=order_store.next_order_id()) for d in new])
+
+
 def eq_with_none(o1, o2):
     eq = False
     if o1 is None and o2 is None:
@@ -1,7 +1,10 @@
+from collections import namedtuple
 from enum import Enum
 
 from otree.api import *
 from otree.common import InvalidRoundError
+from otree.database import dbq
+from otree.models import Participant
 
 import common.SessionConfigFunctions as scf
 
@@ -51,6 +54,7 @@ class OrderErrorCode(Enum):
     QUANT_LEN_RAW = (2048, OrderField.QUANTITY, 'This input is too long.  Please provide a shorter input.')
     SHORTING =  (4096, OrderField.QUANTITY, 'You are attempting to sell more shares that you have.  Please reduce the quantity.')
     MARGIN =  (8192, OrderField.PRICE, 'The total cost of your combined BUYs exceeds your current amount of CASH. Please reduce either the price or quantity of this order.')
+    TOO_MANY_ORDERS = (16384, OrderField.TYPE, 'You already have the most orders allowed.  Cancel an order to place another.')
 
     def combine(self, code):
         if type(code) is OrderErrorCode:
@@ -69,6 +73,9 @@ class Subsession(BaseSubsession):
 
 NO_SHORT_LIMIT = -199
 
+# Lightweight view of a player loaded together with the participant data needed by the market
+PlayerRecord = namedtuple('PlayerRecord', ['player', 'consent'])
+
 
 class Group(BaseGroup):
     price = models.CurrencyField()
@@ -113,8 +120,46 @@ class Group(BaseGroup):
         allowable = max_short_shares - self.short
         return max(allowable, 0)
 
+    def get_player_records(self):
+        """
+        Load the group's players joined with their participants in a single query.
+        Orders loaded afterward will resolve o.player from the session rather than with a query per order.
+        @return: dict of PlayerRecord keyed by player id, in id_in_group order
+        """
+        rows = (dbq(Player, Participant)
+                .join(Participant, Player.participant_id == Participant.id)
+                .filter(Player.group_id == self.id)
+                .order_by(Player.id_in_group))
+        return {p.id: PlayerRecord(p, bool(part.vars.get('CONSENT'))) for p, part in rows}
+
+    def get_previous_round_records(self, players):
+        """
+        Load the previous round's players of the given players' participants, together with their
+        groups, in a single query.
+        @param players: this round's players
+        @return: dict of previous-round Player keyed by participant id, and this group in the previous
+                 round (None in the first round, or if none of its players were loaded)
+        """
+        if self.round_number == 1 or not players:
+            return {}, None
+
+        rows = (dbq(Player, Group)
+                .join(Group, Player.group_id == Group.id)
+                .filter(Player.session_id == self.session_id)
+                .filter(Player.round_number == self.round_number - 1)
+                .filter(Player.participant_id.in_([p.participant_id for p in players])))
+
+        prev_players = {}
+        prev_group = None
+        for p, g in rows:
+            prev_players[p.participant_id] = p
+            if g.id_in_subsession == self.id_in_subsession:
+                prev_group = g
+        return prev_players, prev_group
+
     def determine_float(self):
-        total_shares = sum(p.shares for p in self.get_players() if p.did_give_consent())
+        records = self.get_player_records().values()
+        total_shares = sum(r.player.shares for r in records if r.consent)
         self.float = total_shares
 
 
@@ -302,9 +347,41 @@ class Player(BasePlayer):
             reward = scf.get_forecast_reward(self)
             threshold = scf.get_forecast_thold(self)
             forecast_reward = reward if forecast_error <= threshold else 0
+            old_reward = self.field_maybe_none('forecast_reward') or 0
             self.forecast_error = forecast_error
             self.forecast_reward = forecast_reward
 
+            # Keep a running total on the participant so the final payment doesn't need every round.
+            # Replacing this round's reward keeps the total right if the reward is determined again.
+            participant = self.participant
+            total = participant.vars.get('FORECAST_TOTAL', cu(0))
+            participant.FORECAST_TOTAL = total + forecast_reward - old_reward
+
+    def record_market_equity(self):
+        """
+        Keep a snapshot of the round's final equity, with the stock at fundamental value, on the participant.
+        """
+        stock_value = self.shares_result * scf.get_fundamental_value(self)
+        self.participant.MARKET_EQUITY = stock_value + self.cash_result
+
+    def get_forecast_total(self):
+        """
+        @return: the forecast rewards of all rounds so far.  Sessions created before the running total
+                 was kept are summed over all rounds.
+        """
+        total = self.participant.vars.get('FORECAST_TOTAL')
+        if total is None:
+            total = sum(p.forecast_reward for p in self.in_all_rounds())
+        return total
+
+    def get_market_equity(self):
+        """
+        @return: the final equity of the round, from the snapshot if there is one
+        """
+        if self.participant.vars.get('MARKET_EQUITY') is None:
+            self.record_market_equity()
+        return self.participant.vars.get('MARKET_EQUITY')
+
     @staticmethod
     def calculate_delay(current_delay, base):
         if current_delay == NO_AUTO_TRANS:
@@ -0,0 +1,152 @@
+import numpy as np
+
+from rounds import clearing
+from rounds.models import OrderType
+
+# Open order books by group model and id, since the practice app has its own groups.  Group rows are
+# per-round so this is effectively per-group, per-round.
+BOOKS = {}
+
+
+class OrderBook:
+    """
+    In-memory order book for one group in one round.   Price levels are kept sorted and the
+    cumulative bid / offer depth is updated as orders are added and removed, so the market
+    price can be determined without rebuilding the supply and demand curves.
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self.num_bids = 0
+        self.num_offers = 0
+        self.levels = np.empty(0, dtype=np.int64)
+        self.level_count = np.empty(0, dtype=np.int64)
+        self.cbq = np.empty(0, dtype=np.int64)
+        self.csq = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, oid, order_type, price, quantity):
+        if oid in self.orders:
+            return
+
+        cents = clearing.to_cents(price)
+        self.orders[oid] = (order_type, cents, quantity)
+        self._update_depth(order_type, cents, quantity, 1)
+
+    def remove(self, oid):
+        entry = self.orders.pop(oid, None)
+        if entry is None:
+            return
+
+        order_type, cents, quantity = entry
+        self._update_depth(order_type, cents, -quantity, -1)
+
+    def add_order(self, o):
+        self.add(o.id, o.order_type, o.price, o.quantity)
+
+    def _update_depth(self, order_type, cents, quantity, count):
+        idx = int(np.searchsorted(self.levels, cents))
+        if idx == len(self.levels) or self.levels[idx] != cents:
+            self._insert_level(idx, cents)
+
+        self.level_count[idx] += count
+        if order_type == OrderType.BID.value:
+            self.num_bids += count
+            self.cbq[:idx + 1] += quantity
+        else:
+            self.num_offers += count
+            self.csq[idx:] += quantity
+
+        if self.level_count[idx] == 0:
+            self._remove_level(idx)
+
+    def _insert_level(self, idx, cents):
+        # A new level sees the bids from the level above it and the offers from the level below it.
+        cbq_above = self.cbq[idx] if idx < len(self.levels) else 0
+        csq_below = self.csq[idx - 1] if idx > 0 else 0
+
+        self.levels = np.insert(self.levels, idx, cents)
+        self.level_count = np.insert(self.level_count, idx, 0)
+        self.cbq = np.insert(self.cbq, idx, cbq_above)
+        self.csq = np.insert(self.csq, idx, csq_below)
+
+    def _remove_level(self, idx):
+        self.levels = np.delete(self.levels, idx)
+        self.level_count = np.delete(self.level_count, idx)
+        self.cbq = np.delete(self.cbq, idx)
+        self.csq = np.delete(self.csq, idx)
+
+    def get_curves(self):
+        """
+        @return: levels, cbq, csq as described in clearing.build_curves
+        """
+        return self.levels, self.cbq, self.csq
+
+    def get_market_price(self, last_price):
+        if self.num_bids == 0 or self.num_offers == 0:
+            return last_price, 0
+
+        return clearing.select_price(self.levels, self.cbq, self.csq, last_price)
+
+    def matches(self, orders):
+        """
+        Check that the book holds exactly the given orders, with the same type, price and quantity.
+        @param orders: list of orders or None
+        @return: True if the book is in sync with the orders
+        """
+        orders = orders or []
+        if len(orders) != len(self.orders):
+            return False
+
+        for o in orders:
+            entry = self.orders.get(o.id)
+            if entry is None or entry != (o.order_type, clearing.to_cents(o.price), o.quantity):
+                return False
+        return True
+
+    def copy(self):
+        book = OrderBook()
+        book.orders = dict(self.orders)
+        book.num_bids = self.num_bids
+        book.num_offers = self.num_offers
+        book.levels = self.levels.copy()
+        book.level_count = self.level_count.copy()
+        book.cbq = self.cbq.copy()
+        book.csq = self.csq.copy()
+        return book
+
+
+def get_key(group):
+    return type(group), group.id
+
+
+def get_book(group):
+    """
+    Get the open book for the group, creating an empty one if needed.
+    """
+    key = get_key(group)
+    book = BOOKS.get(key)
+    if book is None:
+        book = OrderBook()
+        BOOKS[key] = book
+    return book
+
+
+def peek_book(group):
+    return BOOKS.get(get_key(group))
+
+
+def discard_book(group):
+    BOOKS.pop(get_key(group), None)
+
+
+def record_order(group, o):
+    get_book(group).add_order(o)
+
+
+def forget_order(group, oid):
+    book = peek_book(group)
+    if book is not None:
+        book.remove(oid)
@@ -0,0 +1,187 @@
+import heapq
+
+from rounds import order_store
+from rounds.models import Order, OrderType
+
+# Open orders by order model and group id, then player id.  Group and player rows are per-round, so
+# the cache is per-round, per-player.  It is filled on a player's first live message and dropped when
+# the group's market is calculated.
+CACHES = {}
+
+ORDER_FIELDS = ('id', 'player_id', 'p_id', 'group_id', 'order_type', 'price', 'quantity',
+                'quantity_final', 'original_quantity', 'is_buy_in')
+
+
+class CachedOrder:
+    """
+    Detached copy of an order.  Unlike the model object it stays valid after the database session
+    that loaded it is closed.
+    """
+    __slots__ = ORDER_FIELDS
+
+    def __init__(self, id, player_id, p_id, group_id, order_type, price, quantity,
+                 quantity_final=0, original_quantity=None, is_buy_in=False):
+        self.id = id
+        self.player_id = player_id
+        self.p_id = p_id
+        self.group_id = group_id
+        self.order_type = order_type
+        self.price = price
+        self.quantity = quantity
+        self.quantity_final = quantity_final
+        self.original_quantity = original_quantity
+        self.is_buy_in = is_buy_in
+
+    @classmethod
+    def from_order(cls, o):
+        return cls(o.id, o.player_id, o.player.id_in_group, o.group_id, o.order_type, o.price, o.quantity,
+                   o.quantity_final, o.original_quantity, o.is_buy_in)
+
+    def to_dict(self):
+        """
+        Same as Order.to_dict
+        """
+        requested_quant = self.original_quantity if self.original_quantity else self.quantity
+        return dict(
+            oid=self.id,
+            p_id=self.p_id,
+            group_id=self.group_id,
+            type=self.order_type,
+            price=self.price,
+            quantity=self.quantity,
+            original_quantity=self.original_quantity,
+            quantity_final=self.quantity_final,
+            requested_quant=requested_quant,
+            is_buy_in=self.is_buy_in
+        )
+
+    def __str__(self):
+        t = "BUY" if self.order_type == -1 else "SELL"
+        a = "(AUTO)" if self.is_buy_in else ""
+        return f"{t} {self.quantity} @ {self.price} {a}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class OrderAggregates:
+    """
+    Running totals of a player's orders used to validate new orders: the quantity offered, the
+    cost of the bids, and the best bid and ask.  The best prices are kept in heaps; removed orders
+    are dropped from a heap only once they reach its top.
+    """
+
+    def __init__(self):
+        self.offer_quantity = 0
+        self.bid_cost = 0
+        self.orders = {}
+        self.asks = []
+        self.bids = []
+
+    @classmethod
+    def from_orders(cls, orders):
+        aggregates = cls()
+        for o in orders:
+            aggregates.add(o)
+        return aggregates
+
+    def add(self, o):
+        if o.id in self.orders:
+            return
+
+        self.orders[o.id] = (o.order_type, o.price, o.quantity)
+        if o.order_type == OrderType.OFFER.value:
+            self.offer_quantity += o.quantity
+            heapq.heappush(self.asks, (o.price, o.id))
+        else:
+            self.bid_cost += o.price * o.quantity
+            heapq.heappush(self.bids, (-o.price, o.id))
+
+    def remove(self, oid):
+        entry = self.orders.pop(oid, None)
+        if entry is None:
+            return
+
+        order_type, price, quantity = entry
+        if order_type == OrderType.OFFER.value:
+            self.offer_quantity -= quantity
+        else:
+            self.bid_cost -= price * quantity
+
+    def _top(self, heap):
+        while heap and heap[0][1] not in self.orders:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def min_ask(self, default=None):
+        price = self._top(self.asks)
+        return default if price is None else price
+
+    def max_bid(self, default=None):
+        price = self._top(self.bids)
+        return default if price is None else -price
+
+
+class PlayerOrders(list):
+    """
+    A player's cached orders and their aggregates.  The version is incremented on every add and
+    remove, so the live pages can tell whether they missed an update.
+    """
+
+    def __init__(self, orders=()):
+        super().__init__(orders)
+        self.version = 0
+        self.aggregates = OrderAggregates.from_orders(self)
+
+
+def get_orders(player, o_cls=Order):
+    """
+    Get the player's orders, reading them from the database only if they are not cached.
+    The group's pending writes are flushed before the orders are read.
+    @return: PlayerOrders of CachedOrder in id order
+    """
+    group_cache = CACHES.setdefault((o_cls, player.group_id), {})
+    orders = group_cache.get(player.id)
+    if orders is None:
+        order_store.flush_group(player.group_id, o_cls)
+        orders = PlayerOrders(CachedOrder.from_order(o) for o in o_cls.filter(player=player))
+        group_cache[player.id] = orders
+    return orders
+
+
+def add_order(player, order, o_cls=Order):
+    """
+    Add a newly created order to the player's cache.  If the cache has not been filled yet the
+    order will be read with the others.
+    @param order: CachedOrder
+    """
+    orders = CACHES.get((o_cls, player.group_id), {}).get(player.id)
+    if orders is not None:
+        orders.append(order)
+        orders.aggregates.add(order)
+        orders.version += 1
+
+
+def remove_order(player, oid, o_cls=Order):
+    orders = CACHES.get((o_cls, player.group_id), {}).get(player.id)
+    if orders is not None:
+        orders[:] = [o for o in orders if o.id != oid]
+        orders.aggregates.remove(oid)
+        orders.version += 1
+
+
+def get_aggregates(player, o_cls=Order):
+    return get_orders(player, o_cls=o_cls).aggregates
+
+
+def get_version(player, o_cls=Order):
+    orders = CACHES.get((o_cls, player.group_id), {}).get(player.id)
+    return orders.version if orders is not None else 0
+
+
+def discard_player(player, o_cls=Order):
+    CACHES.get((o_cls, player.group_id), {}).pop(player.id, None)
+
+
+def discard_group(group, o_cls=Order):
+    CACHES.pop((o_cls, group.id), None)
@@ -0,0 +1,157 @@
+import os
+import time
+
+from otree.database import dbq
+from sqlalchemy import func, text
+
+from rounds.models import Order
+
+# Orders submitted on the live pages are written behind.  A new order gets its id right away and the
+# inserts / deletes are buffered per group and written in batches.  A group's writes are always flushed
+# before its market is calculated.
+#
+# Pending writes are keyed by order model and group id, since the practice app has its own tables.
+PENDING = {}
+ID_BLOCKS = {}
+
+FLUSH_SECONDS = float(os.getenv('SSE_ORDER_FLUSH_SECONDS', '2'))
+ID_BLOCK_SIZE = 1000
+
+# Takes a block of ids from the table's sequence in one statement.  The sequence is left at the last id of
+# the block, so inserts that get their id from the sequence land above it.
+RESERVE_SEQUENCE = text("SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                        "nextval(pg_get_serial_sequence(:table, 'id')) + :size - 1)")
+
+
+class IdBlock:
+    """
+    Hands out ids for an order model in blocks.  On Postgres the blocks are taken from the table's id
+    sequence, so they cannot collide with rows inserted with a sequence id.  Other databases have no
+    sequence; there the blocks start above the largest id in the table, and every insert into the table
+    has to take its id from here (oTree runs in a single process).
+    """
+
+    def __init__(self, o_cls, size=ID_BLOCK_SIZE):
+        self.o_cls = o_cls
+        self.size = size
+        self.next_id = 1
+        self.end = 1
+
+    def take(self):
+        if self.next_id >= self.end:
+            self.reserve()
+
+        oid = self.next_id
+        self.next_id += 1
+        return oid
+
+    def reserve(self):
+        session = dbq(self.o_cls).session
+        if session.get_bind().dialect.name == 'postgresql':
+            params = dict(table=self.o_cls.__table__.name, size=self.size)
+            last = session.execute(RESERVE_SEQUENCE, params).scalar()
+            self.next_id = last - self.size + 1
+        else:
+            top = session.query(func.max(self.o_cls.id)).scalar() or 0
+            self.next_id = max(self.next_id, top + 1)
+        self.end = self.next_id + self.size
+
+
+class PendingWrites:
+    """
+    Inserts and deletes of one group's orders that are not written yet.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.deleted = set()
+        self.since = None
+
+    def __len__(self):
+        return len(self.rows) + len(self.deleted)
+
+    def touch(self):
+        if self.since is None:
+            self.since = time.monotonic()
+
+    def is_due(self, seconds):
+        return self.since is not None and time.monotonic() - self.since >= seconds
+
+
+def next_order_id(o_cls=Order):
+    block = ID_BLOCKS.get(o_cls)
+    if block is None:
+        block = IdBlock(o_cls)
+        ID_BLOCKS[o_cls] = block
+    return block.take()
+
+
+def get_pending(group_id, o_cls=Order):
+    pending = PENDING.get((o_cls, group_id))
+    if pending is None:
+        pending = PendingWrites()
+        PENDING[(o_cls, group_id)] = pending
+    return pending
+
+
+def add_order(player, order_type, price, quantity, o_cls=Order, original_quantity=None):
+    """
+    Buffer a new order.
+    @param original_quantity: the quantity asked for if the order was capped
+    @return: the id of the order
+    """
+    oid = next_order_id(o_cls)
+    pending = get_pending(player.group_id, o_cls)
+    pending.rows[oid] = dict(id=oid,
+                             player_id=player.id,
+                             group_id=player.group_id,
+                             order_type=order_type,
+                             price=price,
+                             quantity=quantity,
+                             quantity_final=0,
+                             original_quantity=original_quantity,
+                             is_buy_in=False)
+    pending.touch()
+    return oid
+
+
+def delete_order(player, oid, o_cls=Order):
+    """
+    Buffer the delete of one of the player's orders.  An order that was not written yet is just dropped.
+    The caller is responsible for checking that the order belongs to the player.
+    """
+    pending = get_pending(player.group_id, o_cls)
+    if pending.rows.pop(oid, None) is None:
+        pending.deleted.add(oid)
+    pending.touch()
+
+
+def flush_group(group_id, o_cls=Order):
+    """
+    Write the group's pending inserts with a single executemany INSERT and its deletes with a single DELETE.
+    The statements run in the current database session; committing is left to the caller.
+    @return: the number of rows written
+    """
+    pending = PENDING.pop((o_cls, group_id), None)
+    if not pending:
+        return 0
+
+    table = o_cls.__table__
+    session = dbq(o_cls).session
+    if pending.rows:
+        session.execute(table.insert(), list(pending.rows.values()))
+    if pending.deleted:
+        session.execute(table.delete().where(table.c.id.in_(pending.deleted)))
+    return len(pending)
+
+
+def flush_if_due(group_id, o_cls=Order, seconds=None):
+    """
+    Flush the group's pending writes if the oldest one has waited longer than the flush interval.
+    @return: True if anything was written
+    """
+    seconds = FLUSH_SECONDS if seconds is None else seconds
+    pending = PENDING.get((o_cls, group_id))
+    if pending is None or not pending.is_due(seconds):
+        return False
+    return flush_group(group_id, o_cls) > 0
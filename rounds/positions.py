@@ -0,0 +1,279 @@
+from collections import namedtuple
+from decimal import Decimal
+from fractions import Fraction
+from math import floor
+
+import numpy as np
+from otree.api import cu
+
+from rounds.clearing import CENTS, clear, to_cents
+
+# Amounts closer than this to half a cent are ambiguous in floating point.  Those rows are
+# recomputed with Currency arithmetic so the results match DataForPlayer exactly.
+TIE_TOLERANCE = 1e-6
+
+Positions = namedtuple('Positions', ['shares_transacted', 'shares_result', 'trans_cost', 'cash_after_trade',
+                                     'dividend_earned', 'interest_earned', 'cash_result', 'exact'])
+MarginStatus = namedtuple('MarginStatus', ['bankrupt', 'short_mv', 'debt_mv', 'exact'])
+MarginCalls = namedtuple('MarginCalls', ['buying', 'buy_at', 'buy_quant', 'selling', 'sell_at', 'sell_quant',
+                                         'canceled', 'price'])
+
+
+def round_half_up(x):
+    """
+    Round to the nearest integer with ties away from zero (Decimal ROUND_HALF_UP).
+    """
+    return (np.sign(x) * np.floor(np.abs(x) + .5)).astype(np.int64)
+
+
+def near_half(x):
+    """
+    @return: mask of the values whose fractional part is within TIE_TOLERANCE of one half
+    """
+    return np.abs(np.abs(x) % 1 - .5) < TIE_TOLERANCE
+
+
+def div_round_half_up(num, den):
+    """
+    Exact integer division rounded half away from zero.
+    @param num: int64 array
+    @param den: int64 array of positive denominators
+    @return: the rounded quotients and a mask of the quotients that were exact ties
+    """
+    twice = 2 * np.abs(num)
+    q = (twice + den) // (2 * den)
+    tie = twice % (2 * den) == den
+    return np.sign(num) * q, tie
+
+
+def to_cu(cents):
+    """
+    Convert whole cents to Currency without going through float.
+    """
+    return cu(Decimal(int(cents)).scaleb(-2))
+
+
+def pack_players(players):
+    """
+    @param players: list of Player
+    @return: int64 arrays of cash (cents) and shares
+    """
+    n = len(players)
+    cash = np.fromiter((to_cents(p.cash) for p in players), dtype=np.int64, count=n)
+    shares = np.fromiter((p.shares for p in players), dtype=np.int64, count=n)
+    return cash, shares
+
+
+def net_shares(order_player_idx, order_types, quantities_final, num_players):
+    """
+    Sum the filled quantities of the orders for each player.  Bids add shares and offers remove them.
+    @param order_player_idx: int array; the index of the player for each order
+    @param order_types: int array of order types (BID = -1, OFFER = 1)
+    @param quantities_final: int array of filled quantities
+    @param num_players: the number of players
+    @return: int64 array of shares transacted by each player
+    """
+    if len(order_player_idx) == 0:
+        return np.zeros(num_players, dtype=np.int64)
+
+    net = -1 * np.asarray(order_types, dtype=np.int64) * np.asarray(quantities_final, dtype=np.int64)
+    return np.bincount(order_player_idx, weights=net, minlength=num_players).astype(np.int64)
+
+
+def compute_positions(cash, shares, shares_transacted, price, dividend, interest_rate):
+    """
+    Compute the new position of every player in one pass.  This follows
+    DataForPlayer.get_new_player_position with the Currency amounts held in whole cents.
+    @param cash: int64 array of player cash in cents
+    @param shares: int64 array of player shares
+    @param shares_transacted: int64 array from net_shares
+    @param price: the market price in cents
+    @param dividend: the realized dividend
+    @param interest_rate: the interest rate
+    @return: Positions; amounts in cents except dividend_earned, which is a float like in DataForPlayer.
+             exact is False for the rows that need to be recomputed with Currency arithmetic.
+    """
+    shares_result = shares + shares_transacted
+    trans_cost = -1 * shares_transacted * price
+    cash_after_trade = cash + trans_cost
+
+    dividend_earned = dividend * shares_result.astype(np.float64)
+
+    raw_interest = cash_after_trade * float(interest_rate)
+    interest_earned = round_half_up(raw_interest)
+
+    raw_cash_result = (cash + interest_earned + trans_cost) + dividend_earned * CENTS
+    cash_result = round_half_up(raw_cash_result)
+
+    exact = ~(near_half(raw_interest) | near_half(raw_cash_result))
+    return Positions(shares_transacted, shares_result, trans_cost, cash_after_trade,
+                     dividend_earned, interest_earned, cash_result, exact)
+
+
+def ratio_threshold(margin_ratio):
+    """
+    Currency ratios have two decimal places, so ratio <= margin_ratio holds exactly when
+    the ratio in hundredths is at most floor(100 * margin_ratio).
+    """
+    return floor(Fraction(margin_ratio) * CENTS)
+
+
+def mv_short_mask(shares_result, cash_result, price, margin_ratio):
+    """
+    Vector form of DataForPlayer.set_mv_short_future.
+    @param shares_result: int64 array of shares after trading
+    @param cash_result: int64 array of cash after trading, in cents
+    @param price: the market price in cents
+    @param margin_ratio: the margin ratio
+    @return: mask of the players that will be in violation, and a mask of the exact rows
+    """
+    short = shares_result < 0
+    mask = np.zeros(len(shares_result), dtype=bool)
+    exact = np.ones(len(shares_result), dtype=bool)
+    if price == 0 or not short.any():
+        return mask, exact
+
+    share_value = np.abs(price * shares_result[short])
+    ratio, _ = div_round_half_up((cash_result[short] - share_value) * CENTS, share_value)
+    mask[short] = ratio <= ratio_threshold(margin_ratio)
+    return mask, exact
+
+
+def mv_debt_mask(shares_result, cash_result, price, margin_ratio):
+    """
+    Vector form of DataForPlayer.set_mv_debt_future.
+    @param shares_result: int64 array of shares after trading
+    @param cash_result: int64 array of cash after trading, in cents
+    @param price: the market price in cents
+    @param margin_ratio: the margin ratio
+    @return: mask of the players that will be in violation, and a mask of the exact rows
+    """
+    debt = cash_result < 0
+    mask = np.zeros(len(shares_result), dtype=bool)
+    exact = np.ones(len(shares_result), dtype=bool)
+    if not debt.any():
+        return mask, exact
+
+    cash = np.abs(cash_result[debt])
+    ratio, tie = div_round_half_up(np.abs(shares_result[debt] * price - cash) * CENTS, cash)
+    mask[debt] = ratio <= ratio_threshold(margin_ratio)
+    # The original divides by a float, so a tie can round either way
+    exact[debt] = ~tie
+    return mask, exact
+
+
+def margin_status(cash, shares, price, margin_ratio):
+    """
+    Vector form of Player.is_bankrupt, Player.is_short_margin_violation and
+    Player.is_debt_margin_violation at the start of a round.
+    @param cash: int64 array of player cash in cents
+    @param shares: int64 array of player shares
+    @param price: the last period price in cents
+    @param margin_ratio: the margin ratio
+    @return: MarginStatus of masks.  exact is False for the rows whose limit is too close to half a
+             cent to be rounded like Currency; those need to be checked with the Player methods.
+    """
+    value_of_stock = price * shares
+    bankrupt = value_of_stock + cash <= 0
+    debt = np.abs(np.minimum(cash, 0) + np.minimum(value_of_stock, 0))
+
+    # Short players are limited by their cash, borrowers by the value of their stock
+    short = (shares < 0) & ~bankrupt
+    raw_short_limit = np.abs(cash) / (1 + margin_ratio)
+    short_mv = short & (debt >= round_half_up(raw_short_limit))
+
+    borrowing = (cash < 0) & ~bankrupt
+    raw_debt_limit = np.abs(value_of_stock) / (1 + margin_ratio)
+    debt_mv = borrowing & (debt >= round_half_up(raw_debt_limit))
+
+    exact = ~((short & near_half(raw_short_limit)) | (borrowing & near_half(raw_debt_limit)))
+    return MarginStatus(bankrupt, short_mv, debt_mv, exact)
+
+
+def margin_call_orders(cash, shares, price, target_ratio, premium):
+    """
+    Vector form of DataForPlayer.generate_buy_in_order and generate_sell_off_order for every player,
+    in floating point dollars.  The buy-in price is the price plus the margin premium and the sell-off price is the price less the premium.
+    @param cash: int64 array of player cash in cents
+    @param shares: int64 array of player shares
+    @param price: the candidate market price in cents
+    @param target_ratio: the margin target ratio
+    @param premium: the margin premium
+    @return: the buy-in price (cents) and quantities, and the sell-off price (cents) and quantities.
+             Quantities are 0 where no order is needed.
+    """
+    n = len(cash)
+    buy_at = int(round_half_up(np.float64(price * (1 + premium))))
+    sell_at = int(round_half_up(np.float64(price * (1 - premium))))
+    buy_quant = np.zeros(n, dtype=np.int64)
+    sell_quant = np.zeros(n, dtype=np.int64)
+
+    c = np.abs(cash) / CENTS
+    s = np.abs(shares)
+    if buy_at > 0 and target_ratio:
+        p = buy_at / CENTS
+        buy_quant = np.ceil(((1 + target_ratio) * s * p - c) / (target_ratio * p)).astype(np.int64)
+    if sell_at > 0 and target_ratio:
+        p = sell_at / CENTS
+        sell_off = np.ceil(np.abs(((1 - target_ratio) * c - s * p) / (target_ratio * p))).astype(np.int64)
+        # prevent shorts
+        sell_quant = np.minimum(sell_off, s)
+
+    return buy_at, np.maximum(buy_quant, 0), sell_at, sell_quant
+
+
+def margin_calls(cash, shares, auto_buy, auto_sell, order_idx, is_bid, order_prices, order_quants, last_price,
+                 margin_ratio, target_ratio, premium, max_iterations):
+    """
+    The margin call stage of the market on packed arrays (see CallMarket.run_margin_calls).  A player whose
+    automatic buy-in (sell-off) is due and whose position is in violation at the candidate price gets an
+    automatic BID (OFFER), which cancels the player's OFFERS (BIDS).  The book is cleared again with the
+    automatic orders until the price stops moving or is set by an automatic order, at most max_iterations
+    times.
+    @param cash: int64 array of player cash in cents
+    @param shares: int64 array of player shares
+    @param auto_buy: mask of the players whose automatic buy-in is due
+    @param auto_sell: mask of the players whose automatic sell-off is due
+    @param order_idx: int array; the index of the player for each order, -1 if the player is not known
+    @param is_bid: mask of the BID orders
+    @param order_prices: int64 array of order prices in cents
+    @param order_quants: int64 array of order quantities
+    @param last_price: the market price of the previous period
+    @param max_iterations: the upper bound on the clearing iterations
+    @return: MarginCalls; buying / selling are masks of the players with an automatic order, canceled is
+             a mask of the orders they cancel and price is the last candidate price in cents
+    """
+    n = len(cash)
+    known = order_idx >= 0
+    price = to_cents(last_price)
+    buy_in = np.zeros(n, dtype=bool)
+    sell_off = np.zeros(n, dtype=bool)
+    for _ in range(max_iterations):
+        # Once called, a player stays called so the iterations settle
+        mv_short, _ = mv_short_mask(shares, cash, price, margin_ratio)
+        mv_debt, _ = mv_debt_mask(shares, cash, price, margin_ratio)
+        buy_in |= auto_buy & mv_short
+        sell_off |= auto_sell & mv_debt
+
+        buy_at, buy_quant, sell_at, sell_quant = margin_call_orders(cash, shares, price, target_ratio, premium)
+        buying = buy_in & (buy_quant > 0)
+        selling = sell_off & (sell_quant > 0)
+        canceled = known & (order_quants > 0) & np.where(is_bid, selling[order_idx], buying[order_idx])
+        active = ~canceled & (order_quants > 0)
+
+        bid_prices = np.concatenate((order_prices[active & is_bid], np.full(buying.sum(), buy_at)))
+        bid_quants = np.concatenate((order_quants[active & is_bid], buy_quant[buying]))
+        offer_prices = np.concatenate((order_prices[active & ~is_bid], np.full(selling.sum(), sell_at)))
+        offer_quants = np.concatenate((order_quants[active & ~is_bid], sell_quant[selling]))
+        new_price, _ = clear(bid_prices, bid_quants, offer_prices, offer_quants, last_price)
+
+        new_price = to_cents(new_price)
+        if new_price == price:
+            break
+        price = new_price
+        # The automatic orders are priced from the candidate price.  If one of them sets the new price,
+        # repricing it from that price would only chase it upward (downward), so the iterations stop.
+        if (buying.any() and new_price == buy_at) or (selling.any() and new_price == sell_at):
+            break
+
+    return MarginCalls(buying, buy_at, buy_quant, selling, sell_at, sell_quant, canceled, price)
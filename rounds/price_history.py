@@ -0,0 +1,84 @@
+# Price and volume history of each market, shared by all of its players' pages.  A market is identified
+# by the group model, the session and the group's id in the subsession, since group rows are per-round.
+# The history is read from the database the first time it is needed and then extended when the market
+# is calculated, and dropped once the market's last round is over.
+HISTORIES = {}
+
+
+class PriceHistory:
+
+    def __init__(self):
+        self.prices = {}
+        self.volumes = {}
+        self.known_through = 0
+        self.series = {}
+
+    def record(self, round_number, price, volume):
+        self.prices[round_number] = price
+        self.volumes[round_number] = volume
+        self.known_through = max(self.known_through, round_number)
+        self.series.clear()
+
+    def load(self, group):
+        """
+        Read the prices of the group's rounds up to the current one.
+        """
+        for g in group.in_all_rounds():
+            price = g.field_maybe_none('price')
+            if price is not None:
+                self.record(g.round_number, price, g.volume)
+        if group.field_maybe_none('price') is None:
+            self.known_through = max(self.known_through, group.round_number - 1)
+
+    def get_series(self, round_number, include_current, init_price):
+        """
+        @return: the prices and volumes up to the round, each starting with the initial values.
+            The lists are shared and must not be changed.
+        """
+        key = (round_number, include_current, init_price)
+        series = self.series.get(key)
+        if series is None:
+            last_round = round_number if include_current else round_number - 1
+            rounds = [r for r in range(1, last_round + 1) if r in self.prices]
+            series = ([init_price] + [self.prices[r] for r in rounds],
+                      [0] + [self.volumes[r] for r in rounds])
+            self.series[key] = series
+        return series
+
+
+def get_key(group):
+    return type(group), group.session_id, group.id_in_subsession
+
+
+def get_history(group, include_current=False):
+    """
+    Get the market's history, reading it from the database if it does not cover the rounds needed.
+    """
+    key = get_key(group)
+    history = HISTORIES.get(key)
+    if history is None:
+        history = PriceHistory()
+        HISTORIES[key] = history
+
+    needed = group.round_number if include_current else group.round_number - 1
+    if history.known_through < needed:
+        history.load(group)
+    return history
+
+
+def discard(group):
+    HISTORIES.pop(get_key(group), None)
+
+
+def record_group(group):
+    """
+    Add the market price and volume just set on the group.
+    """
+    history = HISTORIES.get(get_key(group))
+    if history is not None:
+        history.record(group.round_number, group.price, group.volume)
+
+
+def get_price_series(group, include_current, init_price):
+    history = get_history(group, include_current=include_current)
+    return history.get_series(group.round_number, include_current, init_price)
@@ -0,0 +1,99 @@
+import numpy as np
+
+import common.SessionConfigFunctions as scf
+from rounds.models import NO_SHORT_LIMIT
+
+# Short interest of each market, by group model and id.  Group rows are per-round, so a tracker covers
+# one round: it starts from the group's short at the start of the round, holds the short sales of the
+# SELL orders submitted during the round against the float cap, and is moved by the fills when the
+# market is calculated.  The count after the fills is where the next round starts; the tracker is
+# dropped when the next round starts or the market is over.
+TRACKERS = {}
+
+
+class ShortInterest:
+
+    def __init__(self, short, max_short=None):
+        self.short = short
+        self.max_short = max_short
+        self.pending = 0
+        self.filled = False
+
+    def is_capped(self):
+        return self.max_short is not None
+
+    def get_limit(self):
+        """
+        Same as Group.get_short_limit, less the short sales already submitted this round.
+        @return: int number of shares, or NO_SHORT_LIMIT
+        """
+        if self.max_short is None:
+            return NO_SHORT_LIMIT
+        return max(self.max_short - self.short - self.pending, 0)
+
+    def reserve(self, short_sale):
+        """
+        Hold a short sale against the cap.
+        @return: the number of shares of the short sale that are allowed
+        """
+        allowed = short_sale if self.max_short is None else min(short_sale, self.get_limit())
+        self.pending += allowed
+        return allowed
+
+    def release(self, short_sale):
+        self.pending = max(self.pending - short_sale, 0)
+
+    def apply_fills(self, change):
+        self.short += change
+        self.filled = True
+
+
+def get_key(group):
+    return type(group), group.id
+
+
+def get_max_short(group):
+    # Without allow_short nothing may be sold short, whatever the float cap
+    if not scf.is_short_allowed(group):
+        return 0
+    cap_ratio = scf.get_float_ratio_cap(group)
+    stock_float = group.field_maybe_none('float')
+    if not cap_ratio or stock_float is None:
+        return None
+    return int(cap_ratio * stock_float)
+
+
+def get_tracker(group):
+    key = get_key(group)
+    tracker = TRACKERS.get(key)
+    if tracker is None:
+        tracker = ShortInterest(group.field_maybe_none('short') or 0, get_max_short(group))
+        TRACKERS[key] = tracker
+    return tracker
+
+
+def short_change(shares, shares_result):
+    """
+    @param shares: int64 array of the players' shares before trading
+    @param shares_result: int64 array of the players' shares after trading
+    @return: the change in the number of shares short
+    """
+    return int(np.maximum(-shares_result, 0).sum() - np.maximum(-shares, 0).sum())
+
+
+def record_fills(group, change):
+    get_tracker(group).apply_fills(change)
+
+
+def get_result_short(group):
+    """
+    @return: the short after the market's fills, or None if they were not recorded
+    """
+    tracker = TRACKERS.get(get_key(group))
+    if tracker is None or not tracker.filled:
+        return None
+    return tracker.short
+
+
+def discard(group):
+    TRACKERS.pop(get_key(group), None)
@@ -66,17 +66,29 @@ function cancel_order(elem){
     remove_all_error_messages();
     liveSend({'func': 'delete_order', 'oid': oid});
 
-    $("#order_" + oid).detach();
+    remove_order_from_list(oid);
+}
+
+function remove_order_from_list(oid){
+    let order_elem = $("#order_" + oid);
+    if (order_elem.length === 0){
+        return;
+    }
+    order_elem.detach();
 
     num_orders -= 1;
     if (num_orders < 6){
-        $("#submit-btn").removeClass("disabled");
-        $("input").prop( "disabled", false);
-        $("select").prop("disabled", false);
-        $(".order-form").parents('.boxed_area').removeClass("disabled");
+        enable_order_form();
     }
 }
 
+function enable_order_form(){
+    $("#submit-btn").removeClass("disabled");
+    $("input").prop( "disabled", false);
+    $("select").prop("disabled", false);
+    $(".order-form").parents('.boxed_area').removeClass("disabled");
+}
+
 function remove_all_error_messages(){
         $(".form-control,.form-select").each(remove_error_message);
 }
@@ -113,16 +125,38 @@ function clear_order_form() {
 //////////////////////////////
 
 
+// Version of the order list last received from the server.  Each added or removed order is one version.
+// A change that skips a version means a message was missed, so the whole list is requested again.
+var order_seq = null;
+
+function apply_order_delta(live_data) {
+    let num_changes = live_data.added.length + live_data.removed.length;
+    if (order_seq === null || live_data.seq !== order_seq + num_changes) {
+        liveSend({'func': 'get_orders_for_player'});
+        return;
+    }
+
+    order_seq = live_data.seq;
+    live_data.removed.forEach((oid) => remove_order_from_list(oid));
+    live_data.added.forEach((o) => add_order_to_list(o.oid, o));
+}
+
 function add_form_order_to_list(live_data){
-    o_info = get_order_details();
-    var oid = live_data.order_id;
-    add_order_to_list(oid, o_info);
-    
+    apply_order_delta(live_data);
+
     //clear the form when done
     clear_order_form();
 }
 
 function add_orders_to_list(live_data) {
+    // The list replaces whatever is shown
+    $('.order-list-item').detach();
+    num_orders = 0;
+    if (js_vars.show_cancel){
+        enable_order_form();
+    }
+
+    order_seq = live_data.seq;
     var orders = live_data.orders;
     orders.forEach((o) => {
         var oid = o.oid
@@ -270,6 +304,9 @@ function liveRecv(data) {
     } else if (func === 'order_rejected') {
         process_order_rejection(data)
 
+    } else if (func === 'order_delta') {
+        apply_order_delta(data);
+
     } else if (func === 'order_list') {
         add_orders_to_list(data);
     }
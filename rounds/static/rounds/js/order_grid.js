@@ -7,8 +7,12 @@ let MINOR_TICK = 4
 let PRICE_PER_LINE = PRICE_EXTREME / ((NUM_GRID_LINES + 1) * MINOR_TICK);
 let START_MSG = "Submit an order by clicking on the grid."
 let o_data = null;
-let submitted_odata = null;
+let queued_orders = [];
+let submit_in_flight = false;
 let num_orders = 0;
+let MAX_ORDERS = 6;
+let sent_orders = 0;
+let TOO_MANY_ORDERS = 16384;
 let grid_enabled = true;
 let edgepad = 5;
 let textpad = 50;
@@ -73,8 +77,7 @@ $(window).on('load', function () {
     // Submit Order on Click
     $("#price-grid").on("click", function(e){
         if (o_data && grid_enabled) {
-            submitted_odata = o_data;
-            liveSend({'func': 'submit-order', 'data': submitted_odata});
+            submit_order(o_data);
             reset_grid();
         }
     });
@@ -86,6 +89,54 @@ $(window).on('load', function () {
     });
 });
 
+// Orders clicked while a submission is waiting for its answer are sent together in the next one.
+// Orders sent or queued count toward the limit, so a batch never takes the player past it.
+function submit_order(order_data) {
+    if (count_orders() >= MAX_ORDERS) {
+        $('#curr_ord_msg').text(js_vars.error_codes[TOO_MANY_ORDERS].desc);
+        return;
+    }
+
+    queued_orders.push(order_data);
+    if (count_orders() >= MAX_ORDERS) {
+        disable_grid();
+    }
+    if (!submit_in_flight) {
+        send_queued_orders();
+    }
+}
+
+// The player's orders, including those sent or queued and not yet answered
+function count_orders() {
+    return num_orders + sent_orders + queued_orders.length;
+}
+
+function send_queued_orders() {
+    if (queued_orders.length === 0) {
+        return;
+    }
+    submit_in_flight = true;
+    sent_orders = queued_orders.length;
+    liveSend({'func': 'submit-orders', 'data': queued_orders});
+    queued_orders = [];
+}
+
+function process_submitted_orders(data) {
+    apply_order_delta(data);
+    data.results.forEach((r) => {
+        if (r.error_code) {
+            process_order_rejection(r);
+        }
+    });
+
+    submit_in_flight = false;
+    sent_orders = 0;
+    if (count_orders() < MAX_ORDERS) {
+        enable_grid();
+    }
+    send_queued_orders();
+}
+
 function update_current_order(price, quantity){
     $('#curr_ord_quant_cell').removeClass('curr_ord_alert');
     $('#curr_ord_price_cell').removeClass('curr_ord_alert');
@@ -251,12 +302,29 @@ function draw_grid(market_price) {
 
 
 
-function add_form_order_to_list(live_data){
-    var oid = live_data.order_id;
-    add_order_to_list(oid, submitted_odata);
+// Version of the order list last received from the server.  Each added or removed order is one version.
+// A change that skips a version means a message was missed, so the whole list is requested again.
+let order_seq = null;
+
+function apply_order_delta(live_data) {
+    let num_changes = live_data.added.length + live_data.removed.length;
+    if (order_seq === null || live_data.seq !== order_seq + num_changes) {
+        liveSend({'func': 'get_orders_for_player'});
+        return;
+    }
+
+    order_seq = live_data.seq;
+    live_data.removed.forEach((oid) => remove_order_from_list(oid));
+    live_data.added.forEach((o) => add_order_to_list(o.oid, o));
 }
 
 function add_orders_to_list(live_data) {
+    // The list replaces whatever is shown
+    $('.submitted-order-grid').detach();
+    num_orders = 0;
+    enable_grid();
+
+    order_seq = live_data.seq;
     var orders = live_data.orders;
     orders.forEach((o) => {
         var oid = o.oid
@@ -326,7 +394,7 @@ function add_order_to_list(oid, o_info){
 
     // Disable the form is this is the sixth order
     num_orders += 1;
-    if (num_orders >= 6){  //show_cancel is true only on the market page.
+    if (count_orders() >= MAX_ORDERS){  //show_cancel is true only on the market page.
         disable_grid();
     }
 }
@@ -356,10 +424,18 @@ function cancel_order(elem){
     //remove_all_error_messages();
     liveSend({'func': 'delete_order', 'oid': oid});
 
-    $("#order_" + oid).detach();
+    remove_order_from_list(oid);
+}
+
+function remove_order_from_list(oid){
+    let order_elem = $("#order_" + oid);
+    if (order_elem.length === 0){
+        return;
+    }
+    order_elem.detach();
 
     num_orders -= 1;
-    if (num_orders < 6){
+    if (count_orders() < MAX_ORDERS){
         enable_grid();
     }
 }
@@ -380,8 +456,11 @@ function liveRecv(data) {
     console.log("Here:", data)
     const func = data.func;
 
-    if (func === 'order_confirmed') {
-       add_form_order_to_list(data);
+    if (func === 'order_confirmed' || func === 'order_delta') {
+        apply_order_delta(data);
+
+    } else if (func === 'orders_submitted') {
+        process_submitted_orders(data);
 
     } else if (func === 'order_rejected') {
         process_order_rejection(data)
@@ -0,0 +1,55 @@
+from itertools import count
+from unittest.mock import MagicMock
+
+from otree.models import Session
+
+from rounds import Group, Player
+
+SESSION_CODES = count(1)
+
+sess_config = dict(interest_rate=.1,
+                   margin_ratio=.2,
+                   margin_premium=.3,
+                   margin_target_ratio=.4)
+
+
+def next_session_code():
+    return f'test_{next(SESSION_CODES)}'
+
+
+def new_session(config):
+    """
+    A session with a code of its own, so its parsed config is not shared with other tests' sessions.
+    """
+    session = Session()
+    session.code = next_session_code()
+    session.config = config
+    return session
+
+
+def basic_player(pid=None, id_in_group=None, **kwargs):
+    player = MagicMock(spec=Player)
+    s = kwargs.get('shares', 0)
+    c = kwargs.get('cash', 0)
+
+    player.is_short = MagicMock(return_value = s < 0)
+
+    player.shares = s
+    player.cash = c
+    player.shares_result = kwargs.get('shares_result', 0)
+    player.cash_result = kwargs.get('cash_result', 0)
+    if pid:
+        player.id = pid
+    if id_in_group:
+        player.id_in_group = id_in_group
+    return player
+
+
+def get_group(players, market_price=98, gid=None):
+    group = Group()
+    if gid:
+        group.id = gid
+    group.get_players = MagicMock(return_value=players)
+    group.get_last_period_price = MagicMock(return_value=market_price)
+    group.session = new_session(sess_config)
+    return group
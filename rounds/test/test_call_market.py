@@ -2,8 +2,9 @@ import unittest
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
-from rounds.call_market import CallMarket
+from rounds.call_market import CallMarket, get_orders_by_player, calculate_markets
 from rounds.models import *
+from rounds.test.helpers import next_session_code
 
 NUM_ROUNDS = 5
 BID = OrderType.BID.value
@@ -19,6 +20,7 @@ def get_order(**kwargs):
     if kwargs.get('oid'):
         o.id = kwargs.get('oid')
     o.player = kwargs.get('player')
+    o.player_id = getattr(o.player, 'id', None)
     o.group = kwargs.get('group')
     o.order_type = kwargs.get('order_type')
     o.price = kwargs.get('price')
@@ -35,8 +37,10 @@ def basic_group():
     config_settings = {'interest_rate': R, 'margin_ratio': MARGIN_RATIO, 'margin_premium': MARGIN_PREM,
                        'margin_target_ratio': MARGIN_TARGET}
     session = MagicMock()
+    session.code = next_session_code()
     session.config = config_settings
     group.session = session
+    group.get_player_records = MagicMock(return_value={})
 
     return group
 
@@ -140,6 +144,142 @@ class TestCallMarket(unittest.TestCase):
         self.assertAlmostEqual(avg, 70, delta=.3,
                                msg=f"Expecting the average dividend to be around 70, instead it was: {avg}")
 
+    def test_get_orders_by_player(self):
+        # Set-up
+        p1 = MagicMock(spec=Player)
+        p1.id = 1
+        p2 = MagicMock(spec=Player)
+        p2.id = 2
+        b1 = get_order(player=p1, order_type=BID, price=10, quantity=5)
+        b2 = get_order(player=p2, order_type=BID, price=10, quantity=6)
+        o1 = get_order(player=p1, order_type=OFFER, price=11, quantity=5)
+
+        # Execute
+        d = get_orders_by_player([b1, b2, o1])
+
+        # Assert
+        self.assertEqual(set(d.keys()), {1, 2})
+        self.assertEqual(d[1], [b1, o1])
+        self.assertEqual(d[2], [b2])
+        self.assertEqual(len(get_orders_by_player(None)), 0)
+
+    def test_init_player_records(self):
+        # Set-up
+        p1 = MagicMock(spec=Player)
+        p1.id = 1
+        group = basic_group()
+        group.get_player_records = MagicMock(return_value={1: PlayerRecord(p1, True)})
+        group.get_last_period_price = MagicMock(return_value=47)
+
+        # Execute
+        with patch.object(Order, 'filter', return_value=[]), \
+                patch.object(CallMarket, 'get_dividend', return_value=0):
+            cm = CallMarket(group)
+
+        # Assert
+        self.assertEqual(len(cm.players), 1)
+        self.assertEqual(cm.players[0].player, p1)
+        group.get_player_records.assert_called_once()
+
+    def test_compute_positions(self):
+        # Set-up
+        p1 = MagicMock(spec=Player, id=1, cash=cu(100), shares=2)
+        p2 = MagicMock(spec=Player, id=2, cash=cu(10.10), shares=0)
+        group = basic_group()
+        group.get_player_records = MagicMock(return_value={1: PlayerRecord(p1, True), 2: PlayerRecord(p2, True)})
+        b1 = get_order(player=p1, order_type=BID, price=10, quantity=5)
+        o2 = get_order(player=p2, order_type=OFFER, price=10, quantity=3)
+        b1.quantity_final = 3
+        o2.quantity_final = 3
+
+        with patch.object(Order, 'filter', return_value=[b1, o2]), \
+                patch.object(CallMarket, 'get_dividend', return_value=0.4):
+            cm = CallMarket(group)
+
+        # Execute
+        cm.compute_positions(cu(10))
+
+        # Assert
+        d1, d2 = cm.players
+        self.assertEqual(d1.shares_transacted, 3)
+        self.assertEqual(d1.shares_result, 5)
+        self.assertEqual(d1.trans_cost, cu(-30))
+        self.assertEqual(d1.cash_after_trade, cu(70))
+        self.assertEqual(d1.interest_earned, cu(7))
+        self.assertEqual(d1.cash_result, cu(79))
+        self.assertEqual(d2.shares_result, -3)
+        self.assertEqual(d2.cash_after_trade, cu(40.10))
+        # 40.10 * .1 = 4.01 and the dividend paid on the short is 1.20
+        self.assertEqual(d2.cash_result, cu(42.91))
+        self.assertTrue(d2.mv_short_future)
+
+    def test_calculate_markets(self):
+        # Set-up - two independent markets
+        g1 = basic_group()
+        g1.get_last_period_price = MagicMock(return_value=47)
+        g2 = basic_group()
+        g2.get_last_period_price = MagicMock(return_value=47)
+        # g1 has excess supply at both of its levels, so it clears at the lower one
+        g1_orders = [get_order(order_type=BID, price=10, quantity=5), get_order(order_type=OFFER, price=9, quantity=8)]
+        g2_orders = [get_order(order_type=BID, price=6, quantity=5), get_order(order_type=OFFER, price=6, quantity=2)]
+
+        with patch.object(Order, 'filter', side_effect=[g1_orders, g2_orders]), \
+                patch.object(CallMarket, 'get_dividend', return_value=0), \
+                patch.object(CallMarket, 'apply_market_price') as apply_mock:
+            # Execute
+            calculate_markets([g1, g2], 2)
+
+        # Assert
+        self.assertEqual(g1.price, cu(9))
+        self.assertEqual(g1.volume, 5)
+        self.assertEqual(g2.price, cu(6))
+        self.assertEqual(g2.volume, 2)
+        self.assertEqual([c.args for c in apply_mock.call_args_list], [(cu(9),), (cu(6),)])
+
+    def test_margin_calls(self):
+        # Set-up - p1 is short beyond the margin and due for a buy-in; p2 is selling
+        p1 = MagicMock(spec=Player, id=1, cash=cu(100), shares=-10, periods_until_auto_buy=0,
+                       periods_until_auto_sell=NO_AUTO_TRANS)
+        p2 = MagicMock(spec=Player, id=2, cash=cu(100), shares=30, periods_until_auto_buy=NO_AUTO_TRANS,
+                       periods_until_auto_sell=NO_AUTO_TRANS)
+        group = basic_group()
+        group.id = 1
+        group.get_player_records = MagicMock(return_value={1: PlayerRecord(p1, True), 2: PlayerRecord(p2, True)})
+        group.get_last_period_price = MagicMock(return_value=cu(10))
+        o1 = get_order(oid=1, player=p1, order_type=OFFER, price=9, quantity=2, quantity_final=0)
+        o2 = get_order(oid=2, player=p2, order_type=OFFER, price=11, quantity=20, quantity_final=0)
+
+        with patch.object(Order, 'filter', return_value=[o1, o2]), \
+                patch.object(CallMarket, 'get_dividend', return_value=0):
+            cm = CallMarket(group)
+
+        # Execute
+        func, args = cm.get_clearing_task()
+        market_price, volume = func(*args)
+
+        # Assert - the buy-in was repriced once the market moved to 11.00, and then set the price
+        algo_orders = cm.get_algo_orders()
+        self.assertEqual(len(algo_orders), 1)
+        buy_in = algo_orders[0]
+        self.assertEqual(buy_in.player, p1)
+        self.assertEqual(buy_in.order_type, BID)
+        self.assertEqual(buy_in.price, cu(13.75))
+        self.assertEqual(buy_in.quantity, 20)
+        self.assertTrue(buy_in.is_buy_in)
+        self.assertEqual(market_price, cu(13.75))
+        self.assertEqual(volume, 20)
+
+        # p1's offer was canceled by the buy-in
+        d1, d2 = cm.order_data[:2]
+        self.assertEqual((d1.quantity, d1.original_quantity), (0, 2))
+        self.assertEqual(d2.quantity, 20)
+        self.assertIn(buy_in, cm.orders_by_player[1])
+
+    def test_no_margin_calls(self):
+        cm = basic_setup()
+        self.assertEqual(cm.get_algo_orders(), [])
+
+
 # def test_market_case(self):
 #     # Set up
 #     session = Session()
@@ -0,0 +1,154 @@
+import unittest
+
+import numpy as np
+
+from rounds import clearing
+from rounds.models import *
+
+
+def o(price=None, quantity=None):
+    _o = Order()
+    _o.price = price
+    _o.quantity = quantity
+    return _o
+
+
+def orders(tuples):
+    return [o(price=p, quantity=q) for p, q in tuples]
+
+
+def get_market_price(bids, offers, last_price=-1):
+    return clearing.get_market_price(orders(bids), orders(offers), last_price)
+
+
+# noinspection DuplicatedCode
+class TestClearing(unittest.TestCase):
+
+    def test_pack_orders(self):
+        prices, quants = clearing.pack_orders(orders([(10, 20), (11.5, 21), (cu(0.07), 3)]))
+
+        self.assertEqual(list(prices), [1000, 1150, 7])
+        self.assertEqual(list(quants), [20, 21, 3])
+        self.assertEqual(prices.dtype, np.int64)
+
+    def test_pack_orders_none(self):
+        for empty in (None, []):
+            prices, quants = clearing.pack_orders(empty)
+            self.assertEqual(len(prices), 0)
+            self.assertEqual(len(quants), 0)
+
+    def test_build_curves(self):
+        bid_p, bid_q = clearing.pack_orders(orders([(10, 20), (11, 21), (11, 5)]))
+        offer_p, offer_q = clearing.pack_orders(orders([(5, 15), (6, 16), (11, 2)]))
+
+        levels, cbq, csq = clearing.build_curves(bid_p, bid_q, offer_p, offer_q)
+
+        self.assertEqual(list(levels), [500, 600, 1000, 1100])
+        self.assertEqual(list(cbq), [46, 46, 46, 26])
+        self.assertEqual(list(csq), [15, 31, 31, 33])
+
+    def test_market_price_volume(self):
+        price, volume = get_market_price([(1, 1), (2, 2)], [(1, 1), (2, 2)])
+        self.assertEqual(price, 2)
+        self.assertEqual(volume, 2)
+
+    def test_market_price_resid(self):
+        price, volume = get_market_price([(4, 2), (6, 1)], [(4, 1), (6, 1)])
+        self.assertEqual(price, 6)
+        self.assertEqual(volume, 1)
+
+    def test_market_price_pressure(self):
+        price, volume = get_market_price([(55, 4)], [(50, 10)])
+        self.assertEqual(price, 50)
+        self.assertEqual(volume, 4)
+
+    def test_market_price_ref(self):
+        price, volume = get_market_price([(5, 10), (6, 10)], [(5, 10), (6, 10)])
+        self.assertEqual(price, 6)
+        self.assertEqual(volume, 10)
+
+    def test_market_price_pressure_zero_residual(self):
+        # Both levels clear 10 with no residual; they are both buy pressure, so the highest is chosen
+        price, volume = get_market_price([(6, 10)], [(5, 10)])
+        self.assertEqual(price, 6)
+        self.assertEqual(volume, 10)
+
+    def test_select_price_pressure_tie(self):
+        levels = np.array([1000, 1100, 1200])
+        cbq = np.array([12, 10, 10])
+        csq = np.array([8, 10, 10])
+
+        # 11 and 12 clear 10 with no residual; where the curves meet is buy pressure
+        price, volume = clearing.select_price(levels, cbq, csq, last_price=-1)
+        self.assertEqual(price, 12)
+        self.assertEqual(volume, 10)
+
+    def test_market_price_no_trade(self):
+        price, volume = get_market_price([(1, 1)], [(10, 1)])
+        self.assertEqual(price, -1)
+        self.assertEqual(volume, 0)
+
+    def test_market_price_cents(self):
+        price, volume = get_market_price([(10.37, 3)], [(10.37, 2)])
+        self.assertEqual(cu(price), cu(10.37))
+        self.assertEqual(volume, 2)
+
+    def test_get_market_price_no_orders(self):
+        bids = [(10, 20), (11, 21)]
+        offers = [(5, 15), (6, 16)]
+
+        for b, s in ((bids, None), (bids, []), (None, offers), ([], offers), (None, None), ([], [])):
+            b_orders = orders(b) if b is not None else None
+            o_orders = orders(s) if s is not None else None
+            price, volume = clearing.get_market_price(b_orders, o_orders, 1)
+            self.assertEqual(price, 1)
+            self.assertEqual(volume, 0)
+
+    def test_select_price_pressure_both(self):
+        levels = np.array([10, 11, 12, 13])
+        cbq = np.array([14, 15, 16, 17])
+        csq = np.array([16, 16, 16, 16])
+
+        # Maximum volume ties at 12 and 13, the least residual breaks the tie
+        price, volume = clearing.select_price(levels, cbq, csq, last_price=-1)
+        self.assertEqual(price, .12)
+        self.assertEqual(volume, 16)
+
+    def test_run_tasks(self):
+        tasks = []
+        for i in range(5):
+            bid_p, bid_q = clearing.pack_orders(orders([(10 + i, 5)]))
+            offer_p, offer_q = clearing.pack_orders(orders([(10, 3)]))
+            tasks.append((clearing.clear, (bid_p, bid_q, offer_p, offer_q, -1)))
+
+        expected = [func(*args) for func, args in tasks]
+
+        self.assertEqual(clearing.run_tasks(tasks, 4), expected)
+        self.assertEqual(clearing.run_tasks(tasks, 1), expected)
+        self.assertEqual(clearing.run_tasks([], 4), [])
+
+    def test_fill(self):
+        # Same book as test_order_fill: b_10_06, o_05_06, b_11_06, o_05_05, b_11_05, o_06_05, b_10_05, o_06_07
+        is_bid = np.array([True, False, True, False, True, False, True, False])
+        prices = np.array([1000, 500, 1100, 500, 1100, 600, 1000, 600])
+        quants = np.array([6, 6, 6, 5, 5, 5, 5, 7])
+
+        # The offers at 5 limit the volume to 11, filled by the bids at 11
+        filled = clearing.fill(is_bid, prices, quants, 500)
+        self.assertEqual(list(filled), [0, 6, 6, 5, 5, 0, 0, 0])
+
+        # At 6 the bids limit the volume to 22; the larger offer at 6 is filled last
+        filled = clearing.fill(is_bid, prices, quants, 600)
+        self.assertEqual(list(filled), [6, 6, 6, 5, 5, 5, 5, 6])
+
+        self.assertEqual(list(clearing.fill(is_bid, prices, quants, 1200)), [0] * 8)
+        self.assertEqual(list(clearing.fill(is_bid, prices, quants, 100)), [0] * 8)
+
+    def test_fill_partial(self):
+        is_bid = np.array([True, True, True, False])
+        prices = np.array([1100, 1100, 1200, 1000])
+        quants = np.array([6, 5, 2, 7])
+
+        # Highest price first, then the larger order
+        filled = clearing.fill(is_bid, prices, quants, 1000)
+        self.assertEqual(list(filled), [5, 0, 2, 7])
@@ -2,8 +2,9 @@ import unittest
 from unittest.mock import MagicMock, patch
 
 from rounds.call_market import CallMarket
-from rounds.data_structs import DataForPlayer, DataForOrder
+from rounds.data_structs import DataForPlayer, DataForOrder, update_players, update_orders
 from rounds.models import *
+from rounds.test.helpers import next_session_code
 from test_call_market import get_order
 
 BID = OrderType.BID.value
@@ -29,6 +30,7 @@ all_orders = [b_10_05, b_10_06, b_11_05, b_11_06, o_05_05, o_05_06, o_06_05, o_0
 
 def get_session():
     session = MagicMock()
+    session.code = next_session_code()
     config = {scf.SK_MARGIN_RATIO: MARGIN_RATIO,
               scf.SK_MARGIN_TARGET_RATIO: MARGIN_TARGET,
               scf.SK_MARGIN_PREMIUM: MARGIN_PREM}
@@ -242,6 +244,44 @@ class TestDataForPlayer(unittest.TestCase):
         self.assertEqual(o.price, 45)
         self.assertEqual(o.quantity, 5)
 
+    def test_get_results(self):
+        # Set up
+        d4p = DataForPlayer(basic_player())
+        d4p.shares_result = 105.0
+        d4p.shares_transacted = 5
+        d4p.trans_cost = -50.004
+        d4p.cash_after_trade = 150
+        d4p.dividend_earned = 10.5
+
+        # Execute
+        results = d4p.get_results()
+
+        # Assert
+        self.assertEqual(results['shares_result'], 105)
+        self.assertIsInstance(results['shares_result'], int)
+        self.assertEqual(results['shares_transacted'], 5)
+        self.assertEqual(results['trans_cost'], cu(-50))
+        self.assertEqual(results['cash_after_trade'], cu(150))
+        self.assertEqual(results['dividend_earned'], cu(10.5))
+        self.assertIsNone(results['interest_earned'])
+        self.assertIsNone(results['cash_result'])
+
+    def test_update_players_detached(self):
+        # Set up - players that are not in a db session are updated directly
+        d4ps = [DataForPlayer(basic_player()) for _ in range(2)]
+        for i, d4p in enumerate(d4ps):
+            d4p.shares_result = 100 + i
+            d4p.cash_result = 200 - i
+
+        # Execute
+        update_players(d4ps)
+        update_players([])
+
+        # Assert
+        for i, d4p in enumerate(d4ps):
+            self.assertEqual(d4p.player.shares_result, 100 + i)
+            self.assertEqual(d4p.player.cash_result, 200 - i)
+
 
 # noinspection DuplicatedCode
 class TestDataForOrder(unittest.TestCase):
@@ -312,8 +352,9 @@ class TestDataForOrder(unittest.TestCase):
         self.assertEqual(o.quantity_final, -7777)
         self.assertEqual(d4o.original_quantity, 56)
 
+    @patch('rounds.order_store.next_order_id', return_value=71)
     @patch.object(Order, 'create')
-    def test_update_order_None(self, create_mock):
+    def test_update_order_None(self, create_mock, _):
         # Setup
         d4o = DataForOrder()
         g, _, p = self.basic_setup()
@@ -331,7 +372,8 @@ class TestDataForOrder(unittest.TestCase):
         d4o.update_order()
 
         # Assert
-        create_mock.assert_called_once_with(player=p,
+        create_mock.assert_called_once_with(id=71,
+                                            player=p,
                                             group=g,
                                             order_type=OFFER,
                                             price=-54,
@@ -340,6 +382,31 @@ class TestDataForOrder(unittest.TestCase):
                                             quantity_final=-56,
                                             original_quantity=56)
 
+    @patch('rounds.order_store.next_order_id', return_value=72)
+    @patch.object(Order, 'create')
+    def test_update_orders_detached(self, create_mock, _):
+        # Set up - orders that are not in a db session are updated / created one at a time
+        g, o, p = self.basic_setup()
+        d4o = DataForOrder(o=o)
+        d4o.quantity_final = 3
+        new_d4o = DataForOrder(player=p, group=g, order_type=OFFER, price=5, quantity=2, is_buy_in=True)
+
+        # Execute
+        update_orders([d4o, new_d4o])
+        update_orders(None)
+
+        # Assert
+        self.assertEqual(o.quantity_final, 3)
+        create_mock.assert_called_once_with(id=72,
+                                            player=p,
+                                            group=g,
+                                            order_type=OFFER,
+                                            price=5,
+                                            quantity=2,
+                                            is_buy_in=True,
+                                            quantity_final=0,
+                                            original_quantity=None)
+
     def test_get_total_quantity(self):
         self.assertEqual(CallMarket.get_total_quantity(all_orders), 45)
         self.assertEqual(CallMarket.get_total_quantity([]), 0)
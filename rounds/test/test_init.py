@@ -3,19 +3,19 @@
 # os.chdir("../../")
 
 import unittest
-from collections import defaultdict
 from unittest.mock import MagicMock, patch, call, ANY
 
 from otree import database
 from otree.api import cu
-from otree.models import Session, Participant
+from otree.models import Participant
 
 import rounds
 from rounds import get_debt_message, Group, OrderType, OrderErrorCode, Order
 from rounds import get_short_message
 from rounds import Constants
+from rounds.order_cache import OrderAggregates
 from rounds.test.test_call_market import get_order
-from rounds.test.test_market_iteration import basic_player, get_group
+from rounds.test.helpers import basic_player, get_group, new_session, sess_config
 import common.SessionConfigFunctions as scf
 
 LIMIT = -600
@@ -136,8 +136,7 @@ class TestInitFunctions(unittest.TestCase):
                   scf.SK_DIV_DIST: '.5 .5',
                   scf.SK_DIV_AMOUNT: '0 100'
                   }
-        session = Session()
-        session.config = config
+        session = new_session(config)
         group = Group()
         group.session = session
         group.round_number = 1
@@ -194,8 +193,7 @@ class TestInitFunctions(unittest.TestCase):
                   scf.SK_DIV_DIST: '.5 .5',
                   scf.SK_DIV_AMOUNT: '0 100'
                   }
-        session = Session()
-        session.config = config
+        session = new_session(config)
         group = Group()
         group.session = session
         group.round_number = 1
@@ -242,8 +240,7 @@ class TestInitFunctions(unittest.TestCase):
                   scf.SK_DIV_DIST: '.5 .5',
                   scf.SK_DIV_AMOUNT: '0 100'
                   }
-        session = Session()
-        session.config = config
+        session = new_session(config)
         group = Group()
         group.session = session
         group.round_number = 1
@@ -347,7 +344,7 @@ class TestInitFunctions(unittest.TestCase):
     @patch('rounds.is_order_form_valid', return_value=(999, None, None, None))
     @patch('rounds.is_borrowing_too_much', return_value=False)
     def test_is_order_valid_form_not_valid(self, _, _1):
-        error_code = rounds.is_order_valid(None, {}, {})
+        error_code = rounds.is_order_valid(None, {}, OrderAggregates())
 
         # Assert
         self.assertEqual(error_code, 999)
@@ -355,7 +352,7 @@ class TestInitFunctions(unittest.TestCase):
     @patch('rounds.is_order_form_valid', return_value=(0, None, -1, -2))
     @patch('rounds.is_borrowing_too_much', return_value=False)
     def test_is_order_valid_neg_price_and_quant(self, _, _1):
-        error_code = rounds.is_order_valid(None, {}, {})
+        error_code = rounds.is_order_valid(None, {}, OrderAggregates())
 
         expected_error_code = OrderErrorCode.PRICE_NEGATIVE.value + \
                               OrderErrorCode.QUANT_NEGATIVE.value
@@ -366,7 +363,7 @@ class TestInitFunctions(unittest.TestCase):
     @patch('rounds.is_order_form_valid', return_value=(0, None, -1, 2))
     @patch('rounds.is_borrowing_too_much', return_value=False)
     def test_is_order_valid_neg_price(self, _, _1):
-        error_code = rounds.is_order_valid(None, {}, {})
+        error_code = rounds.is_order_valid(None, {}, OrderAggregates())
 
         expected_error_code = OrderErrorCode.PRICE_NEGATIVE.value
 
@@ -376,7 +373,7 @@ class TestInitFunctions(unittest.TestCase):
     @patch('rounds.is_order_form_valid', return_value=(0, None, 1, -2))
     @patch('rounds.is_borrowing_too_much', return_value=False)
     def test_is_order_valid_neg_quant(self, _, _1):
-        error_code = rounds.is_order_valid(None, {}, {})
+        error_code = rounds.is_order_valid(None, {}, OrderAggregates())
 
         expected_error_code = OrderErrorCode.QUANT_NEGATIVE.value
 
@@ -388,12 +385,11 @@ class TestInitFunctions(unittest.TestCase):
     def test_is_order_valid_buy_price_above_sell(self, _, _1):
         # Set-up
         player = basic_player(id_in_group=-99)
-        order = get_order(player=player, order_type=1, price=4000)
-        orders_by_price = defaultdict(list)
-        orders_by_price[OrderType.OFFER] = [order]
+        order = get_order(player=player, order_type=1, price=4000, quantity=1)
+        aggregates = OrderAggregates.from_orders([order])
 
         # Test
-        error_code = rounds.is_order_valid(player, {}, orders_by_price)
+        error_code = rounds.is_order_valid(player, {}, aggregates)
 
         # Assert
         expected_error_code = OrderErrorCode.BID_GREATER_THAN_ASK.value
@@ -404,12 +400,11 @@ class TestInitFunctions(unittest.TestCase):
     def test_is_order_valid_sell_price_below_buy(self, _, _1):
         # Set-up
         player = basic_player(id_in_group=-99)
-        order = get_order(player=player, order_type=-1, price=4000)
-        orders_by_price = defaultdict(list)
-        orders_by_price[OrderType.BID] = [order]
+        order = get_order(player=player, order_type=-1, price=4000, quantity=1)
+        aggregates = OrderAggregates.from_orders([order])
 
         # Test
-        error_code = rounds.is_order_valid(player, {}, orders_by_price)
+        error_code = rounds.is_order_valid(player, {}, aggregates)
 
         # Assert
         expected_error_code = OrderErrorCode.ASK_LESS_THAN_BID.value
@@ -420,14 +415,12 @@ class TestInitFunctions(unittest.TestCase):
     def test_is_order_valid_sell(self, _, _1):
         # Set-up
         player = basic_player(id_in_group=-99)
-        sell = get_order(player=player, order_type=1, price=4001)
-        buy = get_order(player=player, order_type=-1, price=3999)
-        orders_by_price = defaultdict(list)
-        orders_by_price[OrderType.OFFER] = [sell]
-        orders_by_price[OrderType.BID] = [buy]
+        sell = get_order(player=player, order_type=1, price=4001, quantity=1)
+        buy = get_order(player=player, order_type=-1, price=3999, quantity=1)
+        aggregates = OrderAggregates.from_orders([sell, buy])
 
         # Test
-        error_code = rounds.is_order_valid(player, {}, orders_by_price)
+        error_code = rounds.is_order_valid(player, {}, aggregates)
 
         # Assert
         self.assertEqual(error_code, 0)
@@ -437,14 +430,12 @@ class TestInitFunctions(unittest.TestCase):
     def test_is_order_valid_buy(self, _, _1):
         # Set-up
         player = basic_player(id_in_group=-99)
-        sell = get_order(player=player, order_type=1, price=4001)
-        buy = get_order(player=player, order_type=-1, price=3999)
-        orders_by_price = defaultdict(list)
-        orders_by_price[OrderType.OFFER] = [sell]
-        orders_by_price[OrderType.BID] = [buy]
+        sell = get_order(player=player, order_type=1, price=4001, quantity=1)
+        buy = get_order(player=player, order_type=-1, price=3999, quantity=1)
+        aggregates = OrderAggregates.from_orders([sell, buy])
 
         # Test
-        error_code = rounds.is_order_valid(player, {}, orders_by_price)
+        error_code = rounds.is_order_valid(player, {}, aggregates)
 
         # Assert
         self.assertEqual(error_code, 0)
@@ -488,75 +479,216 @@ class TestInitFunctions(unittest.TestCase):
         buy.to_dict.assert_called_once()
 
     @patch.object(database.db, 'commit')
-    @patch.object(Order, 'create')
-    def test_create_order_from_live_submit(self, create_mock, commit_mock):
+    @patch('rounds.order_store.next_order_id', return_value=44)
+    @patch('rounds.get_order_aggregates', return_value=OrderAggregates())
+    def test_create_order_from_live_submit(self, _, id_mock, commit_mock):
         # Set-up
-        player = basic_player(id_in_group=55)
-        group = get_group([player])
+        player = basic_player(pid=12, id_in_group=55)
+        group = get_group([player], gid=8)
+        group.session = new_session(dict(sess_config, allow_short=True))
         player.group = group
-        o = get_order(oid=44)
-        create_mock.return_value = o
+        player.group_id = 8
 
         # Test
         d = rounds.create_order_from_live_submit(player, OrderType.OFFER, 3000, 2)
 
         # Assert
         self.assertEqual(d['func'], 'order_confirmed')
-        self.assertEqual(d['order_id'], o.id)
-        commit_mock.assert_called_once()
+        self.assertEqual(d['order_id'], 44)
+        self.assertEqual(d['removed'], [])
+        self.assertEqual([o['oid'] for o in d['added']], [44])
+        self.assertEqual(d['added'][0]['price'], '3000.00')
+        commit_mock.assert_not_called()
+        pending = rounds.order_store.PENDING.pop((Order, 8))
+        self.assertEqual(pending.rows[44]['player_id'], 12)
+        self.assertEqual(pending.rows[44]['quantity'], 2)
+        self.assertIsNone(pending.rows[44]['original_quantity'])
+        rounds.order_book.discard_book(group)
+        rounds.short_interest.discard(group)
+
+    @patch('rounds.order_store.next_order_id', return_value=45)
+    @patch('rounds.get_order_aggregates', return_value=OrderAggregates())
+    def test_place_order_short_cap(self, _, _1):
+        # Set-up - a float of 10 with 8 short leaves room for 2 more
+        player = basic_player(pid=12, id_in_group=55, shares=2)
+        group = get_group([player], gid=9)
+        group.session = new_session(dict(sess_config, float_ratio_cap=1.0, allow_short=True))
+        group.float = 10
+        group.short = 8
+        player.group = group
+        player.group_id = 9
 
-    @patch.object(Order, 'filter')
-    @patch.object(Order, 'delete')
-    def test_delete_order(self, del_mock, filter_mock):
-        # Set-up
+        # Test - 2 held shares and 3 short
+        order = rounds.place_order(player, OrderType.OFFER, 10, 5)
+
+        # Assert
+        self.assertEqual((order.quantity, order.original_quantity), (4, 5))
+        pending = rounds.order_store.PENDING.pop((Order, 9))
+        self.assertEqual(pending.rows[45]['original_quantity'], 5)
+        tracker = rounds.short_interest.get_tracker(group)
+        self.assertEqual(tracker.pending, 2)
+        self.assertEqual(tracker.get_limit(), 0)
+
+        rounds.order_book.discard_book(group)
+        rounds.short_interest.discard(group)
+
+    def test_is_shorting(self):
+        player = basic_player(shares=4)
+        group = get_group([player], gid=10)
+        player.group = group
+        aggregates = OrderAggregates.from_orders([get_order(oid=1, order_type=1, price=10, quantity=4)])
+
+        # Without a float cap nothing may be sold short
+        self.assertFalse(rounds.is_shorting(player, OrderAggregates(), 4))
+        self.assertTrue(rounds.is_shorting(player, aggregates, 1))
+        rounds.short_interest.discard(group)
+
+        # Nor with one, unless shorting is turned on
+        group.session = new_session(dict(sess_config, float_ratio_cap=1.0))
+        group.float = 10
+        group.short = 8
+        self.assertTrue(rounds.is_shorting(player, aggregates, 3))
+        rounds.short_interest.discard(group)
+
+        # Then orders are capped and only refused once the cap is reached
+        group.session = new_session(dict(sess_config, float_ratio_cap=1.0, allow_short=True))
+        self.assertFalse(rounds.is_shorting(player, aggregates, 3))
+        rounds.short_interest.get_tracker(group).reserve(2)
+        self.assertTrue(rounds.is_shorting(player, aggregates, 1))
+        rounds.short_interest.discard(group)
+
+    @patch('rounds.order_store.flush_group')
+    def test_market_page_before_next_page(self, flush_mock):
         player = basic_player()
-        filter_mock.return_value = []
+        player.group_id = 7
+
+        # Orders are written when the page is left, whether or not the timer ran out
+        rounds.Market.before_next_page(player, True)
+        flush_mock.assert_called_once_with(7, o_cls=Order)
+        self.assertIs(rounds.MarketGridChoice.before_next_page, rounds.market_page_before_next_page)
+
+    @patch('rounds.get_order_aggregates')
+    @patch('rounds.get_orders_for_player')
+    @patch('rounds.order_store.delete_order')
+    def test_delete_order_releases_short(self, _, o4p_mock, agg_mock):
+        # Set-up - 2 held and 3 short between the two SELL orders
+        player = basic_player(shares=2)
+        group = get_group([player], gid=12)
+        group.session = new_session(dict(sess_config, allow_short=True))
+        player.group = group
+        sell_1 = get_order(oid=54, order_type=1, price=10, quantity=2)
+        sell_2 = get_order(oid=55, order_type=1, price=11, quantity=3)
+        o4p_mock.return_value = [sell_1, sell_2]
+        agg_mock.return_value = OrderAggregates.from_orders([sell_1, sell_2])
+        tracker = rounds.short_interest.get_tracker(group)
+        tracker.reserve(3)
 
         # Test
-        rounds.delete_order(player, 55)
+        rounds.delete_order(player, 54)
+
+        # Assert - removing either order takes 2 shares off the short sale
+        self.assertEqual(tracker.pending, 1)
+        rounds.order_book.discard_book(group)
+        rounds.short_interest.discard(group)
+
+    @patch('rounds.place_order')
+    def test_create_orders_from_live_submit(self, place_mock):
+        # Set-up
+        player = basic_player(shares=4, cash=100)
+        player.group = get_group([player], gid=11)
+        aggregates = OrderAggregates()
+        oids = iter(range(1, 10))
+
+        def place(p, t, price, quant, o_cls):
+            o = get_order(oid=next(oids), order_type=t.value, price=price, quantity=quant)
+            aggregates.add(o)
+            return o
+
+        place_mock.side_effect = place
+        orders_data = [dict(type='SELL', price='10', quantity='3'),
+                       dict(type='SELL', price='11', quantity='3'),  # combined with the first, a short
+                       dict(type='BUY', price='5', quantity='10'),
+                       dict(type='BUY', price='5', quantity='30')]  # combined with the third, more than the cash
+
+        # Test
+        d = rounds.create_orders_from_live_submit(player, orders_data, aggregates)
 
         # Assert
-        filter_mock.assert_called_once_with(player=player, id=55)
-        del_mock.assert_not_called()
+        self.assertEqual(d['func'], 'orders_submitted')
+        self.assertEqual([r['error_code'] for r in d['results']],
+                         [0, OrderErrorCode.SHORTING.value, 0, OrderErrorCode.MARGIN.value])
+        self.assertEqual([r['order_id'] for r in d['results']], [1, None, 2, None])
+        self.assertEqual(len(d['added']), 2)
+        self.assertEqual(aggregates.offer_quantity, 3)
+        self.assertEqual(aggregates.bid_cost, 50)
+        rounds.short_interest.discard(player.group)
+
+    @patch('rounds.place_order')
+    def test_create_orders_from_live_submit_max_orders(self, place_mock):
+        # Set-up
+        player = basic_player(shares=0, cash=1000)
+        player.group = get_group([player], gid=12)
+        aggregates = OrderAggregates.from_orders(
+            get_order(oid=oid, order_type=OrderType.BID.value, price=1, quantity=1) for oid in range(1, 5))
+        oids = iter(range(5, 10))
+
+        def place(p, t, price, quant, o_cls):
+            o = get_order(oid=next(oids), order_type=t.value, price=price, quantity=quant)
+            aggregates.add(o)
+            return o
+
+        place_mock.side_effect = place
+        orders_data = [dict(type='BUY', price='2', quantity='1') for _ in range(3)]
+
+        # Test
+        d = rounds.create_orders_from_live_submit(player, orders_data, aggregates)
+
+        # Assert
+        self.assertEqual([r['error_code'] for r in d['results']],
+                         [0, 0, OrderErrorCode.TOO_MANY_ORDERS.value])
+        self.assertEqual([r['order_id'] for r in d['results']], [5, 6, None])
+        self.assertEqual(place_mock.call_count, 2)
+        self.assertEqual(len(aggregates.orders), rounds.MAX_ORDERS)
 
-    @patch.object(Order, 'filter')
-    @patch.object(Order, 'delete')
-    def test_delete_order(self, del_mock, filter_mock):
+    @patch('rounds.get_orders_for_player', return_value=[])
+    @patch('rounds.order_store.delete_order')
+    def test_delete_order(self, del_mock, o4p_mock):
         # Set-up
         player = basic_player()
-        filter_mock.return_value = []
 
         # Test
-        rounds.delete_order(player, 55)
+        d = rounds.delete_order(player, 55)
 
         # Assert
-        filter_mock.assert_called_once_with(player=player, id=55)
+        o4p_mock.assert_called_once_with(player, o_cls=Order)
         del_mock.assert_not_called()
+        self.assertEqual(d, {})
 
-    @patch.object(Order, 'filter')
-    @patch.object(Order, 'delete')
-    def test_delete_order_found(self, del_mock, filter_mock):
+    @patch('rounds.get_orders_for_player')
+    @patch('rounds.order_store.delete_order')
+    def test_delete_order_found(self, del_mock, o4p_mock):
         # Set-up
         player = basic_player()
-        filter_mock.return_value = ['o1', 'o2']
+        o4p_mock.return_value = [get_order(oid=54), get_order(oid=55)]
 
         # Test
-        rounds.delete_order(player, 55)
+        d = rounds.delete_order(player, '55')
 
         # Assert
-        filter_mock.assert_called_once_with(player=player, id=55)
-        del_mock.assert_has_calls([call('o1'), call('o2')])
+        del_mock.assert_called_once_with(player, 55, o_cls=Order)
+        self.assertEqual(d['func'], 'order_delta')
+        self.assertEqual(d['removed'], [55])
 
     def test_get_warnings_borrow(self):
         # Set-up
         player = basic_player(shares=4, cash=5000)
-        buy1 = get_order(order_type=-1, quantity=1, price=1001)
-        sell_1 = get_order(order_type=1, quantity=2)
-        sell_2 = get_order(order_type=1, quantity=3)
-        obt = {OrderType.OFFER: [sell_1, sell_2], OrderType.BID: [buy1]}
+        buy1 = get_order(oid=1, order_type=-1, quantity=1, price=1001)
+        sell_1 = get_order(oid=2, order_type=1, quantity=2)
+        sell_2 = get_order(oid=3, order_type=1, quantity=3)
+        aggregates = OrderAggregates.from_orders([sell_1, sell_2, buy1])
 
         # Test
-        warnings = rounds.get_order_warnings(player, OrderType.BID, 2000, 2, obt)
+        warnings = rounds.get_order_warnings(player, OrderType.BID, 2000, 2, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 2)
@@ -566,13 +698,13 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_short(self):
         # Set-up
         player = basic_player(shares=4, cash=5000)
-        buy1 = get_order(order_type=-1, quantity=1, price=1001)
-        buy2 = get_order(order_type=-1, quantity=2, price=2000)
-        sell_1 = get_order(order_type=1, quantity=3)
-        obt = {OrderType.OFFER: [sell_1], OrderType.BID: [buy1, buy2]}
+        buy1 = get_order(oid=4, order_type=-1, quantity=1, price=1001)
+        buy2 = get_order(oid=5, order_type=-1, quantity=2, price=2000)
+        sell_1 = get_order(oid=6, order_type=1, quantity=3)
+        aggregates = OrderAggregates.from_orders([sell_1, buy1, buy2])
 
         # Test
-        warnings = rounds.get_order_warnings(player, OrderType.OFFER, 0, 2, obt)
+        warnings = rounds.get_order_warnings(player, OrderType.OFFER, 0, 2, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 2)
@@ -582,11 +714,11 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_short_any_supply_is_warn(self):
         # Set-up
         player = basic_player(shares=-1, cash=5000)
-        sell_1 = get_order(order_type=1, quantity=3)
-        obt = {OrderType.OFFER: [sell_1], OrderType.BID: []}
+        sell_1 = get_order(oid=7, order_type=1, quantity=3)
+        aggregates = OrderAggregates.from_orders([sell_1])
 
         # Test
-        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, obt)
+        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 1)
@@ -595,10 +727,10 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_short_any_supply_is_warn_2(self):
         # Set-up
         player = basic_player(shares=-1, cash=5000)
-        obt = {OrderType.OFFER: [], OrderType.BID: []}
+        aggregates = OrderAggregates.from_orders([])
 
         # Test
-        warnings = rounds.get_order_warnings(player, OrderType.OFFER, 0, 1, obt)
+        warnings = rounds.get_order_warnings(player, OrderType.OFFER, 0, 1, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 1)
@@ -607,11 +739,11 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_any_cost_warn(self):
         # Set-up
         player = basic_player(shares=4, cash=0)
-        buy1 = get_order(order_type=-1, quantity=1, price=1001)
-        obt = {OrderType.OFFER: [], OrderType.BID: [buy1]}
+        buy1 = get_order(oid=8, order_type=-1, quantity=1, price=1001)
+        aggregates = OrderAggregates.from_orders([buy1])
 
         # Test
-        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, obt)
+        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 1)
@@ -620,10 +752,10 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_any_cost_warn_2(self):
         # Set-up
         player = basic_player(shares=4, cash=-1)
-        obt = {OrderType.OFFER: [], OrderType.BID: []}
+        aggregates = OrderAggregates.from_orders([])
 
         # Test
-        warnings = rounds.get_order_warnings(player, OrderType.BID, 1, 1, obt)
+        warnings = rounds.get_order_warnings(player, OrderType.BID, 1, 1, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 1)
@@ -632,13 +764,13 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_no_order(self):
         # Set-up
         player = basic_player(shares=4, cash=5000)
-        buy1 = get_order(order_type=-1, quantity=1, price=1001)
-        buy2 = get_order(order_type=-1, quantity=2, price=2000)
-        sell_1 = get_order(order_type=1, quantity=3)
-        obt = {OrderType.OFFER: [sell_1], OrderType.BID: [buy1, buy2]}
+        buy1 = get_order(oid=9, order_type=-1, quantity=1, price=1001)
+        buy2 = get_order(oid=10, order_type=-1, quantity=2, price=2000)
+        sell_1 = get_order(oid=11, order_type=1, quantity=3)
+        aggregates = OrderAggregates.from_orders([sell_1, buy1, buy2])
 
         # Test
-        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, obt)
+        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 1)
@@ -647,10 +779,10 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_no_order_already_short(self):
         # Set-up
         player = basic_player(shares=-4, cash=5000)
-        obt = {OrderType.OFFER: [], OrderType.BID: []}
+        aggregates = OrderAggregates.from_orders([])
 
         # Test
-        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, obt)
+        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 0)
@@ -658,17 +790,17 @@ class TestInitFunctions(unittest.TestCase):
     def test_get_warnings_no_order_already_debt(self):
         # Set-up
         player = basic_player(shares=4, cash=-5000)
-        obt = {OrderType.OFFER: [], OrderType.BID: []}
+        aggregates = OrderAggregates.from_orders([])
 
         # Test
-        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, obt)
+        warnings = rounds.get_order_warnings(player, 'no_order', 0, 0, aggregates)
 
         # Assert
         self.assertEqual(len(warnings), 0)
 
-    @patch('rounds.delete_order')
+    @patch('rounds.delete_order', return_value={'func': 'order_delta', 'seq': 3, 'added': [], 'removed': [7]})
     @patch('rounds.get_orders_for_player', return_value=[])
-    @patch('rounds.get_orders_by_type', return_value={})
+    @patch('rounds.get_order_aggregates', return_value={})
     @patch('rounds.is_order_form_valid', side_effect=TypeError)
     @patch('rounds.is_order_valid', side_effect=TypeError)
     @patch('rounds.create_order_from_live_submit', side_effect=TypeError)
@@ -685,7 +817,7 @@ class TestInitFunctions(unittest.TestCase):
         # Assert
         del_m.assert_called_once_with(player, '7', o_cls=ANY)
         o4p_m.assert_called_once_with(player, o_cls=ANY)
-        obt_m.assert_called_once_with([])
+        obt_m.assert_called_once_with(player, o_cls=ANY)
         is_vf_m.assert_not_called()
         is_v_m.assert_not_called()
         create_m.assert_not_called()
@@ -693,10 +825,12 @@ class TestInitFunctions(unittest.TestCase):
         warn_m.assert_called_once_with(player, 'no_order', 0, 0, {})
         self.assertEqual(d.keys(), {66})
         self.assertEqual(d[66]['warnings'], ['abc', 'def'])
+        self.assertEqual(d[66]['func'], 'order_delta')
+        self.assertEqual(d[66]['removed'], [7])
 
     @patch('rounds.delete_order', side_effect=TypeError)
     @patch('rounds.get_orders_for_player', return_value=[])
-    @patch('rounds.get_orders_by_type', return_value={})
+    @patch('rounds.get_order_aggregates', return_value={})
     @patch('rounds.is_order_form_valid', return_value=(1, None, None, None))
     @patch('rounds.is_order_valid', return_value=1)
     @patch('rounds.create_order_from_live_submit', side_effect=TypeError)
@@ -714,7 +848,7 @@ class TestInitFunctions(unittest.TestCase):
         # Assert
         del_m.assert_not_called()
         o4p_m.assert_called_once_with(player, o_cls=ANY)
-        obt_m.assert_called_once_with([])
+        obt_m.assert_called_once_with(player, o_cls=ANY)
         is_vf_m.assert_called_once_with(form_data)
         is_v_m.assert_called_once_with(player, form_data, {})
         create_m.assert_not_called()
@@ -728,7 +862,7 @@ class TestInitFunctions(unittest.TestCase):
 
     @patch('rounds.delete_order', side_effect=TypeError)
     @patch('rounds.get_orders_for_player', return_value=[])
-    @patch('rounds.get_orders_by_type', return_value={})
+    @patch('rounds.get_order_aggregates', return_value={})
     @patch('rounds.is_order_form_valid', return_value=(0, None, None, None))
     @patch('rounds.is_order_valid', return_value=1)
     @patch('rounds.create_order_from_live_submit', side_effect=TypeError)
@@ -746,7 +880,7 @@ class TestInitFunctions(unittest.TestCase):
         # Assert
         del_m.assert_not_called()
         o4p_m.assert_called_once_with(player, o_cls=ANY)
-        obt_m.assert_called_once_with([])
+        obt_m.assert_called_once_with(player, o_cls=ANY)
         is_vf_m.assert_called_once_with(form_data)
         is_v_m.assert_called_once_with(player, form_data, {})
         create_m.assert_not_called()
@@ -760,7 +894,7 @@ class TestInitFunctions(unittest.TestCase):
 
     @patch('rounds.delete_order', side_effect=TypeError)
     @patch('rounds.get_orders_for_player', return_value=[])
-    @patch('rounds.get_orders_by_type', return_value={})
+    @patch('rounds.get_order_aggregates', return_value={})
     @patch('rounds.is_order_form_valid', return_value=(0, OrderType.BID, 3890, 9))
     @patch('rounds.is_order_valid', return_value=0)
     @patch('rounds.create_order_from_live_submit', return_value={'func': 'order_confirmed', 'order_id': 7})
@@ -778,7 +912,7 @@ class TestInitFunctions(unittest.TestCase):
         # Assert
         del_m.assert_not_called()
         o4p_m.assert_called_once_with(player, o_cls=ANY)
-        obt_m.assert_called_once_with([])
+        obt_m.assert_called_once_with(player, o_cls=ANY)
         is_vf_m.assert_called_once_with(form_data)
         is_v_m.assert_called_once_with(player, form_data, {})
         create_m.assert_called_once_with(player, OrderType.BID, 3890, 9, o_cls=ANY)
@@ -792,7 +926,7 @@ class TestInitFunctions(unittest.TestCase):
 
     @patch('rounds.delete_order')
     @patch('rounds.get_orders_for_player', return_value=[9, 8, 7])
-    @patch('rounds.get_orders_by_type', return_value={})
+    @patch('rounds.get_order_aggregates', return_value={})
     @patch('rounds.is_order_form_valid')
     @patch('rounds.is_order_valid')
     @patch('rounds.create_order_from_live_submit')
@@ -810,7 +944,7 @@ class TestInitFunctions(unittest.TestCase):
         # Assert
         del_m.assert_not_called()
         o4p_m.assert_called_once_with(player, o_cls=ANY)
-        obt_m.assert_called_once_with([9, 8, 7])
+        obt_m.assert_called_once_with(player, o_cls=ANY)
         is_vf_m.assert_not_called()
         is_v_m.assert_not_called()
         create_m.assert_not_called()
@@ -822,6 +956,54 @@ class TestInitFunctions(unittest.TestCase):
         self.assertEqual(sub_d['func'], 'order_list')
         self.assertEqual(sub_d['orders'], [1, 2, 3])
 
+    def test_group_vars_for_template(self):
+        # Set-up
+        group = get_group([], market_price=14, gid=71)
+        group.session = new_session(dict(interest_rate=.05, margin_ratio=.5, div_amount='0.4 1.0', div_dist='.5 .5'))
+        group.short = 3
+
+        # Test
+        d = rounds.group_vars_for_template(group)
+        d2 = rounds.group_vars_for_template(group)
+
+        # Assert
+        self.assertIs(d, d2)
+        group.get_last_period_price.assert_called_once()
+        self.assertEqual(d['market_price'], 14)
+        self.assertEqual(d['marg_req_pct'], '50%')
+        self.assertEqual(d['interest_pct'], '5%')
+        self.assertEqual(d['short'], 3)
+
+        rounds.discard_group_template_vars(group)
+        self.assertNotIn((Group, 71), rounds.GROUP_TEMPLATE_VARS)
+
+        # Also dropped once the market is over
+        rounds.group_vars_for_template(group)
+        rounds.discard_market(group)
+        self.assertNotIn((Group, 71), rounds.GROUP_TEMPLATE_VARS)
+
+    def test_discard_market_short_interest(self):
+        group = get_group([], gid=73)
+        rounds.short_interest.get_tracker(group)
+
+        rounds.discard_market(group)
+        self.assertNotIn((Group, 73), rounds.short_interest.TRACKERS)
+
+    def test_result_short(self):
+        # Set-up
+        players = [basic_player(shares_result=-2), basic_player(shares_result=5), basic_player(shares_result=-1)]
+        group = get_group(players, gid=72)
+
+        group.short = 2
+
+        # Test / Assert - summed while the fills are not recorded
+        self.assertEqual(rounds.get_result_short(group), 3)
+
+        rounds.short_interest.record_fills(group, 4)
+        self.assertEqual(rounds.get_result_short(group), 6)
+        rounds.short_interest.discard(group)
+        self.assertEqual(rounds.get_result_short(group), 3)
+
     # noinspection PyArgumentList
     def test_FinalResultsPage_vars(self):
         # Set-up
@@ -830,9 +1012,8 @@ class TestInitFunctions(unittest.TestCase):
         p.participant.payoff = cu(1000)
         p.participant.vars = {'MARKET_PAYMENT': cu(4.56), 'FORECAST_PAYMENT': cu(7.89)}
         p.participant.payoff_plus_participation_fee = MagicMock(return_value=25.55)
-        session = Session()
         config = {'real_world_currency_per_point': 0.02, 'participation_fee': 5.55}
-        session.config = config
+        session = new_session(config)
         p.session = session
         p.participant.session = session
         page = rounds.FinalResultsPage({'type': 'http'}, 'rec', 'send')
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+import common.Instrumentation as inst
+
+
+# noinspection DuplicatedCode
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        inst.reset_metrics()
+        patcher = patch.object(inst, 'ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_histogram(self):
+        h = inst.Histogram([1, 10, 100])
+        for v in [.5, 1, 5, 50, 500]:
+            h.record(v)
+
+        self.assertEqual(h.counts, [2, 1, 1, 1])
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.min, .5)
+        self.assertEqual(h.max, 500)
+        self.assertEqual(h.mean(), 556.5 / 5)
+        self.assertEqual(h.quantile(.5), 10)
+        self.assertEqual(h.quantile(1), 500)
+
+    def test_histogram_empty(self):
+        h = inst.Histogram([1])
+        self.assertIsNone(h.mean())
+        self.assertIsNone(h.quantile(.5))
+
+    def test_instrument_hook(self):
+        @inst.instrument_hook
+        def hook(x, y=1):
+            return x + y
+
+        self.assertEqual(hook(1, y=2), 3)
+        self.assertEqual(hook(1), 2)
+
+        metrics = inst.get_metrics()
+        name = hook.__qualname__
+        self.assertEqual(metrics[name]['wall_ms']['count'], 2)
+        self.assertEqual(metrics[name]['queries']['count'], 2)
+        self.assertEqual(metrics[name]['errors'], 0)
+
+    def test_instrument_hook_name_and_error(self):
+        @inst.instrument_hook('my_hook')
+        def hook():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            hook()
+
+        metrics = inst.get_metrics()
+        self.assertEqual(metrics['my_hook']['errors'], 1)
+        self.assertEqual(metrics['my_hook']['wall_ms']['count'], 1)
+
+    def test_disabled(self):
+        @inst.instrument_hook('off')
+        def hook():
+            return 1
+
+        with patch.object(inst, 'ENABLED', False):
+            self.assertEqual(hook(), 1)
+        self.assertNotIn('off', inst.get_metrics())
+
+    def test_nested_peaks(self):
+        @inst.instrument_hook('inner')
+        def inner():
+            return bytearray(64 * 1024)
+
+        @inst.instrument_hook('outer')
+        def outer():
+            big = bytearray(1024 * 1024)
+            del big
+            inner()
+
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            outer()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+        metrics = inst.get_metrics()
+        # The inner hook reset the peak after the large allocation, but the outer hook still reports it
+        self.assertGreaterEqual(metrics['outer']['alloc_kb']['max'], 1024)
+        self.assertLess(metrics['inner']['alloc_kb']['max'], 1024)
+
+    def test_summary_and_dump(self):
+        inst.record('a', 12.5, 3)
+        inst.record('a', 7.5, 1, alloc_kb=10)
+
+        rows = inst.get_summary_rows()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['calls'], 2)
+        self.assertEqual(rows[0]['mean_ms'], 10)
+        self.assertEqual(rows[0]['max_queries'], 3)
+        self.assertEqual(rows[0]['mean_alloc_kb'], 10)
+
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            inst.dump_metrics(path)
+            with open(path) as f:
+                dumped = json.load(f)
+        finally:
+            os.remove(path)
+        self.assertEqual(dumped['hooks']['a']['wall_ms']['count'], 2)
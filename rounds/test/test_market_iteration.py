@@ -10,29 +10,12 @@ from rounds.market_iteration import MarketIteration
 from rounds.market_iteration import get_orders_by_player, concat_or_null, ensure_order_data
 from test_call_market import get_order
 from test_call_market import basic_group
+from rounds.test.helpers import basic_player, get_group, sess_config
 
 BID = OrderType.BID.value
 OFFER = OrderType.OFFER.value
 
 
-def basic_player(pid=None, id_in_group=None, **kwargs):
-    player = MagicMock(spec=Player)
-    s = kwargs.get('shares', 0)
-    c = kwargs.get('cash', 0)
-
-    player.is_short = MagicMock(return_value = s < 0)
-
-    player.shares = s
-    player.cash = c
-    player.shares_result = kwargs.get('shares_result', 0)
-    player.cash_result = kwargs.get('cash_result', 0)
-    if pid:
-        player.id = pid
-    if id_in_group:
-        player.id_in_group = id_in_group
-    return player
-
-
 def basic_iteration(offers=None, bids=None, group=None, dividend=100, players=None, last_price=1375):
     if not group:
         group = basic_group()
@@ -62,23 +45,6 @@ sell_off_p1 = get_order(player=p1, order_type=OFFER, price=8, quantity=1)
 all_bids = [b_10_05, b_10_06, b_11_05, b_11_06]
 all_offers = [o_05_05, o_05_06, o_06_05, o_06_07]
 
-sess_config = dict(interest_rate=.1,
-                   margin_ratio=.2,
-                   margin_premium=.3,
-                   margin_target_ratio=.4)
-
-
-def get_group(players, market_price=98, gid=None):
-    group = Group()
-    if gid:
-        group.id = gid
-    group.get_players = MagicMock(return_value=players)
-    group.get_last_period_price = MagicMock(return_value=market_price)
-    group.session = Session()
-    group.session.config = sess_config
-    return group
-
-
 # noinspection PyUnresolvedReferences
 class TestMarketIteration(unittest.TestCase):
 
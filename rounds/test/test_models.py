@@ -1,12 +1,19 @@
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
-from otree.models import Session
+from otree.models import Participant
 
 from rounds.models import *
+from rounds.test.helpers import new_session
 from rounds.test.test_call_market import basic_group
 
 
+def get_participant(**part_vars):
+    participant = Participant()
+    participant.vars = part_vars
+    return participant
+
+
 class TestOrderErrorCodeMethods(unittest.TestCase):
 
     def test_combine(self):
@@ -64,8 +71,7 @@ class TestOrderMethods(unittest.TestCase):
 def setup_margin_violation_tests(ratio=None, price=None, shares=None, cash=None, atd=None):
     config = {scf.SK_MARGIN_RATIO: ratio,
               scf.SK_AUTO_TRANS_DELAY: atd}
-    session = Session()
-    session.config = config
+    session = new_session(config)
     group = Group()
     group.round_number = 5
     group.session = session
@@ -439,15 +445,15 @@ class TestPlayerMethods(unittest.TestCase):
 
     def generic_forecast_test(self, f0=None, price=None, reward=None, error=None):
         # Setup
-        session = Session()
         config = {scf.SK_FORECAST_REWARD: 500, scf.SK_FORECAST_THOLD: 250}
-        session.config = config
+        session = new_session(config)
 
         p = Player()
         p.f0 = f0
         p.cash_result = 0
         p.forecast_reward = 0
         p.session = session
+        p.participant = get_participant(FORECAST_TOTAL=cu(1000))
 
         # Test
         p.determine_forecast_reward(price)
@@ -456,6 +462,7 @@ class TestPlayerMethods(unittest.TestCase):
         self.assert_equal_or_none(p.forecast_reward, reward)
         self.assert_equal_or_none(p.forecast_error, error)
         self.assert_equal_or_none(p.cash_result, 0)
+        self.assertEqual(p.participant.vars['FORECAST_TOTAL'], cu(1000) + (reward or 0))
 
     def test_forecasts(self):
         self.generic_forecast_test(f0=1000, price=750, reward=500, error=250)
@@ -463,14 +470,51 @@ class TestPlayerMethods(unittest.TestCase):
         self.generic_forecast_test(f0=500, price=750, reward=500, error=250)
         self.generic_forecast_test(f0=499, price=750, reward=0, error=251)
 
+    def test_forecast_total_redetermined(self):
+        session = new_session({scf.SK_FORECAST_REWARD: 500, scf.SK_FORECAST_THOLD: 250})
+        p = Player()
+        p.f0 = 1000
+        p.forecast_reward = 0
+        p.session = session
+        p.participant = get_participant()
+
+        p.determine_forecast_reward(750)
+        p.determine_forecast_reward(750)
+        self.assertEqual(p.get_forecast_total(), cu(500))
+
+        p.determine_forecast_reward(700)
+        self.assertEqual(p.get_forecast_total(), cu(0))
+
+    def test_forecast_total_without_running_total(self):
+        p = Player()
+        p.participant = get_participant()
+        p.in_all_rounds = MagicMock(return_value=[MagicMock(forecast_reward=cu(5)),
+                                                  MagicMock(forecast_reward=cu(0)),
+                                                  MagicMock(forecast_reward=cu(5))])
+        self.assertEqual(p.get_forecast_total(), cu(10))
+
+    @patch('rounds.models.scf.get_fundamental_value', return_value=cu(14))
+    def test_market_equity(self, _):
+        p = Player()
+        p.participant = get_participant()
+        p.shares_result = 3
+        p.cash_result = cu(100)
+
+        self.assertEqual(p.get_market_equity(), cu(142))
+
+        # Served from the snapshot
+        p.cash_result = cu(0)
+        self.assertEqual(p.get_market_equity(), cu(142))
+        p.record_market_equity()
+        self.assertEqual(p.get_market_equity(), cu(42))
+
 
 class TestGroupMethods(unittest.TestCase):
     def test_get_short_limit(self):
         # Set-up
         group = Group()
-        session = Session()
         config = {scf.SK_FLOAT_RATIO_CAP: 1.0}
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.short = 10
         group.float = 12
@@ -484,9 +528,8 @@ class TestGroupMethods(unittest.TestCase):
     def test_get_short_limit_high_ratio(self):
         # Set-up
         group = Group()
-        session = Session()
         config = {scf.SK_FLOAT_RATIO_CAP: 1.5}
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.short = 17
         group.float = 12
@@ -500,9 +543,8 @@ class TestGroupMethods(unittest.TestCase):
     def test_get_short_limit_no_limit(self):
         # Set-up
         group = Group()
-        session = Session()
         config = {}
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.short = 10
         group.float = 12
@@ -516,9 +558,8 @@ class TestGroupMethods(unittest.TestCase):
     def test_get_short_limit_at_limit(self):
         # Set-up
         group = Group()
-        session = Session()
         config = {scf.SK_FLOAT_RATIO_CAP: 1.5}
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.short = 18
         group.float = 12
@@ -532,9 +573,8 @@ class TestGroupMethods(unittest.TestCase):
     def test_get_short_limit_over_limit(self):
         # Set-up
         group = Group()
-        session = Session()
         config = {scf.SK_FLOAT_RATIO_CAP: 1.5}
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.short = 19
         group.float = 12
@@ -569,8 +609,7 @@ class TestGroupMethods(unittest.TestCase):
         # Set-up
         group = Group()
         config = {scf.SK_INITIAL_PRICE: 800}
-        session = Session()
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.in_round = MagicMock(side_effect=InvalidRoundError)
         group.round_number = 1
@@ -588,8 +627,7 @@ class TestGroupMethods(unittest.TestCase):
         config = dict(div_dist='0.5 0.5',
                       div_amount='40 100',
                       interest_rate=.05)
-        session = Session()
-        session.config = config
+        session = new_session(config)
         group.session = session
         group.in_round = MagicMock(side_effect=InvalidRoundError)
         group.round_number = 1
@@ -654,8 +692,7 @@ class TestGroupMethods(unittest.TestCase):
         player = Player()
         player.shares = 2
         player.cash = 100
-        session = Session()
-        session.config = {scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7}
+        session = new_session({scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7})
         player.session = session
 
         # Test
@@ -673,8 +710,7 @@ class TestGroupMethods(unittest.TestCase):
         player = Player()
         player.shares = 2
         player.cash = -100
-        session = Session()
-        session.config = {scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7}
+        session = new_session({scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7})
         player.session = session
 
         # Test
@@ -692,8 +728,7 @@ class TestGroupMethods(unittest.TestCase):
         player = Player()
         player.shares = -2
         player.cash = 100
-        session = Session()
-        session.config = {scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7}
+        session = new_session({scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7})
         player.session = session
 
         # Test
@@ -711,8 +746,7 @@ class TestGroupMethods(unittest.TestCase):
         player = Player()
         player.shares_result = -2
         player.cash_result = 100
-        session = Session()
-        session.config = {scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7}
+        session = new_session({scf.SK_MARGIN_RATIO: 0.6, scf.SK_MARGIN_TARGET_RATIO: 0.7})
         player.session = session
 
         # Test
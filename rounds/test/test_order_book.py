@@ -0,0 +1,152 @@
+import random
+import unittest
+
+import numpy as np
+
+from rounds import clearing, order_book
+from rounds.models import *
+from rounds.order_book import OrderBook
+from rounds.test.test_call_market import get_order
+
+BID = OrderType.BID.value
+OFFER = OrderType.OFFER.value
+
+
+def expected_curves(book):
+    bids = [(cents, q) for t, cents, q in book.orders.values() if t == BID]
+    offers = [(cents, q) for t, cents, q in book.orders.values() if t == OFFER]
+    return clearing.build_curves(*pack(bids), *pack(offers))
+
+
+def pack(tuples):
+    return np.array([p for p, _ in tuples], dtype=np.int64), np.array([q for _, q in tuples], dtype=np.int64)
+
+
+# noinspection DuplicatedCode
+class TestOrderBook(unittest.TestCase):
+
+    def assert_curves(self, book):
+        levels, cbq, csq = book.get_curves()
+        e_levels, e_cbq, e_csq = expected_curves(book)
+        self.assertEqual(list(levels), list(e_levels))
+        self.assertEqual(list(cbq), list(e_cbq))
+        self.assertEqual(list(csq), list(e_csq))
+
+    def test_add(self):
+        book = OrderBook()
+        book.add(1, BID, 10, 20)
+        book.add(2, BID, 11, 21)
+        book.add(3, BID, 11, 5)
+        book.add(4, OFFER, 5, 15)
+        book.add(5, OFFER, 6, 16)
+        book.add(6, OFFER, 11, 2)
+
+        levels, cbq, csq = book.get_curves()
+        self.assertEqual(list(levels), [500, 600, 1000, 1100])
+        self.assertEqual(list(cbq), [46, 46, 46, 26])
+        self.assertEqual(list(csq), [15, 31, 31, 33])
+        self.assertEqual(len(book), 6)
+        self.assertEqual(book.num_bids, 3)
+        self.assertEqual(book.num_offers, 3)
+
+    def test_add_twice(self):
+        book = OrderBook()
+        book.add(1, BID, 10, 20)
+        book.add(1, BID, 10, 20)
+
+        levels, cbq, csq = book.get_curves()
+        self.assertEqual(list(cbq), [20])
+        self.assertEqual(len(book), 1)
+
+    def test_remove(self):
+        book = OrderBook()
+        book.add(1, BID, 10, 20)
+        book.add(2, OFFER, 5, 15)
+        book.add(3, OFFER, 10, 1)
+
+        book.remove(3)
+        book.remove(99)  # not in the book
+
+        levels, cbq, csq = book.get_curves()
+        self.assertEqual(list(levels), [500, 1000])
+        self.assertEqual(list(cbq), [20, 20])
+        self.assertEqual(list(csq), [15, 15])
+        self.assertEqual(book.num_offers, 1)
+
+    def test_random_updates(self):
+        rng = random.Random(42)
+        book = OrderBook()
+        oids = []
+        for oid in range(500):
+            if oids and rng.random() < .3:
+                book.remove(oids.pop(rng.randrange(len(oids))))
+            else:
+                book.add(oid, rng.choice([BID, OFFER]), rng.randint(900, 1100) / 100, rng.randint(1, 10))
+                oids.append(oid)
+            self.assert_curves(book)
+
+    def test_get_market_price(self):
+        book = OrderBook()
+        book.add(1, BID, 5, 10)
+        book.add(2, BID, 6, 10)
+        book.add(3, OFFER, 5, 10)
+        book.add(4, OFFER, 6, 10)
+
+        self.assertEqual(book.get_market_price(-1), (6, 10))
+
+    def test_get_market_price_pressure_tie(self):
+        # Every level clears 10 with no residual, so the highest is chosen
+        book = OrderBook()
+        book.add(1, BID, 6, 10)
+        book.add(2, OFFER, 5, 10)
+
+        self.assertEqual(book.get_market_price(-1), (6, 10))
+
+    def test_get_market_price_one_side(self):
+        book = OrderBook()
+        book.add(1, BID, 5, 10)
+
+        self.assertEqual(book.get_market_price(47), (47, 0))
+
+    def test_matches(self):
+        o1 = get_order(oid=1, order_type=BID, price=cu(10), quantity=5)
+        o2 = get_order(oid=2, order_type=OFFER, price=cu(9.5), quantity=6)
+        book = OrderBook()
+        book.add_order(o1)
+        book.add_order(o2)
+
+        self.assertTrue(book.matches([o1, o2]))
+        self.assertFalse(book.matches([o1]))
+        self.assertFalse(book.matches(None))
+
+        o2.quantity = 0
+        self.assertFalse(book.matches([o1, o2]))
+
+    def test_copy(self):
+        book = OrderBook()
+        book.add(1, BID, 10, 20)
+
+        book_copy = book.copy()
+        book_copy.add(2, BID, 11, 1)
+
+        self.assertEqual(len(book), 1)
+        self.assertEqual(list(book.get_curves()[1]), [20])
+        self.assertEqual(list(book_copy.get_curves()[1]), [21, 1])
+
+    def test_books_by_group_model(self):
+        class PracticeGroup:
+            id = 3
+
+        group = Group()
+        group.id = 3
+        practice_group = PracticeGroup()
+
+        # Same id, different apps
+        book = order_book.get_book(group)
+        self.assertIsNot(order_book.get_book(practice_group), book)
+        self.assertIs(order_book.peek_book(group), book)
+
+        order_book.discard_book(practice_group)
+        self.assertIsNone(order_book.peek_book(practice_group))
+        self.assertIs(order_book.peek_book(group), book)
+        order_book.discard_book(group)
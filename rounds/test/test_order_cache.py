@@ -0,0 +1,143 @@
+import random
+import unittest
+from unittest.mock import MagicMock, patch
+
+from rounds import order_cache
+from rounds.models import *
+from rounds.order_cache import CachedOrder, OrderAggregates
+
+
+def get_player(pid, group_id=1):
+    return MagicMock(id=pid, id_in_group=pid, group_id=group_id)
+
+
+def get_order(oid, player, order_type=OrderType.BID.value, price=10, quantity=3):
+    o = MagicMock(id=oid, player_id=player.id, player=player, group_id=player.group_id, order_type=order_type,
+                  price=price, quantity=quantity, quantity_final=0, original_quantity=None, is_buy_in=False)
+    o.group.id = player.group_id
+    return o
+
+
+# noinspection DuplicatedCode
+class TestOrderCache(unittest.TestCase):
+
+    def setUp(self):
+        order_cache.CACHES.clear()
+
+    def test_get_orders_once(self):
+        player = get_player(1)
+        o_cls = MagicMock()
+        o_cls.filter.return_value = [get_order(5, player), get_order(6, player)]
+
+        orders = order_cache.get_orders(player, o_cls=o_cls)
+        self.assertEqual([o.id for o in orders], [5, 6])
+
+        order_cache.get_orders(player, o_cls=o_cls)
+        o_cls.filter.assert_called_once_with(player=player)
+
+    def test_add_remove(self):
+        player = get_player(1)
+        other = get_player(2)
+        o_cls = MagicMock()
+        o_cls.filter.return_value = [get_order(5, player)]
+        order_cache.get_orders(player, o_cls=o_cls)
+
+        order_cache.add_order(player, CachedOrder(7, 1, 1, 1, OrderType.OFFER.value, 12, 2), o_cls=o_cls)
+        order_cache.remove_order(player, 5, o_cls=o_cls)
+        self.assertEqual([o.id for o in order_cache.get_orders(player, o_cls=o_cls)], [7])
+        self.assertEqual(order_cache.get_version(player, o_cls=o_cls), 2)
+
+        # Not cached yet - nothing to update
+        order_cache.add_order(other, CachedOrder(8, 2, 2, 1, OrderType.OFFER.value, 12, 2), o_cls=o_cls)
+        order_cache.remove_order(other, 8, o_cls=o_cls)
+        self.assertNotIn(other.id, order_cache.CACHES[(o_cls, 1)])
+        self.assertEqual(order_cache.get_version(other, o_cls=o_cls), 0)
+
+    def test_discard_group(self):
+        player = get_player(1, group_id=3)
+        o_cls = MagicMock()
+        o_cls.filter.return_value = []
+        order_cache.get_orders(player, o_cls=o_cls)
+
+        order_cache.discard_group(MagicMock(id=3), o_cls=o_cls)
+        self.assertNotIn((o_cls, 3), order_cache.CACHES)
+
+        order_cache.get_orders(player, o_cls=o_cls)
+        self.assertEqual(o_cls.filter.call_count, 2)
+
+    @patch('rounds.order_store.flush_group')
+    def test_get_orders_flushes(self, flush_mock):
+        player = get_player(1, group_id=3)
+        o_cls = MagicMock()
+        o_cls.filter.return_value = []
+
+        order_cache.get_orders(player, o_cls=o_cls)
+        order_cache.get_orders(player, o_cls=o_cls)
+        flush_mock.assert_called_once_with(3, o_cls)
+
+    def test_discard_player(self):
+        player = get_player(1)
+        o_cls = MagicMock()
+        o_cls.filter.return_value = []
+        order_cache.get_orders(player, o_cls=o_cls)
+
+        order_cache.discard_player(player, o_cls=o_cls)
+        self.assertEqual(order_cache.CACHES[(o_cls, 1)], {})
+
+    def test_to_dict(self):
+        player = get_player(4)
+        o = Order(id=9, order_type=OrderType.OFFER.value, price=cu(11.5), quantity=4, quantity_final=1,
+                  original_quantity=6, is_buy_in=True)
+        o.player = MagicMock(id_in_group=4)
+        o.group = MagicMock(id=player.group_id)
+        o.group_id = player.group_id
+
+        self.assertEqual(CachedOrder.from_order(o).to_dict(), o.to_dict())
+
+
+def brute_force(orders):
+    offers = [o for o in orders if o.order_type == OrderType.OFFER.value]
+    bids = [o for o in orders if o.order_type == OrderType.BID.value]
+    return (sum(o.quantity for o in offers),
+            sum(o.price * o.quantity for o in bids),
+            min((o.price for o in offers), default=None),
+            max((o.price for o in bids), default=None))
+
+
+class TestOrderAggregates(unittest.TestCase):
+
+    def assert_aggregates(self, aggregates, orders):
+        self.assertEqual((aggregates.offer_quantity, aggregates.bid_cost, aggregates.min_ask(), aggregates.max_bid()),
+                         brute_force(orders))
+
+    def test_add_remove(self):
+        sell_1 = CachedOrder(1, 1, 1, 1, OrderType.OFFER.value, 12, 2)
+        sell_2 = CachedOrder(2, 1, 1, 1, OrderType.OFFER.value, 11, 3)
+        buy = CachedOrder(3, 1, 1, 1, OrderType.BID.value, 9, 4)
+        aggregates = OrderAggregates.from_orders([sell_1, sell_2, buy])
+        self.assert_aggregates(aggregates, [sell_1, sell_2, buy])
+
+        # Adding the same order twice has no effect
+        aggregates.add(sell_1)
+        self.assert_aggregates(aggregates, [sell_1, sell_2, buy])
+
+        aggregates.remove(2)
+        self.assert_aggregates(aggregates, [sell_1, buy])
+        aggregates.remove(3)
+        self.assert_aggregates(aggregates, [sell_1])
+        self.assertEqual(aggregates.max_bid(default=-999), -999)
+
+    def test_random_updates(self):
+        rng = random.Random(7)
+        aggregates = OrderAggregates()
+        orders = {}
+        for oid in range(300):
+            if orders and rng.random() < 0.4:
+                remove_id = rng.choice(list(orders))
+                del orders[remove_id]
+                aggregates.remove(remove_id)
+            else:
+                o = CachedOrder(oid, 1, 1, 1, rng.choice([-1, 1]), cu(rng.randint(100, 3000) / 100), rng.randint(1, 9))
+                orders[oid] = o
+                aggregates.add(o)
+            self.assert_aggregates(aggregates, list(orders.values()))
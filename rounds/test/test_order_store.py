@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from rounds import order_store
+from rounds.models import *
+from rounds.order_store import IdBlock
+
+
+def get_player(pid, group_id=1):
+    return MagicMock(id=pid, group_id=group_id)
+
+
+# noinspection DuplicatedCode
+class TestOrderStore(unittest.TestCase):
+
+    def setUp(self):
+        order_store.PENDING.clear()
+        order_store.ID_BLOCKS.clear()
+
+    @patch('rounds.order_store.dbq')
+    def test_id_block(self, dbq_mock):
+        session = dbq_mock.return_value.session
+        session.get_bind.return_value.dialect.name = 'sqlite'
+        session.query.return_value.scalar.return_value = 41
+        block = IdBlock(Order, size=3)
+
+        self.assertEqual([block.take() for _ in range(3)], [42, 43, 44])
+        self.assertEqual(session.query.call_count, 1)
+
+        # The next block starts above the ids already handed out even if the table has not caught up.
+        self.assertEqual(block.take(), 45)
+        self.assertEqual(session.query.call_count, 2)
+
+    @patch('rounds.order_store.dbq')
+    def test_id_block_empty_table(self, dbq_mock):
+        session = dbq_mock.return_value.session
+        session.get_bind.return_value.dialect.name = 'sqlite'
+        session.query.return_value.scalar.return_value = None
+        self.assertEqual(IdBlock(Order).take(), 1)
+
+    @patch('rounds.order_store.dbq')
+    def test_id_block_sequence(self, dbq_mock):
+        session = dbq_mock.return_value.session
+        session.get_bind.return_value.dialect.name = 'postgresql'
+        # The sequence is moved to the last id of each block
+        session.execute.return_value.scalar.side_effect = [102, 110]
+        block = IdBlock(Order, size=3)
+
+        self.assertEqual([block.take() for _ in range(4)], [100, 101, 102, 108])
+        self.assertEqual(session.execute.call_args[0][1], dict(table=Order.__table__.name, size=3))
+        session.query.assert_not_called()
+
+    @patch('rounds.order_store.next_order_id', side_effect=[7, 8])
+    def test_add_delete_pending(self, _):
+        player = get_player(3)
+        oid = order_store.add_order(player, OrderType.BID.value, cu(10), 2)
+        order_store.add_order(player, OrderType.OFFER.value, cu(12), 1)
+        order_store.delete_order(player, oid)
+        order_store.delete_order(player, 5)
+
+        pending = order_store.PENDING[(Order, 1)]
+        self.assertEqual(oid, 7)
+        self.assertEqual(list(pending.rows), [8])
+        self.assertEqual(pending.rows[8]['player_id'], 3)
+        self.assertEqual(pending.deleted, {5})
+
+    @patch('rounds.order_store.dbq')
+    @patch('rounds.order_store.next_order_id', return_value=7)
+    def test_flush_group(self, _, dbq_mock):
+        session = dbq_mock.return_value.session
+        player = get_player(3)
+        order_store.add_order(player, OrderType.BID.value, cu(10), 2)
+        order_store.delete_order(player, 5)
+
+        self.assertEqual(order_store.flush_group(1), 2)
+        self.assertEqual(session.execute.call_count, 2)
+        self.assertNotIn((Order, 1), order_store.PENDING)
+
+        # Nothing left to write
+        self.assertEqual(order_store.flush_group(1), 0)
+        self.assertEqual(session.execute.call_count, 2)
+
+    @patch('rounds.order_store.flush_group', return_value=1)
+    @patch('rounds.order_store.next_order_id', return_value=7)
+    def test_flush_if_due(self, _, flush_mock):
+        self.assertFalse(order_store.flush_if_due(1))
+
+        order_store.add_order(get_player(3), OrderType.BID.value, cu(10), 2)
+        self.assertFalse(order_store.flush_if_due(1, seconds=60))
+        flush_mock.assert_not_called()
+
+        self.assertTrue(order_store.flush_if_due(1, seconds=0))
+        flush_mock.assert_called_once_with(1, Order)
+
+    def test_pending_by_model(self):
+        other_cls = MagicMock()
+        order_store.get_pending(1)
+        order_store.get_pending(1, other_cls)
+        self.assertEqual(len(order_store.PENDING), 2)
@@ -0,0 +1,182 @@
+import random
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from rounds import positions
+from rounds.data_structs import DataForPlayer
+from rounds.models import *
+
+
+def cents_player(cash_cents, shares):
+    player = Player()
+    player.cash = positions.to_cu(cash_cents)
+    player.shares = shares
+    return player
+
+
+# noinspection DuplicatedCode
+class TestPositions(unittest.TestCase):
+
+    def test_round_half_up(self):
+        rounded = positions.round_half_up(np.array([.5, 1.49, -.5, -2.5, 2.51, 0]))
+        self.assertEqual(list(rounded), [1, 1, -1, -3, 3, 0])
+
+    def test_div_round_half_up(self):
+        q, tie = positions.div_round_half_up(np.array([5, -5, 7, 1]), np.array([2, 2, 2, 3]))
+        self.assertEqual(list(q), [3, -3, 4, 0])
+        self.assertEqual(list(tie), [True, True, True, False])
+
+    def test_net_shares(self):
+        st = positions.net_shares(np.array([0, 0, 2]), [OrderType.BID.value, OrderType.OFFER.value, 1], [5, 2, 3], 3)
+        self.assertEqual(list(st), [3, 0, -3])
+        self.assertEqual(list(positions.net_shares(np.array([], dtype=np.int64), [], [], 2)), [0, 0])
+
+    def test_ratio_threshold(self):
+        # .6 as a float is slightly less than .6
+        self.assertEqual(positions.ratio_threshold(.6), 59)
+        self.assertEqual(positions.ratio_threshold(.5), 50)
+        self.assertEqual(positions.ratio_threshold(0), 0)
+
+    def test_compute_positions_matches_data_for_player(self):
+        rng = random.Random(1)
+        for _ in range(20):
+            n = 50
+            cash = np.array([rng.randint(-50000, 50000) for _ in range(n)], dtype=np.int64)
+            shares = np.array([rng.randint(-10, 10) for _ in range(n)], dtype=np.int64)
+            transacted = np.array([rng.randint(-5, 5) for _ in range(n)], dtype=np.int64)
+            price = rng.randint(1, 3000)
+            dividend = np.float64(rng.choice([0, .4, 1.0, .25]))
+            interest_rate = rng.choice([0, .05, .1, .033])
+            margin_ratio = rng.choice([.5, .6, .75])
+
+            pos = positions.compute_positions(cash, shares, transacted, price, dividend, interest_rate)
+            mv_short, _ = positions.mv_short_mask(pos.shares_result, pos.cash_result, price, margin_ratio)
+            mv_debt, mv_debt_exact = positions.mv_debt_mask(pos.shares_result, pos.cash_result, price, margin_ratio)
+
+            market_price = positions.to_cu(price)
+            for i in range(n):
+                d4p = DataForPlayer(cents_player(int(cash[i]), int(shares[i])))
+                order = MagicMock(order_type=OrderType.BID.value, quantity_final=int(transacted[i]))
+                d4p.get_new_player_position([order], dividend, interest_rate, market_price)
+                d4p.set_mv_short_future(margin_ratio, market_price)
+                d4p.set_mv_debt_future(margin_ratio, market_price)
+
+                self.assertEqual(pos.shares_result[i], d4p.shares_result)
+                self.assertEqual(pos.dividend_earned[i], d4p.dividend_earned)
+                self.assertEqual(positions.to_cu(pos.trans_cost[i]), d4p.trans_cost)
+                self.assertEqual(positions.to_cu(pos.cash_after_trade[i]), d4p.cash_after_trade)
+                self.assertEqual(mv_short[i], d4p.mv_short_future)
+                if pos.exact[i]:
+                    self.assertEqual(positions.to_cu(pos.interest_earned[i]), d4p.interest_earned)
+                    self.assertEqual(positions.to_cu(pos.cash_result[i]), d4p.cash_result)
+                if pos.exact[i] and mv_debt_exact[i]:
+                    self.assertEqual(mv_debt[i], d4p.mv_debt_future)
+
+    def test_compute_positions_tie(self):
+        # 0.05 * 10.10 = 0.505, which is a tie in Currency but not exactly representable as a float
+        pos = positions.compute_positions(np.array([1010]), np.array([0]), np.array([0]), 100, 0, .05)
+        self.assertFalse(pos.exact[0])
+
+    def test_mv_short_mask(self):
+        shares_result = np.array([-10, -10, 5, -10])
+        cash_result = np.array([90000, 90400, 0, 0])
+        mask, _ = positions.mv_short_mask(shares_result, cash_result, 6000, .5)
+        self.assertEqual(list(mask), [True, False, False, True])
+
+        mask, _ = positions.mv_short_mask(shares_result, cash_result, 0, .5)
+        self.assertFalse(mask.any())
+
+    def test_mv_debt_mask(self):
+        shares_result = np.array([10, 10, 10])
+        cash_result = np.array([-40000, -30000, 100])
+        mask, exact = positions.mv_debt_mask(shares_result, cash_result, 6000, .5)
+        self.assertEqual(list(mask), [True, False, False])
+        self.assertTrue(exact.all())
+
+    def test_margin_status_matches_player(self):
+        rng = random.Random(2)
+        for _ in range(20):
+            n = 50
+            cash = np.array([rng.randint(-50000, 50000) for _ in range(n)], dtype=np.int64)
+            shares = np.array([rng.randint(-10, 10) for _ in range(n)], dtype=np.int64)
+            price = rng.randint(1, 3000)
+            margin_ratio = rng.choice([.5, .6, .75])
+
+            status = positions.margin_status(cash, shares, price, margin_ratio)
+
+            group = MagicMock(get_last_period_price=MagicMock(return_value=positions.to_cu(price)))
+            with patch.object(Player, 'group', group), \
+                    patch('rounds.models.scf.get_margin_ratio', return_value=margin_ratio), \
+                    patch('rounds.models.scf.get_margin_target_ratio', return_value=margin_ratio):
+                for i in range(n):
+                    player = cents_player(int(cash[i]), int(shares[i]))
+                    self.assertEqual(status.bankrupt[i], player.is_bankrupt())
+                    if status.exact[i]:
+                        self.assertEqual(status.short_mv[i], player.is_short_margin_violation())
+                        self.assertEqual(status.debt_mv[i], player.is_debt_margin_violation())
+
+    def test_margin_status(self):
+        # short 10 at 60.00 with 1000.00 cash: debt 600.00 and limit 666.67
+        # borrowed 400.00 with 10 at 60.00: debt 400.00 and limit 400.00
+        cash = np.array([100000, 80000, -40000, -10000, -60000])
+        shares = np.array([-10, -10, 10, 10, 10])
+        status = positions.margin_status(cash, shares, 6000, .5)
+        self.assertEqual(list(status.bankrupt), [False, False, False, False, True])
+        self.assertEqual(list(status.short_mv), [False, True, False, False, False])
+        self.assertEqual(list(status.debt_mv), [False, False, True, False, False])
+        self.assertTrue(status.exact.all())
+
+    def test_margin_call_orders_match_data_for_player(self):
+        rng = random.Random(3)
+        target_ratio, premium = .3, .25
+        for _ in range(20):
+            n = 20
+            cash = np.array([rng.randint(-50000, 50000) for _ in range(n)], dtype=np.int64)
+            shares = np.array([rng.randint(-20, 20) for _ in range(n)], dtype=np.int64)
+            price = rng.randint(1, 3000)
+
+            buy_at, buy_quant, sell_at, sell_quant = positions.margin_call_orders(cash, shares, price,
+                                                                                  target_ratio, premium)
+
+            with patch('rounds.data_structs.scf.get_margin_target_ratio', return_value=target_ratio), \
+                    patch('rounds.data_structs.scf.get_margin_premium', return_value=premium):
+                for i in range(n):
+                    # The kernel works in floating point dollars
+                    player = Player()
+                    player.cash = int(cash[i]) / 100
+                    player.shares = int(shares[i])
+                    d4p = DataForPlayer(player)
+                    buy_in = d4p.generate_buy_in_order(buy_at / 100)
+                    sell_off = d4p.generate_sell_off_order(sell_at / 100)
+                    self.assertEqual(buy_quant[i], max(buy_in.quantity, 0))
+                    self.assertEqual(sell_quant[i], sell_off.quantity)
+
+    def test_margin_calls(self):
+        # Same market as TestCallMarket.test_margin_calls: player 0 is short and due for a buy-in
+        cash = np.array([10000, 10000])
+        shares = np.array([-10, 30])
+        order_idx = np.array([0, 1])
+        is_bid = np.array([False, False])
+        prices = np.array([900, 1100])
+        quants = np.array([2, 20])
+
+        calls = positions.margin_calls(cash, shares, np.array([True, False]), np.array([False, False]), order_idx,
+                                       is_bid, prices, quants, cu(10), .6, .3, .25, 10)
+
+        self.assertEqual(list(calls.buying), [True, False])
+        self.assertEqual(calls.buy_at, 1375)
+        self.assertEqual(calls.buy_quant[0], 20)
+        self.assertEqual(list(calls.selling), [False, False])
+        self.assertEqual(list(calls.canceled), [True, False])
+        # Repriced once from 11.00; the buy-in then meets the offer and sets the price, which ends the iterations
+        self.assertEqual(calls.price, 1375)
+
+    def test_margin_calls_not_due(self):
+        calls = positions.margin_calls(np.array([10000]), np.array([-10]), np.array([False]), np.array([False]),
+                                       np.empty(0, dtype=np.int64), np.empty(0, dtype=bool),
+                                       np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), cu(10), .6, .3,
+                                       .25, 10)
+        self.assertFalse(calls.buying.any())
+        self.assertEqual(calls.price, 1000)
@@ -0,0 +1,93 @@
+import unittest
+from unittest.mock import MagicMock
+
+from rounds import price_history
+
+
+class FakeGroup:
+    id_in_subsession = 1
+
+    def __init__(self, round_number, price, volume, session_id, chain):
+        self.round_number = round_number
+        self.price = price
+        self.volume = volume
+        self.session_id = session_id
+        self.in_all_rounds = MagicMock(return_value=chain + [self])
+
+    def field_maybe_none(self, field):
+        return getattr(self, field)
+
+
+def get_group(round_number, price=None, volume=None, session_id=1, chain=None):
+    return FakeGroup(round_number, price, volume, session_id, chain or [])
+
+
+def get_chain(prices):
+    chain = []
+    for r, p in enumerate(prices, start=1):
+        chain.append(get_group(r, price=p, volume=r * 10, chain=list(chain)))
+    return chain
+
+
+# noinspection DuplicatedCode
+class TestPriceHistory(unittest.TestCase):
+
+    def setUp(self):
+        price_history.HISTORIES.clear()
+
+    def test_previous_rounds(self):
+        chain = get_chain([11, 12])
+        group = get_group(3, chain=chain)
+
+        prices, volumes = price_history.get_price_series(group, False, 10)
+        self.assertEqual(prices, [10, 11, 12])
+        self.assertEqual(volumes, [0, 10, 20])
+
+        # Served from the history the second time
+        price_history.get_price_series(group, False, 10)
+        group.in_all_rounds.assert_called_once()
+
+    def test_record(self):
+        chain = get_chain([11, 12])
+        group = get_group(3, chain=chain)
+        price_history.get_price_series(group, False, 10)
+
+        group.price = 13
+        group.volume = 30
+        price_history.record_group(group)
+
+        prices, volumes = price_history.get_price_series(group, True, 10)
+        self.assertEqual(prices, [10, 11, 12, 13])
+        self.assertEqual(volumes, [0, 10, 20, 30])
+        group.in_all_rounds.assert_called_once()
+
+        # The next round only needs what was recorded
+        next_group = get_group(4, chain=chain + [group])
+        prices, _ = price_history.get_price_series(next_group, False, 10)
+        self.assertEqual(prices, [10, 11, 12, 13])
+        next_group.in_all_rounds.assert_not_called()
+
+    def test_reload_when_not_recorded(self):
+        # e.g. practice rounds where the prices are set when the session is created
+        chain = get_chain([11, 12])
+        price_history.get_price_series(chain[0], True, 10)
+
+        prices, _ = price_history.get_price_series(chain[1], True, 10)
+        self.assertEqual(prices, [10, 11, 12])
+        chain[1].in_all_rounds.assert_called_once()
+
+    def test_sessions_kept_apart(self):
+        group = get_group(2, chain=[get_group(1, price=11, volume=1)])
+        other = get_group(2, session_id=2, chain=[get_group(1, price=21, volume=1, session_id=2)])
+
+        self.assertEqual(price_history.get_price_series(group, False, 10)[0], [10, 11])
+        self.assertEqual(price_history.get_price_series(other, False, 10)[0], [10, 21])
+
+    def test_discard(self):
+        group = get_group(2, chain=[get_group(1, price=11, volume=1)])
+        price_history.get_price_series(group, False, 10)
+
+        price_history.discard(group)
+        self.assertEqual(price_history.HISTORIES, {})
+        # Nothing to drop
+        price_history.discard(group)
@@ -1,19 +1,20 @@
 import unittest
+from unittest.mock import patch
 
 from otree.models import Session
 
 import common.SessionConfigFunctions as scf
 from rounds import Group
+from rounds.test.helpers import new_session
 
 
 class Test_Session_Config_Functions(unittest.TestCase):
     def test_get_fundamental_value_r0(self):
         # Set-up
         group = Group()
-        group.session = Session()
-        group.session.config = dict(div_dist='0.5 0.5',
-                                    div_amount='0.40 1.00',
-                                    interest_rate=0)
+        group.session = new_session(dict(div_dist='0.5 0.5',
+                                         div_amount='0.40 1.00',
+                                         interest_rate=0))
         # Execute
         f = scf.get_fundamental_value(group)
 
@@ -23,10 +24,9 @@ class Test_Session_Config_Functions(unittest.TestCase):
     def test_get_fundamental_value(self):
         # Set-up
         group = Group()
-        group.session = Session()
-        group.session.config = dict(div_dist='0.5 0.5',
-                                    div_amount='0.0 1.00',
-                                    interest_rate=0.1)
+        group.session = new_session(dict(div_dist='0.5 0.5',
+                                         div_amount='0.0 1.00',
+                                         interest_rate=0.1))
         # Execute
         f = scf.get_fundamental_value(group)
 
@@ -36,12 +36,67 @@ class Test_Session_Config_Functions(unittest.TestCase):
     def test_get_fundamental_value_exp_relevant(self):
         # Set-up
         group = Group()
-        group.session = Session()
-        group.session.config = dict(div_dist='0.5 0.5',
-                                    div_amount='0.40 1.00',
-                                    interest_rate=0.05)
+        group.session = new_session(dict(div_dist='0.5 0.5',
+                                         div_amount='0.40 1.00',
+                                         interest_rate=0.05))
         # Execute
         f = scf.get_fundamental_value(group)
 
         # Assert
         self.assertEqual(f, 14.00)
+
+    def test_get_config_cached_by_code(self):
+        # Set-up
+        session = Session()
+        session.code = 'test_cache'
+        session.config = dict(div_dist='0.5 0.5',
+                              div_amount='0.40 1.00',
+                              interest_rate=0.05,
+                              endow_stock='0 2 4')
+        group = Group()
+        group.session = session
+        scf.clear_config_cache('test_cache')
+
+        # Execute
+        config = scf.get_config(group)
+
+        # Assert
+        self.assertIs(scf.get_config(session), config)
+        self.assertEqual(config.fundamental_value, 14.00)
+        self.assertEqual(scf.get_endow_stocks(group), [0, 2, 4])
+        with self.assertRaises(ValueError):
+            scf.get_dividend_amounts(group)[0] = 99
+
+        scf.clear_config_cache('test_cache')
+        self.assertIsNot(scf.get_config(session), config)
+
+    @patch.object(scf, 'CONFIG_CACHE_SIZE', 2)
+    def test_get_config_cache_bounded(self):
+        # Set-up
+        scf.clear_config_cache()
+        sessions = []
+        for code in ('s1', 's2', 's3'):
+            session = Session()
+            session.code = code
+            session.config = dict(interest_rate=0.05)
+            sessions.append(session)
+
+        # Execute
+        for session in sessions:
+            scf.get_config(session)
+
+        # Assert - the oldest session is dropped
+        self.assertEqual(list(scf.CONFIG_CACHE), ['s2', 's3'])
+        scf.clear_config_cache()
+
+    def test_ensure_config_copy(self):
+        # Set-up
+        session = new_session(dict(interest_rate=0.05))
+
+        # Execute
+        ret = scf.ensure_config(session)
+        ret['for_results'] = False
+
+        # Assert
+        self.assertNotIn('for_results', session.config)
+        self.assertEqual(ret['interest_rate'], 0.05)
@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from rounds import short_interest
+from rounds.models import NO_SHORT_LIMIT
+from rounds.short_interest import ShortInterest
+from rounds.test.helpers import get_group, new_session, sess_config
+
+
+# noinspection DuplicatedCode
+class TestShortInterest(unittest.TestCase):
+
+    def setUp(self):
+        short_interest.TRACKERS.clear()
+
+    def test_no_cap(self):
+        tracker = ShortInterest(5)
+        self.assertFalse(tracker.is_capped())
+        self.assertEqual(tracker.get_limit(), NO_SHORT_LIMIT)
+        self.assertEqual(tracker.reserve(100), 100)
+
+    def test_reserve_release(self):
+        tracker = ShortInterest(6, max_short=10)
+        self.assertEqual(tracker.get_limit(), 4)
+        self.assertEqual(tracker.reserve(3), 3)
+        self.assertEqual(tracker.reserve(3), 1)
+        self.assertEqual(tracker.get_limit(), 0)
+
+        tracker.release(2)
+        self.assertEqual(tracker.get_limit(), 2)
+        tracker.release(10)
+        self.assertEqual(tracker.pending, 0)
+
+    def test_short_change(self):
+        shares = np.array([-2, 3, 0, -1])
+        shares_result = np.array([0, -1, -4, -1])
+        self.assertEqual(short_interest.short_change(shares, shares_result), 3)
+
+    def test_get_tracker(self):
+        group = get_group([], gid=5)
+        group.session = new_session(dict(sess_config, float_ratio_cap=.5, allow_short=True))
+        group.float = 21
+        group.short = 4
+
+        tracker = short_interest.get_tracker(group)
+        self.assertIs(short_interest.get_tracker(group), tracker)
+        self.assertEqual(tracker.max_short, 10)
+        self.assertEqual(tracker.get_limit(), 6)
+
+    def test_get_max_short_not_allowed(self):
+        group = get_group([], gid=7)
+        group.session = new_session(dict(sess_config, float_ratio_cap=.5))
+        group.float = 21
+        self.assertEqual(short_interest.get_max_short(group), 0)
+
+    def test_result_short(self):
+        group = get_group([], gid=6)
+        group.short = 4
+        self.assertIsNone(short_interest.get_result_short(group))
+
+        short_interest.get_tracker(group).reserve(2)
+        self.assertIsNone(short_interest.get_result_short(group))
+
+        short_interest.record_fills(group, -3)
+        self.assertEqual(short_interest.get_result_short(group), 1)
+
+        short_interest.discard(group)
+        self.assertIsNone(short_interest.get_result_short(group))
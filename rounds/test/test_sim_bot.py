@@ -0,0 +1,88 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from bots import sim_bot
+from bots.sim_bot import SessionAgents
+from bots.simulator import Agents, FEEDBACK, PASSIVE, SPECULATOR
+from rounds import Constants
+from rounds.models import *
+
+
+def get_player(pid, code):
+    return MagicMock(id=pid, participant=MagicMock(code=code))
+
+
+def get_state(kinds, aggression=.1):
+    n = len(kinds)
+    state = SessionAgents(10, 14)
+    state.agents = Agents(np.array(kinds, dtype=np.int8), np.full(n, aggression), np.full(n, .5), np.full(n, 1.0),
+                          np.full(n, .5), np.full(n, 1.0))
+    state.idx_by_participant = {f'p{i}': i for i in range(n)}
+    return state
+
+
+# noinspection DuplicatedCode
+class TestSimBot(unittest.TestCase):
+
+    def setUp(self):
+        sim_bot.SESSIONS.clear()
+
+    @patch('bots.sim_bot.scf.get_init_price', return_value=14.0)
+    @patch('bots.sim_bot.scf.get_fundamental_value', return_value=cu(14))
+    def test_sessions_kept_apart(self, *_):
+        one = MagicMock(session=MagicMock(code='s1'))
+        two = MagicMock(session=MagicMock(code='s2'))
+
+        state = sim_bot.get_session_agents(one)
+        state.record_price(1, 15)
+        self.assertIs(sim_bot.get_session_agents(one), state)
+
+        other = sim_bot.get_session_agents(two)
+        self.assertIsNot(other, state)
+        self.assertEqual(other.prices, [14])
+        self.assertEqual(state.prices, [14, 15])
+
+    def test_assign_types(self):
+        state = SessionAgents(14, 14, seed=1)
+        state.assign_types(['a', 'b', 'c', 'd'])
+
+        self.assertEqual(list(state.agents.kind), [FEEDBACK, FEEDBACK, PASSIVE, SPECULATOR])
+        self.assertEqual(state.idx_by_participant, dict(a=0, b=1, c=2, d=3))
+        self.assertEqual(state.describe(2, 'c'), "PASSIVE:  Participant c")
+
+    def test_record_price(self):
+        state = SessionAgents(14, 14)
+        state.record_price(1, cu(15.5))
+        # A round is only recorded once
+        state.record_price(1, cu(15.5))
+        state.record_price(2, cu(16))
+        self.assertEqual(state.prices, [14, 15, 16])
+
+    def test_get_orders(self):
+        state = get_state([FEEDBACK, PASSIVE, SPECULATOR])
+        state.prices = [14, 16]
+        players = [get_player(1, 'p0'), get_player(2, 'p1'), get_player(3, 'p2')]
+        group = MagicMock(get_players=MagicMock(return_value=players))
+
+        # Feedback: -1 + 2; Passive: -round(.5 * 6); Speculator: 1 + .5 * (20 - 16)
+        bids, offers = sim_bot.get_orders(group, state, 20, 16)
+
+        self.assertEqual([(o.player, o.price, o.quantity) for o in bids], [(players[0], 17, 1), (players[2], 17, 3)])
+        self.assertEqual([(o.player, o.order_type, o.price, o.quantity) for o in offers],
+                         [(players[1], OrderType.OFFER.value, 14, 3)])
+
+    @patch('bots.sim_bot.get_market_price', return_value=(14, 0))
+    @patch('bots.sim_bot.get_orders', return_value=([], []))
+    def test_last_round_drops_session(self, *_):
+        players = [get_player(1, 'p0'), get_player(2, 'p1')]
+        group = MagicMock(session=MagicMock(code='s1'), get_players=MagicMock(return_value=players))
+        group.in_round_or_none.return_value = MagicMock(price=cu(15))
+        sim_bot.SESSIONS['s1'] = get_state([FEEDBACK, PASSIVE])
+
+        sim_bot.call_live_method(None, round_number=2, group=group)
+        self.assertIn('s1', sim_bot.SESSIONS)
+
+        sim_bot.call_live_method(None, round_number=Constants.num_rounds, group=group)
+        self.assertNotIn('s1', sim_bot.SESSIONS)
@@ -0,0 +1,105 @@
+import unittest
+
+import numpy as np
+
+import common.SessionConfigFunctions as scf
+from bots import simulator
+from bots.simulator import Agents, FEEDBACK, PASSIVE, SPECULATOR, SPECULATING, Simulation
+from rounds.models import NO_AUTO_TRANS
+
+
+def get_agents(kinds, aggression=.1, alpha=.01, beta=.01, gamma=.002, delta=1.0):
+    n = len(kinds)
+    return Agents(np.array(kinds, dtype=np.int8), np.full(n, aggression), np.full(n, alpha), np.full(n, beta),
+                  np.full(n, gamma), np.full(n, delta))
+
+
+# noinspection DuplicatedCode
+class TestSimulator(unittest.TestCase):
+
+    def test_get_session_config(self):
+        config = simulator.get_session_config(interest_rate=.04)
+        self.assertEqual(config['name'], 'sim_1')
+        self.assertEqual(config['interest_rate'], .04)
+        self.assertEqual(config['margin_ratio'], .5)
+
+    def test_make_agents(self):
+        agents = simulator.make_agents(8, np.random.default_rng(1))
+        self.assertEqual(list(agents.kind), [FEEDBACK, FEEDBACK, PASSIVE, SPECULATOR, SPECULATOR, SPECULATOR,
+                                             FEEDBACK, FEEDBACK])
+        self.assertTrue(((agents.gamma >= simulator.GAMMA_LO) & (agents.gamma <= simulator.GAMMA_HI)).all())
+        self.assertTrue(((agents.aggression >= simulator.AGG_LO) & (agents.aggression <= simulator.AGG_HI)).all())
+
+    def test_get_demand(self):
+        agents = get_agents([FEEDBACK, PASSIVE, SPECULATOR], alpha=.5, beta=1.0, gamma=.5, delta=1.0)
+
+        # Feedback: -1 + (16 - 14); Passive: -round(.5 * (16 - 10)); Speculator: 1 + .5 * (20 - 16)
+        demand = simulator.get_demand(agents, [14, 16], 10, 20)
+        self.assertEqual(list(demand), [1, -3, 3])
+
+        # Feedback agents sit out the first round and speculators sit out while speculating
+        demand = simulator.get_demand(agents, [16], 10, SPECULATING)
+        self.assertEqual(list(demand), [0, -3, 0])
+
+    def test_get_orders(self):
+        agents = get_agents([FEEDBACK, PASSIVE, SPECULATOR], aggression=.1)
+        order_idx, is_bid, prices, quants = simulator.get_orders(agents, np.array([2, 0, -3]), 14.5)
+
+        self.assertEqual(list(order_idx), [0, 2])
+        self.assertEqual(list(is_bid), [True, False])
+        # int(14.5 * 1.1) and int(14.5 * .9)
+        self.assertEqual(list(prices), [1500, 1300])
+        self.assertEqual(list(quants), [2, 3])
+
+    def test_cap_short_sales(self):
+        is_bid = np.array([False, True, False, False])
+        quants = np.array([5, 4, 3, 2])
+        held = np.array([2, 0, 0, 5])
+
+        # 3 + 3 short; the second OFFER is capped at the 1 share that is left
+        capped = simulator.cap_short_sales(is_bid, quants, held, 4)
+        self.assertEqual(list(capped), [5, 4, 1, 2])
+
+        self.assertEqual(list(simulator.cap_short_sales(is_bid, quants, held, None)), [5, 4, 3, 2])
+        self.assertEqual(list(simulator.cap_short_sales(is_bid, quants, held, 0)), [2, 4, 0, 2])
+
+    def test_get_endowments(self):
+        config = scf.get_config(simulator.get_session_config())
+        cash, shares = simulator.get_endowments(config, 5)
+
+        # The fundamental value is 14.00
+        self.assertEqual(list(shares), [0, 2, 4, 0, 4])
+        self.assertEqual(list(cash), [18400, 15600, 12800, 18400, 12800])
+
+    def test_update_delays(self):
+        delays = np.array([NO_AUTO_TRANS, 2, 0, 1, NO_AUTO_TRANS])
+        violation = np.array([True, True, True, False, True])
+        bankrupt = np.array([False, False, False, False, True])
+
+        delays = simulator.update_delays(delays, violation, bankrupt, 3)
+        self.assertEqual(list(delays), [3, 1, 0, NO_AUTO_TRANS, NO_AUTO_TRANS])
+
+    def test_run(self):
+        config = simulator.get_session_config()
+        result = Simulation(config, 300, seed=7).run(20)
+
+        self.assertEqual(len(result.prices), 21)
+        self.assertEqual(result.prices[0], 14)
+        self.assertEqual(len(result.dividends), 20)
+        self.assertTrue(set(result.dividends) <= {.4, 1.0})
+        self.assertTrue(result.volumes[1:].any())
+
+        # Shares change hands but the float does not change
+        _, shares = simulator.get_endowments(scf.get_config(config), 300)
+        self.assertEqual(result.shares.sum(), shares.sum())
+
+        # Seeded runs repeat
+        again = Simulation(config, 300, seed=7).run(20)
+        self.assertEqual(list(again.prices), list(result.prices))
+        self.assertEqual(list(again.cash), list(result.cash))
+
+    def test_run_short_cap(self):
+        config = simulator.get_session_config(float_ratio_cap=.05, allow_short=True)
+        sim = Simulation(config, 300, seed=3)
+        sim.run(20)
+        self.assertTrue(max(sim.short) <= sim.max_short)
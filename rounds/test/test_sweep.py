@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from bots import simulator, sweep
+
+
+# noinspection DuplicatedCode
+class TestSweep(unittest.TestCase):
+
+    def test_get_points(self):
+        points = sweep.get_points({'interest_rate': [.04, .05], 'div_amount': ['0.40 1.00', '0.20 1.20']})
+        self.assertEqual(points, [dict(interest_rate=.04, div_amount='0.40 1.00'),
+                                  dict(interest_rate=.04, div_amount='0.20 1.20'),
+                                  dict(interest_rate=.05, div_amount='0.40 1.00'),
+                                  dict(interest_rate=.05, div_amount='0.20 1.20')])
+        self.assertEqual(sweep.get_points({}), [{}])
+
+    def test_split_overrides(self):
+        config, bounds = sweep.split_overrides(dict(margin_ratio=.4, gamma_hi=.01, aggression_lo=.05))
+
+        self.assertEqual(config, dict(margin_ratio=.4))
+        self.assertEqual(bounds.gamma, (simulator.GAMMA_LO, .01))
+        self.assertEqual(bounds.aggression, (.05, simulator.AGG_HI))
+        self.assertEqual(bounds.alpha, (simulator.ALPHA_LO, simulator.ALPHA_HI))
+
+    def test_run_sweep(self):
+        grid = {'interest_rate': [.04, .05], 'gamma_hi': [.01]}
+        summary, paths = sweep.run_sweep(grid, seeds=2, num_agents=60, num_rounds=5, max_workers=1)
+
+        self.assertEqual(len(summary), 4)
+        self.assertEqual(list(summary['point']), [0, 0, 1, 1])
+        self.assertEqual(list(summary['seed']), [0, 1, 0, 1])
+        self.assertEqual(list(summary['interest_rate']), [.04, .04, .05, .05])
+        self.assertIn('rad', summary.columns)
+
+        # One row per price, starting with the initial price
+        self.assertEqual(len(paths), 4 * 6)
+        run = paths[(paths['point'] == 1) & (paths['seed'] == 1)]
+        self.assertEqual(list(run['round']), list(range(6)))
+        self.assertEqual(run['price'].iloc[0], 14)
+        self.assertEqual(run['price'].iloc[-1], summary['final_price'].iloc[3])
+
+        # The same seed gives the same run
+        again, _ = sweep.run_sweep(grid, seeds=2, num_agents=60, num_rounds=5, max_workers=1)
+        pd.testing.assert_frame_equal(again, summary)
+
+    def test_write_table_csv(self):
+        df = pd.DataFrame(dict(point=[0, 1], price=[14., 15.]))
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(pd.DataFrame, 'to_parquet', side_effect=ImportError):
+            path = sweep.write_table(df, os.path.join(tmp, 'summary'))
+            self.assertTrue(path.endswith('summary.csv'))
+            pd.testing.assert_frame_equal(pd.read_csv(path), df)
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+from rounds import trigger
+from rounds.trigger import Hub
+
+
+class FakeSocket:
+
+    def __init__(self, delay=0, error=None):
+        self.delay = delay
+        self.error = error
+        self.sent = []
+        self.closed = False
+
+    async def send(self, data):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.sent.append(json.loads(data))
+
+    async def close(self):
+        self.closed = True
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(.01)
+
+
+# noinspection DuplicatedCode
+class TestHub(unittest.TestCase):
+
+    def test_send_before_start(self):
+        socket = FakeSocket()
+
+        async def go():
+            hub = Hub(queue_size=2)
+            self.assertFalse(hub.send({'n': 0}))
+            self.assertFalse(hub.send({'n': 1}))
+            self.assertFalse(hub.send({'n': 2}))
+            hub.connect(socket)
+            hub.start()
+            await settle()
+
+        # The messages sent before the start are delivered once it starts; only the most recent are held
+        run(go())
+        self.assertEqual([m['n'] for m in socket.sent], [1, 2])
+
+    def test_targeted_sends(self):
+        async def go():
+            hub = Hub()
+            hub.start()
+            a, b, c = FakeSocket(), FakeSocket(), FakeSocket()
+            conn_a = hub.connect(a)
+            conn_b = hub.connect(b)
+            hub.connect(c)
+            hub.register(conn_a, 'P1', 'S1')
+            hub.register(conn_b, 'P2', 'S1')
+
+            hub.deliver({'n': 1}, code='P1')
+            hub.deliver({'n': 2}, session_code='S1')
+            hub.deliver({'n': 3})
+            await settle()
+            return hub, a, b, c
+
+        hub, a, b, c = run(go())
+        self.assertEqual(a.sent, [{'n': 1}, {'n': 2}, {'n': 3}])
+        self.assertEqual(b.sent, [{'n': 2}, {'n': 3}])
+        self.assertEqual(c.sent, [{'n': 3}])
+        self.assertEqual(hub.counts(), dict(connections=3, participants=2, sessions={'S1': 2}))
+
+    def test_disconnect_cleans_up(self):
+        async def go():
+            hub = Hub()
+            conn = hub.connect(FakeSocket())
+            hub.register(conn, 'P1', 'S1')
+            hub.disconnect(conn)
+            await settle()
+            return hub, conn
+
+        hub, conn = run(go())
+        self.assertEqual(hub.counts(), dict(connections=0, participants=0, sessions={}))
+        self.assertTrue(conn.writer.cancelled())
+
+    def test_reregister(self):
+        async def go():
+            hub = Hub()
+            conn = hub.connect(FakeSocket())
+            hub.register(conn, 'P1', 'S1')
+            hub.register(conn, 'P2', 'S2')
+            return hub
+
+        hub = run(go())
+        self.assertEqual(set(hub.by_code), {'P2'})
+        self.assertEqual(set(hub.by_session), {'S2'})
+
+    def test_slow_and_closed_dropped(self):
+        async def go():
+            hub = Hub(queue_size=2, timeout=.05)
+            hub.start()
+            slow, closed, ok = FakeSocket(delay=1), FakeSocket(error=OSError()), FakeSocket()
+            for socket in (slow, closed, ok):
+                hub.connect(socket)
+            for n in range(4):
+                hub.deliver({'n': n})
+                await asyncio.sleep(.001)
+            await settle()
+            return hub, slow, ok
+
+        hub, slow, ok = run(go())
+        self.assertEqual([m['n'] for m in ok.sent], [0, 1, 2, 3])
+        self.assertEqual([c.websocket for c in hub.connections], [ok])
+        self.assertTrue(slow.closed)
+
+    def test_send_from_other_thread(self):
+        socket = FakeSocket()
+
+        async def go():
+            hub = Hub()
+            hub.start()
+            hub.connect(socket)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, hub.send, {'round': 1})
+            await loop.run_in_executor(None, hub.send, {'round': 2})
+            await settle()
+
+        run(go())
+        self.assertEqual(socket.sent, [{'round': 1}, {'round': 2}])
+
+
+class TestStartThread(unittest.TestCase):
+
+    def tearDown(self):
+        trigger._thread = None
+
+    @patch('rounds.trigger.Thread')
+    def test_start_thread_once(self, thread_mock):
+        # Importing the module does not start the thread; the app starts it when it is needed
+        trigger._thread = None
+        self.assertIs(trigger.start_thread(), thread_mock.return_value)
+        self.assertIs(trigger.start_thread(), thread_mock.return_value)
+        thread_mock.assert_called_once_with(target=trigger.signal_thread, daemon=True)
+        thread_mock.return_value.start.assert_called_once_with()
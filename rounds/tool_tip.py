@@ -98,7 +98,7 @@ def get_tool_tip_data(obj):
     variables['float'] = ensure_group(obj).float
     float_ratio_cap = scf.get_float_ratio_cap(obj)
     float_ratio_blurb = ''
-    if float_ratio_cap:
+    if float_ratio_cap and scf.is_short_allowed(obj):
         float_ratio_blurb = """<p>Short sells will be limited to ensure that no more than {float} shares
                         are shorted.</p>""".format(**variables)
     variables['float_ratio_blurb'] = float_ratio_blurb
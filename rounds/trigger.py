@@ -1,35 +1,169 @@
 import asyncio
-import itertools
+from collections import defaultdict, deque
 import json
 import websockets
-from threading import Thread
+from threading import Lock, Thread
 import os
 
-from rounds import Player
 
-SOCKETS = []
+# Seconds to wait for a socket to take a message before it is dropped
+SEND_TIMEOUT = float(os.getenv('SSE_SIGNAL_TIMEOUT', '2'))
+# Messages that can wait for a socket before it is considered too slow and dropped
+SEND_QUEUE_SIZE = int(os.getenv('SSE_SIGNAL_QUEUE_SIZE', '32'))
 
-def register_bio_user(code):
-    #for p in Player.filter():
-    print(f"Got it: {code}")
 
-async def handler(websocket):
-    SOCKETS.append(websocket)
-    print(websocket)
-    while True:
-        message = await websocket.recv()
-        msg = json.loads(message)
-        print(msg)
-        type = msg.get("type")
+class Connection:
+    """
+    A connected socket.  Messages for it wait in its own bounded queue and are written by its own task,
+    so a slow client only holds up itself.
+    """
+
+    def __init__(self, websocket, queue_size=SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.code = None
+        self.session_code = None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.writer = None
+
+    def __str__(self):
+        return f"Connection: {self.websocket}; Code: {self.code}; Session: {self.session_code}"
+
+
+class Hub:
+    """
+    The connected sockets, indexed by participant code and session code once they register.
+    All the bookkeeping happens on the websocket thread's event loop; send can be called from any thread.
+    Messages sent before the loop is running are held, the most recent queue_size of them, and delivered
+    when it starts.
+    """
+
+    def __init__(self, queue_size=SEND_QUEUE_SIZE, timeout=SEND_TIMEOUT):
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.loop = None
+        self.held = deque(maxlen=queue_size)
+        self.lock = Lock()
+        self.connections = set()
+        self.by_code = defaultdict(set)
+        self.by_session = defaultdict(set)
+
+    def start(self):
+        """
+        Must be called from the running event loop.  Delivers the messages sent before it was called.
+        """
+        with self.lock:
+            self.loop = asyncio.get_running_loop()
+            held = list(self.held)
+            self.held.clear()
+        for args in held:
+            self.loop.call_soon(self.deliver, *args)
+
+    def connect(self, websocket):
+        conn = Connection(websocket, queue_size=self.queue_size)
+        conn.writer = asyncio.get_running_loop().create_task(self.write(conn))
+        self.connections.add(conn)
+        return conn
+
+    def register(self, conn, code, session_code=None):
+        self.unindex(conn)
+        conn.code = code
+        conn.session_code = session_code
+        if code:
+            self.by_code[code].add(conn)
+        if session_code:
+            self.by_session[session_code].add(conn)
+
+    def unindex(self, conn):
+        for index, key in ((self.by_code, conn.code), (self.by_session, conn.session_code)):
+            conns = index.get(key)
+            if conns is not None:
+                conns.discard(conn)
+                if not conns:
+                    del index[key]
+
+    def disconnect(self, conn):
+        if conn not in self.connections:
+            return
+        self.connections.discard(conn)
+        self.unindex(conn)
+        if conn.writer is not None and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+
+    async def write(self, conn):
+        try:
+            while True:
+                data = await conn.queue.get()
+                await asyncio.wait_for(conn.websocket.send(data), self.timeout)
+        except (asyncio.TimeoutError, websockets.ConnectionClosed, OSError) as e:
+            print(f"dropping {conn}: {e!r}")
+            self.disconnect(conn)
 
-        if type == 'register':
-            part_code = msg.get("code")
-            register_bio_user(part_code)
+    def get_targets(self, code=None, session_code=None):
+        if code is not None:
+            return self.by_code.get(code, ())
+        if session_code is not None:
+            return self.by_session.get(session_code, ())
+        return self.connections
 
+    def deliver(self, msg, code=None, session_code=None):
+        """
+        Queue a message on each target connection.  Runs on the event loop.  A connection whose queue
+        is full is not keeping up and is closed.
+        """
+        data = json.dumps(msg)
+        for conn in list(self.get_targets(code=code, session_code=session_code)):
+            self.put(conn, data)
+
+    def put(self, conn, data):
+        try:
+            conn.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            print(f"dropping {conn}: send queue full")
+            self.disconnect(conn)
+            asyncio.get_running_loop().create_task(conn.websocket.close())
+
+    def send(self, msg, code=None, session_code=None):
+        """
+        Send a message to the participant with the code, to everyone registered for the session,
+        or to every connection.  Safe to call from any thread; does not wait for the message to be sent.
+        @return: False if the hub is not running yet, in which case the message is held until it starts.
+        """
+        with self.lock:
+            if self.loop is None:
+                self.held.append((msg, code, session_code))
+                return False
+        self.loop.call_soon_threadsafe(self.deliver, msg, code, session_code)
+        return True
+
+    def counts(self):
+        return dict(connections=len(self.connections),
+                    participants=len(self.by_code),
+                    sessions={s: len(conns) for s, conns in list(self.by_session.items())})
+
+
+HUB = Hub()
+
+
+async def handler(websocket):
+    conn = HUB.connect(websocket)
+    try:
+        async for message in websocket:
+            msg = json.loads(message)
+            type = msg.get("type")
+
+            if type == 'register':
+                HUB.register(conn, msg.get("code"), msg.get("session"))
+            elif type == 'status':
+                HUB.put(conn, json.dumps(dict(type='status', **HUB.counts())))
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        HUB.disconnect(conn)
 
 
 async def main():
     async with websockets.serve(handler, "", port=int(os.environ["PORT"])):
+        HUB.start()
         await asyncio.Future() # run Forever
 
 
@@ -39,7 +173,21 @@ def signal_thread():
     print("finishing signal_thread")
 
 
-_t = Thread(target=signal_thread)
-_t.setDaemon(True)
-_t.start()
-print(f"started thread in {__name__}")
+_thread = None
+_thread_lock = Lock()
+
+
+def start_thread():
+    """
+    Start the websocket thread unless it is already running.  The app starts it when a session is created
+    or a round starts, rather than on import, so that scripts using the market code (e.g.
+    bots/simulator.py) do not open the port.
+    @return: the thread
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = Thread(target=signal_thread, daemon=True)
+            _thread.start()
+            print(f"started thread in {__name__}")
+    return _thread
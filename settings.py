@@ -102,6 +102,8 @@ SESSION_CONFIG_DEFAULTS = dict(
     margin_target_ratio=.6,
     auto_trans_delay=0,
     float_ratio_cap=1.0,
+    allow_short=False,
+    clearing_workers=0,
 
     endow_stock='0 2 4',
     endow_worth=184.0,
@@ -182,7 +184,8 @@ elif environ.get('MTURK_HIT_TYPE') == 'EXP':
         qualification_requirements=[]
         # grant_qualification_id='YOUR_QUALIFICATION_ID_HERE', # to prevent retakes
     )
-PARTICIPANT_FIELDS = ['PART_ID', 'CONSENT', 'CONSENT_BUTTON_CLICKED', 'MARKET_PAYMENT', 'FORECAST_PAYMENT', 'finished']
+PARTICIPANT_FIELDS = ['PART_ID', 'CONSENT', 'CONSENT_BUTTON_CLICKED', 'MARKET_PAYMENT', 'FORECAST_PAYMENT', 'FORECAST_TOTAL',
+                      'MARKET_EQUITY', 'finished']
 SESSION_FIELDS = ['prolific_completion_url']
 
 # ISO-639 code